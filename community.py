@@ -9,8 +9,10 @@ Community instance.
 """
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict, OrderedDict
+from heapq import heapify, heappush, heappop
 from itertools import islice, groupby
 import logging
+from marshal import dumps, loads
 from math import ceil
 from random import random, Random, randint, shuffle, uniform
 from time import time
@@ -22,22 +24,26 @@ from twisted.python.threadable import isInIOThread
 
 from .authentication import NoAuthentication, MemberAuthentication, DoubleMemberAuthentication
 from .bloomfilter import BloomFilter
-from .candidate import Candidate, WalkCandidate
+from .candidate import Candidate, WalkCandidate, LoopbackCandidate
 from .conversion import BinaryConversion, DefaultConversion, Conversion
 from .destination import CommunityDestination, CandidateDestination
 from .distribution import (SyncDistribution, GlobalTimePruning, LastSyncDistribution, DirectDistribution,
                            FullSyncDistribution)
 from .exception import ConversionNotFoundException, MetaNotFoundException
+from .iblt import InvertibleBloomLookupTable
 from .member import DummyMember, Member
-from .message import (BatchConfiguration, Message, Packet, DropMessage, DelayMessageByProof,
+from .message import (BatchConfiguration, Message, Packet, DropMessage, DropMessageByDuplicate, DelayMessageByProof,
                       DelayMessageByMissingMessage, DropPacket, DelayPacket, DelayMessage)
 from .payload import (AuthorizePayload, RevokePayload, UndoPayload, DestroyCommunityPayload, DynamicSettingsPayload,
                       IdentityPayload, MissingIdentityPayload, IntroductionRequestPayload, IntroductionResponsePayload,
                       PunctureRequestPayload, PuncturePayload, MissingMessagePayload, MissingSequencePayload,
-                      MissingProofPayload, SignatureRequestPayload, SignatureResponsePayload)
-from .requestcache import RequestCache, SignatureRequestCache, IntroductionRequestCache
+                      MissingProofPayload, SignatureRequestPayload, SignatureResponsePayload, SyncDigestPayload)
+from .requestcache import (RequestCache, SignatureRequestCache, IntroductionRequestCache, MissingIdentityCache,
+                           MissingMessageCache)
 from .resolution import PublicResolution, LinearResolution, DynamicResolution
-from .statistics import CommunityStatistics
+from .statistics import CommunityStatistics, PhaseTimer
+from .synccontroller import SyncController
+from .syncdigest import SyncDigest, RangeDigests, get_bucket_time_high, get_ranges, SYNC_DIGEST_BUCKET_SIZE
 from .taskmanager import TaskManager
 from .timeline import Timeline
 from .util import runtime_duration_warning, attach_runtime_statistics, deprecated, is_valid_address
@@ -49,7 +55,16 @@ FAST_WALKER_MAX_NEW_ELIGIBLE_CANDIDATES = 10
 FAST_WALKER_STEPS = 15
 FAST_WALKER_STEP_INTERVAL = 2.0
 PERIODIC_CLEANUP_INTERVAL = 5.0
+DELAYED_TIMEOUT = 10.0
+MISSING_REQUEST_WINDOW = 0.1
+MISSING_MESSAGE_BATCH_SIZE = 100
 TAKE_STEP_INTERVAL = 5
+# maximum number of packets, on average, in one sync reconciliation table, see _dispersy_claim_sync_reconciliation
+SYNC_RECONCILIATION_ITEMS = 4096
+# maximum number of packets that a received sync reconciliation table may select, larger requests are not answered
+SYNC_RECONCILIATION_MAX_ITEMS = 2 * SYNC_RECONCILIATION_ITEMS
+# maximum number of times that the slices are split in halves when the tables are unable to list the difference
+SYNC_RECONCILIATION_MAX_SPLIT = 5
 
 logger = logging.getLogger(__name__)
 
@@ -280,16 +295,45 @@ class Community(TaskManager):
 
         self._delayed_value = defaultdict(list)
 
+        # WILDCARDS:COUNT dictionary, where WILDCARDS is a tuple with the positions of the None components of the
+        # keys in _delayed_key.  Used to look up all keys matching a received key without scanning _delayed_key
+        self._delayed_wildcards = defaultdict(int)
+
+        # (TIMESTAMP, DELAYED) heap used to expire delayed packets/messages in order.  Entries of delays that have
+        # already been resumed are skipped when they reach the top
+        self._delayed_timeouts = []
+
+        # memory accounting for the delayed packets/messages.  _delayed_sources is a SOCK_ADDR:{DELAYED:BYTES}
+        # dictionary where the inner OrderedDict keeps the delays from one source in the order they were received
+        self._delayed_bytes = 0
+        self._delayed_sources = defaultdict(OrderedDict)
+        self._delayed_source = {}
+
+        # (-COUNT, SOCK_ADDR) heap used by the fair eviction policy to find the source with the most delays.  An entry
+        # is pushed whenever the count of a source changes, entries that no longer match the count are skipped
+        self._delayed_largest = []
+
+        # SOCK_ADDR:(WINDOW_START, COUNT) dictionary used to rate limit the requests for missing data
+        self._delayed_requests = {}
+
+        # SOCK_ADDR:(CANDIDATE, MIDS, {MEMBER:GLOBAL_TIMES}) dictionary with the missing identities and messages
+        # that will be requested when the current coalescing window ends
+        self._missing_requests = {}
+
         self.meta_message_cache = {}
         self._meta_messages = {}
 
         self._conversions = []
 
         self._nrsyncpackets = 0
+        self._sync_reconciliation_round = 0
+        self._sync_reconciliation_split = 0
 
         self._do_pruning = False
 
         self._sync_cache_skip_count = 0
+        self._sync_controller = None
+        self._sync_digest = None
 
         self._acceptable_global_time_deadline = 0.0
 
@@ -306,6 +350,7 @@ class Community(TaskManager):
     def initialize(self):
         assert isInIOThread()
         self._logger.info("initializing:  %s", self.get_classification())
+        timer = PhaseTimer(self._statistics, u"startup")
         self._logger.debug("master member: %s %s", self._master_member.mid.encode("HEX"),
             "" if self._master_member.public_key else " (no public key available)")
 
@@ -334,6 +379,7 @@ class Community(TaskManager):
                 (self._master_member.database_id,)).next()
 
         self._logger.debug("database id:   %d", self._database_id)
+        timer.phase(u"community")
 
         self._logger.debug("my member:     %s", self._my_member.mid.encode("HEX"))
         assert self._my_member.public_key, [self._database_id, self._my_member.database_id, self._my_member.public_key]
@@ -382,6 +428,7 @@ class Community(TaskManager):
         if __debug__:
             assert len(self._conversions) > 0, len(self._conversions)
             assert all(isinstance(conversion, Conversion) for conversion in self._conversions), [type(conversion) for conversion in self._conversions]
+        timer.phase(u"meta_messages")
 
         # the global time.  zero indicates no messages are available, messages must have global
         # times that are higher than zero.
@@ -391,15 +438,19 @@ class Community(TaskManager):
         assert isinstance(self._global_time, (int, long))
         self._acceptable_global_time_cache = self._global_time
         self._logger.debug("global time:   %d", self._global_time)
+        timer.phase(u"global_time")
 
         # the sequence numbers
         for current_sequence_number, name in self._dispersy.database.execute(u"SELECT MAX(sync.sequence), meta_message.name FROM sync, meta_message WHERE sync.meta_message = meta_message.id AND sync.member = ? AND meta_message.community = ? GROUP BY meta_message.name", (self._my_member.database_id, self.database_id)):
             if current_sequence_number:
                 self._meta_messages[name].distribution._current_sequence_number = current_sequence_number
+        timer.phase(u"sequence_numbers")
 
         # sync range bloom filters
         self._sync_cache = None
         self._sync_cache_skip_count = 0
+        self._sync_controller = SyncController(self)
+        self._sync_digest = SyncDigest(self)
         if __debug__:
             b = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate)
             self._logger.debug("sync bloom:    size: %d;  capacity: %d;  error-rate: %f",
@@ -413,6 +464,7 @@ class Community(TaskManager):
         # initial timeline.  the timeline will keep track of member permissions
         self._timeline = Timeline(self)
         self._initialize_timeline()
+        timer.phase(u"timeline")
 
         # random seed, used for sync range
         self._random = Random()
@@ -440,6 +492,7 @@ class Community(TaskManager):
         except StopIteration:
             # we haven't do it now
             self.create_identity()
+        timer.phase(u"identity")
 
         # check/sanity check the database
         self.dispersy_check_database()
@@ -449,6 +502,7 @@ class Community(TaskManager):
                 self.dispersy.sanity_check(self)
             except ValueError:
                 self._logger.exception("sanity check fail for %s", self)
+        timer.phase(u"check_database")
 
         # start walker, if needed
         if self.dispersy_enable_candidate_walker:
@@ -524,11 +578,18 @@ class Community(TaskManager):
                 self._logger.warning("unable to load permissions from database [could not obtain %s]", name)
 
         if mapping:
-            for packet, in list(self._dispersy.database.execute(u"SELECT packet FROM sync WHERE meta_message IN (" + ", ".join("?" for _ in mapping) + ") ORDER BY global_time, packet",
-                                                                mapping.keys())):
+            meta_message_ids = mapping.keys()
+            last_packet_id = self._load_timeline_snapshot(meta_message_ids) if self.dispersy_enable_timeline_snapshot else 0
+
+            # replay the permission packets that are not part of the snapshot
+            replayed = 0
+            for packet_id, packet in list(self._dispersy.database.execute(u"SELECT id, packet FROM sync WHERE meta_message IN (" + ", ".join("?" for _ in mapping) + ") AND id > ? ORDER BY global_time, packet",
+                                                                          meta_message_ids + [last_packet_id])):
+                replayed += 1
                 message = self._dispersy.convert_packet_to_message(str(packet), self, verify=False)
                 if message:
                     self._logger.debug("processing %s", message.name)
+                    message.packet_id = packet_id
                     mapping[message.database_id]([message], initializing=True)
                 else:
                     # TODO: when a packet conversion fails we must drop something, and preferably check
@@ -536,6 +597,54 @@ class Community(TaskManager):
                     self._logger.error("invalid message in database [%s; %s]\n%s",
                                        self.get_classification(), self.cid.encode("HEX"), str(packet).encode("HEX"))
 
+            if replayed and self.dispersy_enable_timeline_snapshot:
+                self._store_timeline_snapshot(meta_message_ids)
+
+    def _load_timeline_snapshot(self, meta_message_ids):
+        """
+        Restores the timeline from the snapshot in the database.
+
+        Returns the highest packet id that is part of the restored snapshot, or 0 when there is no usable
+        snapshot.  A snapshot is not usable when permission packets that it covers were removed from the database,
+        i.e. when the number of permission packets or the highest packet id differs from the snapshot.
+        """
+        try:
+            last_packet_id, count, snapshot = self._dispersy.database.execute(
+                u"SELECT sync, count, snapshot FROM timeline_snapshot WHERE community = ?", (self._database_id,)).next()
+        except StopIteration:
+            return 0
+
+        current_count, current_last_packet_id = self._dispersy.database.execute(
+            u"SELECT COUNT(*), MAX(id) FROM sync WHERE meta_message IN (" + ", ".join("?" for _ in meta_message_ids) + ") AND id <= ?",
+            meta_message_ids + [last_packet_id]).next()
+        if current_count != count or current_last_packet_id != last_packet_id:
+            self._logger.warning("ignoring outdated timeline snapshot [%d packets up to %s, expected %d up to %d]",
+                                 current_count, current_last_packet_id, count, last_packet_id)
+            return 0
+
+        try:
+            self._timeline.load_snapshot(loads(str(snapshot)))
+        except (ValueError, EOFError, TypeError, IndexError, KeyError, MetaNotFoundException):
+            self._logger.exception("ignoring invalid timeline snapshot")
+            return 0
+
+        self._logger.debug("restored timeline snapshot up to packet %d", last_packet_id)
+        return last_packet_id
+
+    def _store_timeline_snapshot(self, meta_message_ids):
+        """
+        Stores a snapshot of the timeline in the database.
+
+        Must only be called when the timeline contains exactly the permission packets in the database.
+        """
+        last_packet_id, count = self._dispersy.database.execute(
+            u"SELECT MAX(id), COUNT(*) FROM sync WHERE meta_message IN (" + ", ".join("?" for _ in meta_message_ids) + ")",
+            meta_message_ids).next()
+        self._dispersy.database.execute(
+            u"INSERT OR REPLACE INTO timeline_snapshot (community, sync, count, snapshot) VALUES (?, ?, ?, ?)",
+            (self._database_id, last_packet_id, count, buffer(dumps(self._timeline.get_snapshot()))))
+        self._logger.debug("stored timeline snapshot up to packet %d", last_packet_id)
+
     @property
     def dispersy_auto_load(self):
         """
@@ -571,6 +680,18 @@ class Community(TaskManager):
         """
         return True
 
+    @property
+    def dispersy_enable_timeline_snapshot(self):
+        """
+        Enable the timeline snapshot.
+
+        When True is returned, the timeline is restored from a snapshot stored in the database and only the
+        permission packets that were stored after this snapshot are given to on_authorize, on_revoke, and
+        on_dynamic_settings while initializing.  Communities that only update the timeline in these methods may
+        return True.  The timeline snapshot is disabled by default.
+        """
+        return False
+
     @property
     def dispersy_enable_fast_candidate_walker(self):
         """
@@ -596,6 +717,17 @@ class Community(TaskManager):
         """
         return self.dispersy_enable_candidate_walker
 
+    @property
+    def dispersy_enable_response_signature_reuse(self):
+        """
+        Reuse the signature of byte-identical dispersy-introduction-response messages.
+
+        When True is returned, a dispersy-introduction-response that is byte-identical to one created earlier with
+        the same global time, i.e. an answer to a retransmitted dispersy-introduction-request, is not signed again.
+        @rtype: bool
+        """
+        return False
+
     @property
     def dispersy_enable_bloom_filter_sync(self):
         """
@@ -667,12 +799,36 @@ class Community(TaskManager):
 
     @property
     def dispersy_sync_bloom_filter_strategy(self):
+        """
+        The method that creates the sync part of outgoing dispersy-introduction-request messages.
+
+        Available strategies are _dispersy_claim_sync_bloom_filter_largest, _dispersy_claim_sync_bloom_filter_modulo,
+        _dispersy_claim_sync_reconciliation, and _dispersy_claim_sync_digest.
+        """
         return self._dispersy_claim_sync_bloom_filter_largest
 
     @property
     def dispersy_sync_skip_enable(self):
         return True  # _sync_skip_
 
+    @property
+    def dispersy_sync_adaptive_enable(self):
+        """
+        When True the size of the sync bloom filters and the probability that a sync is skipped are chosen from the
+        observed sync yield, see SyncController.  Otherwise the sync bloom filters are always
+        dispersy_sync_bloom_filter_bits in size and the static skip curve is used.
+        @rtype: bool
+        """
+        return True
+
+    @property
+    def sync_controller(self):
+        return self._sync_controller
+
+    @property
+    def sync_digest(self):
+        return self._sync_digest
+
     @property
     def dispersy_sync_cache_enable(self):
         return True  # _cache_enable_
@@ -684,6 +840,11 @@ class Community(TaskManager):
         if __debug__:
             cached = 0
 
+        if self.dispersy_sync_adaptive_enable:
+            for message in messages:
+                if message.candidate and not isinstance(message.candidate, LoopbackCandidate):
+                    self._sync_controller.on_message(message.candidate, len(message.packet), False)
+
         if self._sync_cache:
             cache = self._sync_cache
             for message in messages:
@@ -710,23 +871,33 @@ class Community(TaskManager):
         """
         Returns a (time_low, time_high, modulo, offset, bloom_filter) or None.
         """
-        if self._sync_cache:
+        adaptive = self.dispersy_sync_adaptive_enable
+        candidate = request_cache.helper_candidate
+        # a dispersy-sync-digest reported ranges that differ from CANDIDATE, these are neither skipped nor replaced by
+        # the cached bloom filter, see _dispersy_claim_sync_digest
+        descend = self._sync_digest.has_differences(candidate)
+
+        if self._sync_cache and not descend:
             if self._sync_cache.responses_received > 0:
                 if self.dispersy_sync_skip_enable:
                     # We have received data, reset skip counter
                     self._sync_cache_skip_count = 0
 
-                if self.dispersy_sync_cache_enable and self._sync_cache.times_used < 100:
+                if (self.dispersy_sync_cache_enable and self._sync_cache.times_used < 100 and
+                        (not adaptive or
+                         self._sync_cache.bloom_filter.size >= self._sync_controller.get_bloom_filter_bits(candidate))):
                     self._statistics.sync_bloom_reuse += 1
                     self._statistics.sync_bloom_send += 1
                     cache = self._sync_cache
                     cache.times_used += 1
                     cache.responses_received = 0
-                    cache.candidate = request_cache.helper_candidate
+                    cache.candidate = candidate
+                    if adaptive:
+                        self._sync_controller.on_bloom_filter(candidate, cache.bloom_filter.size // 8)
 
                     self._logger.debug("%s reuse #%d (packets received: %d; %s)",
                                        self._cid.encode("HEX"), cache.times_used, cache.responses_received,
-                                       hex(cache.bloom_filter._filter))
+                                       cache.bloom_filter.bytes.encode("HEX"))
                     return cache.time_low, cache.time_high, cache.modulo, cache.offset, cache.bloom_filter
 
             elif self._sync_cache.times_used == 0:
@@ -736,19 +907,30 @@ class Community(TaskManager):
                                    self._sync_cache.responses_received)
                 self._sync_cache_skip_count = min(self._sync_cache_skip_count + 1, self._SKIP_STEPS)
 
-        if (self.dispersy_sync_skip_enable and
-            self._sync_cache_skip_count and
-                random() < self._SKIP_CURVE_STEPS[self._sync_cache_skip_count - 1]):
-                # Lets skip this one
-                self._logger.debug("skip: random() was <%f", self._SKIP_CURVE_STEPS[self._sync_cache_skip_count - 1])
-                self._statistics.sync_bloom_skip += 1
-                self._sync_cache = None
-                return None
+        skip_probability = 0.0
+        if self.dispersy_sync_skip_enable and not descend:
+            if adaptive:
+                skip_probability = self._sync_controller.get_skip_probability(candidate)
+            elif self._sync_cache_skip_count:
+                skip_probability = self._SKIP_CURVE_STEPS[self._sync_cache_skip_count - 1]
+
+        if skip_probability and random() < skip_probability:
+            # Lets skip this one
+            self._logger.debug("skip: random() was <%f", skip_probability)
+            self._statistics.sync_bloom_skip += 1
+            self._sync_cache = None
+            return None
 
         sync = self.dispersy_sync_bloom_filter_strategy(request_cache)
         if sync:
-            self._sync_cache = SyncCache(*sync)
-            self._sync_cache.candidate = request_cache.helper_candidate
+            if isinstance(sync[4], RangeDigests):
+                # digests are never reused, the ranges to request next depend on the reply
+                self._sync_cache = None
+            else:
+                self._sync_cache = SyncCache(*sync)
+                self._sync_cache.candidate = candidate
+            if adaptive:
+                self._sync_controller.on_bloom_filter(candidate, sync[4].size // 8)
             self._statistics.sync_bloom_new += 1
             self._statistics.sync_bloom_send += 1
             self._logger.debug("%s new sync bloom (%d/%d~%.2f)", self._cid.encode("HEX"),
@@ -757,6 +939,14 @@ class Community(TaskManager):
 
         return sync
 
+    def _get_sync_bloom_filter_bits(self, request_cache):
+        """
+        Returns the size in bits of the bloom filter that the sync strategies create for REQUEST_CACHE.
+        """
+        if self.dispersy_sync_adaptive_enable:
+            return self._sync_controller.get_bloom_filter_bits(request_cache.helper_candidate)
+        return self.dispersy_sync_bloom_filter_bits
+
     # instead of pivot + capacity, compare pivot - capacity and pivot + capacity to see which globaltime range is largest
     @runtime_duration_warning(0.5)
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name}")
@@ -770,7 +960,7 @@ class Community(TaskManager):
                 t2 = time()
 
             acceptable_global_time = self.acceptable_global_time
-            bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+            bloom = BloomFilter(self._get_sync_bloom_filter_bits(request_cache), self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
             capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
             desired_mean = self.global_time / 2.0
@@ -908,7 +1098,7 @@ class Community(TaskManager):
     def _dispersy_claim_sync_bloom_filter_modulo(self, request_cache):
         syncable_messages = u", ".join(unicode(meta.database_id) for meta in self._meta_messages.itervalues() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32)
         if syncable_messages:
-            bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+            bloom = BloomFilter(self._get_sync_bloom_filter_bits(request_cache), self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
             capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
             self._nrsyncpackets = list(self._dispersy.database.execute(u"SELECT count(*) FROM sync WHERE meta_message IN (%s) AND undone = 0 LIMIT 1" % (syncable_messages)))[0][0]
@@ -932,6 +1122,115 @@ class Community(TaskManager):
             self._logger.debug("%s NOT syncing no syncable messages", self.cid.encode("HEX"))
         return (1, self.acceptable_global_time, 1, 0, BloomFilter(8, 0.1, prefix='\x00'))
 
+    @runtime_duration_warning(0.5)
+    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name}")
+    def _dispersy_claim_sync_reconciliation(self, request_cache):
+        """
+        Sync strategy that sends an InvertibleBloomLookupTable instead of a BloomFilter.
+
+        The size of the table does not depend on the number of packets that it contains, only on the size of the
+        difference that the receiver can list.  Hence a mostly converged community finds its missing packets using
+        far fewer bytes and rounds than with the bloom filter strategies.  The packets are divided over MODULO slices of
+        about SYNC_RECONCILIATION_ITEMS packets to bound the work of the receiver, the slices are visited in turn.
+
+        The receiver sends nothing when the difference is too large to be listed.  When the adaptive sync is enabled,
+        each full turn over the slices without new messages splits the slices in halves, up to
+        SYNC_RECONCILIATION_MAX_SPLIT times, and each round that lists only a few packets merges them again.
+
+        All members of the community must use a Dispersy version that supports sync reconciliation tables.
+        """
+        syncable_messages = u", ".join(unicode(meta.database_id) for meta in self._meta_messages.itervalues() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32)
+        if syncable_messages:
+            table = InvertibleBloomLookupTable(self._get_sync_bloom_filter_bits(request_cache), prefix=chr(int(random() * 256)))
+
+            self._nrsyncpackets = list(self._dispersy.database.execute(u"SELECT count(*) FROM sync WHERE meta_message IN (%s) AND undone = 0 LIMIT 1" % (syncable_messages)))[0][0]
+            modulo = max(1, int(ceil(self._nrsyncpackets / float(SYNC_RECONCILIATION_ITEMS))))
+            if self.dispersy_sync_adaptive_enable:
+                # the yield of the round that ends now
+                sync_yield = self._sync_controller.community_yield
+                if sync_yield.new_messages:
+                    if sync_yield.new_messages < table.get_capacity() // 4:
+                        self._sync_reconciliation_split = max(0, self._sync_reconciliation_split - 1)
+                elif (sync_yield.empty_rounds + 1) % (modulo << self._sync_reconciliation_split) == 0:
+                    self._sync_reconciliation_split = min(self._sync_reconciliation_split + 1, SYNC_RECONCILIATION_MAX_SPLIT)
+                modulo <<= self._sync_reconciliation_split
+            modulo = min(modulo, 2 ** 16 - 1)
+            offset = self._sync_reconciliation_round % modulo
+            self._sync_reconciliation_round += 1
+
+            table.add_keys(str(packet) for packet, in self._dispersy.database.execute(u"SELECT sync.packet FROM sync WHERE meta_message IN (%s) AND sync.undone = 0 AND (sync.global_time + ?) %% ? = 0" % syncable_messages, (offset, modulo)))
+
+            self._logger.debug("%s reconciling %d-%d, nr_packets = %d, cells = %d",
+                               self.cid.encode("HEX"), modulo, offset, self._nrsyncpackets, table.cells)
+
+            return (1, self.acceptable_global_time, modulo, offset, table)
+
+        else:
+            self._logger.debug("%s NOT syncing no syncable messages", self.cid.encode("HEX"))
+        return (1, self.acceptable_global_time, 1, 0, BloomFilter(8, 0.1, prefix='\x00'))
+
+    @runtime_duration_warning(0.5)
+    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name}")
+    def _dispersy_claim_sync_digest(self, request_cache):
+        """
+        Sync strategy that sends the digests of consecutive global time ranges instead of a BloomFilter.
+
+        The receiver replies with a dispersy-sync-digest listing the ranges whose digest differs from its own, see
+        SyncDigest.  Nothing else is sent when all ranges match, hence the sync of a converged community costs a few
+        hundred bytes regardless of the number of packets.  Each differing range is visited in a following request to
+        the same candidate: a range with no more packets than a bloom filter can hold, or that covers a single bucket,
+        is synced with a BloomFilter, a larger range is divided into ranges again.  on_sync_digest sends the
+        following request right away.
+
+        All members of the community must use a Dispersy version that supports sync digests.
+        """
+        if any(isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32 for meta in self._meta_messages.itervalues()):
+            candidate = request_cache.helper_candidate
+            time_range = self._sync_digest.pop_difference(candidate)
+            if time_range:
+                time_low, time_high = time_range
+                bloom = BloomFilter(self._get_sync_bloom_filter_bits(request_cache), self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+                capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
+                count = self._sync_digest.get_count(time_low, time_high)
+
+                # extend the range with the following differing ranges while the bloom filter can hold the packets
+                while count <= capacity:
+                    following = self._sync_digest.peek_difference(candidate)
+                    if not (following and following[0] > time_high):
+                        break
+                    extended = self._sync_digest.get_count(time_low, following[1])
+                    if extended > capacity:
+                        break
+                    self._sync_digest.pop_difference(candidate)
+                    time_high, count = following[1], extended
+
+                if count <= capacity or time_low // SYNC_DIGEST_BUCKET_SIZE == time_high // SYNC_DIGEST_BUCKET_SIZE:
+                    syncable_messages = u", ".join(unicode(meta.database_id) for meta in self._meta_messages.itervalues() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32)
+                    modulo = max(1, int(ceil(count / float(capacity))))
+                    offset = randint(0, modulo - 1)
+                    bloom.add_keys(str(packet) for packet, in self._dispersy.database.execute(u"SELECT sync.packet FROM sync WHERE meta_message IN (%s) AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) %% ? = 0" % syncable_messages, (time_low, time_high, offset, modulo)))
+
+                    self._logger.debug("%s syncing differing range [%d:%d] %%%d+%d, nr_packets = %d, capacity = %d",
+                                       self.cid.encode("HEX"), time_low, time_high, modulo, offset, count, capacity)
+                    self._statistics.sync_digest_descend += 1
+                    return (time_low, time_high, modulo, offset, bloom)
+
+            else:
+                # the range ends at a bucket boundary, see SyncDigest.get_digests
+                time_low, time_high = 1, min(get_bucket_time_high(self.acceptable_global_time), 2 ** 63 - 1)
+
+            ranges = get_ranges(time_low, time_high)
+            digests = RangeDigests(self._sync_digest.get_digests(ranges))
+            self._sync_digest.on_request(candidate, time_low, time_high, len(ranges))
+
+            self._logger.debug("%s sending %d digests for [%d:%d]", self.cid.encode("HEX"), len(ranges), time_low, time_high)
+            self._statistics.sync_digest_sent += 1
+            return (time_low, time_high, 1, 0, digests)
+
+        else:
+            self._logger.debug("%s NOT syncing no syncable messages", self.cid.encode("HEX"))
+        return (1, self.acceptable_global_time, 1, 0, BloomFilter(8, 0.1, prefix='\x00'))
+
     @property
     def dispersy_sync_response_limit(self):
         """
@@ -948,10 +1247,79 @@ class Community(TaskManager):
         """
         return 10 * 1024
 
+    @property
+    def dispersy_incoming_packet_rate(self):
+        """
+        The number of incoming packets per second that are accepted for this community, and the maximum burst.
+        Packets exceeding this rate are dropped before they are decoded.
+        @rtype: (float, int)
+        """
+        return (2500.0, 25000)
+
+    @property
+    def dispersy_incoming_packet_rate_per_candidate(self):
+        """
+        The number of incoming packets per second that are accepted from a single candidate in this community, and
+        the maximum burst.
+        @rtype: (float, int)
+        """
+        return (250.0, 5000)
+
     @property
     def dispersy_acceptable_global_time_range(self):
         return 10000
 
+    @property
+    def dispersy_delayed_max_count(self):
+        """
+        The maximum number of delayed packets and messages that are kept while waiting for missing data.
+        @rtype: int
+        """
+        return 5000
+
+    @property
+    def dispersy_delayed_max_bytes(self):
+        """
+        The maximum number of bytes that the delayed packets and messages may occupy.
+        @rtype: int
+        """
+        return 5 * 1024 * 1024
+
+    @property
+    def dispersy_delayed_max_count_per_candidate(self):
+        """
+        The maximum number of delayed packets and messages that are kept for a single candidate.
+        @rtype: int
+        """
+        return 500
+
+    @property
+    def dispersy_delayed_eviction_policy(self):
+        """
+        Selects which delayed packet or message is evicted when one of the delay limits is exceeded.
+
+        - u"oldest": evict the oldest delay
+        - u"fair": evict the oldest delay from the candidate that has the most delays
+        @rtype: unicode
+        """
+        return u"fair"
+
+    @property
+    def dispersy_delayed_request_limit(self):
+        """
+        The maximum number of requests for missing data that are sent to a single candidate per second.
+        @rtype: int
+        """
+        return 25
+
+    @property
+    def delayed_size(self):
+        """
+        The number of delayed packets and messages and the number of bytes they occupy.
+        @rtype: (int, int)
+        """
+        return len(self._delayed_value), self._delayed_bytes
+
     @property
     def cid(self):
         """
@@ -1091,6 +1459,10 @@ class Community(TaskManager):
                 # Check for messages that need to be pruned because the global time changed.
                 for meta in self._meta_messages.itervalues():
                     if isinstance(meta.distribution, SyncDistribution) and isinstance(meta.distribution.pruning, GlobalTimePruning):
+                         if self._sync_digest.loaded:
+                             self._sync_digest.invalidate(global_time for global_time, in self._dispersy.database.execute(
+                                 u"SELECT global_time FROM sync WHERE meta_message = ? AND global_time <= ?",
+                                 (meta.database_id, self._global_time - meta.distribution.pruning.prune_threshold)))
                          self._dispersy.database.execute(
                             u"DELETE FROM sync WHERE meta_message = ? AND global_time <= ?",
                             (meta.database_id, self._global_time - meta.distribution.pruning.prune_threshold))
@@ -1812,7 +2184,16 @@ class Community(TaskManager):
                                      CandidateDestination(),
                                      PuncturePayload(),
                                      self.check_puncture,
-                                     self.on_puncture)])
+                                     self.on_puncture),
+                             # the reply to a dispersy-introduction-request with sync digests that differ
+                             Message(self, u"dispersy-sync-digest",
+                                     NoAuthentication(),
+                                     PublicResolution(),
+                                     DirectDistribution(),
+                                     CandidateDestination(),
+                                     SyncDigestPayload(),
+                                     self.check_sync_digest,
+                                     self.on_sync_digest)])
 
         return messages
 
@@ -1893,6 +2274,8 @@ class Community(TaskManager):
 
         elif isinstance(drop, DropMessage):
             self._statistics.increase_msg_count(u"drop", u"drop_message:%s" % drop)
+            if self.dispersy_sync_adaptive_enable and candidate and isinstance(drop, DropMessageByDuplicate):
+                self._sync_controller.on_message(candidate, len(packet), True)
 
     def _delay(self, match_info, delay, packet, candidate):
         assert len(match_info) == 4, match_info
@@ -1903,6 +2286,14 @@ class Community(TaskManager):
         assert not match_info[3] or isinstance(match_info[3], list), type(match_info[3])
 
         send_request = False
+        source = candidate.sock_addr if candidate else None
+
+        if delay not in self._delayed_value:
+            heappush(self._delayed_timeouts, (delay.timestamp, delay))
+            self._delayed_sources[source][delay] = len(packet)
+            self._delayed_source[delay] = source
+            self._delayed_bytes += len(packet)
+            self._push_delayed_largest(source)
 
         # unwrap sequence number list
         seq_number_list = match_info[3] or [None]
@@ -1911,15 +2302,20 @@ class Community(TaskManager):
 
             # if we find a new key, then we need to send a request
             # if we did send a delay for this message that is
-            if (unwrapped_key not in self._delayed_key) and (delay not in self._delayed_value):
-                send_request = True
+            if unwrapped_key not in self._delayed_key:
+                if delay not in self._delayed_value:
+                    send_request = True
+                self._delayed_wildcards[tuple(i for i, k in enumerate(unwrapped_key) if k is None)] += 1
 
             self._delayed_key[unwrapped_key].append(delay)
             self._delayed_value[delay].append(unwrapped_key)
 
         if send_request:
-            delay.send_request(self, candidate)
-            self._statistics.increase_delay_msg_count(u"send")
+            if self._claim_delayed_request(source):
+                delay.send_request(self, candidate)
+                self._statistics.increase_delay_msg_count(u"send")
+            else:
+                self._statistics.increase_delay_msg_count(u"send_limited")
 
         self._logger.debug("delay a %d byte packet/message (%s) from %s", len(packet), delay, candidate)
         self._statistics.increase_delay_msg_count(u"received")
@@ -1932,6 +2328,54 @@ class Community(TaskManager):
             delay.delayed = packet
             delay.candidate = candidate
 
+        self._evict_delayed(source)
+
+    def _claim_delayed_request(self, source):
+        """
+        Returns True when another request for missing data may be sent to SOURCE.
+        """
+        now = time()
+        window_start, count = self._delayed_requests.get(source, (now, 0))
+        if now - window_start >= 1.0:
+            window_start, count = now, 0
+
+        if count < self.dispersy_delayed_request_limit:
+            self._delayed_requests[source] = (window_start, count + 1)
+            return True
+        return False
+
+    def _evict_delayed(self, source):
+        """
+        Evicts delayed packets/messages until the delay limits are met again.
+
+        When SOURCE exceeds its own quota its oldest delay is evicted, otherwise the victim is chosen using
+        dispersy_delayed_eviction_policy.
+        """
+        max_count = self.dispersy_delayed_max_count
+        max_bytes = self.dispersy_delayed_max_bytes
+        max_count_per_candidate = self.dispersy_delayed_max_count_per_candidate
+
+        while True:
+            if len(self._delayed_sources.get(source, ())) > max_count_per_candidate:
+                victim = next(iter(self._delayed_sources[source]))
+
+            elif len(self._delayed_value) > max_count or self._delayed_bytes > max_bytes:
+                if self.dispersy_delayed_eviction_policy == u"oldest":
+                    victim = None
+                    while victim not in self._delayed_value:
+                        _, victim = heappop(self._delayed_timeouts)
+                else:
+                    victim = next(iter(self._delayed_sources[self._peek_delayed_largest()]))
+
+            else:
+                break
+
+            self._logger.debug("evict %s, delay limits exceeded", victim)
+            self._remove_delayed(victim)
+            victim.on_timeout()
+            self._statistics.increase_delay_msg_count(u"evict")
+            self._statistics.increase_msg_count(u"drop", u"delay_evict:%s" % victim)
+
     def _resume_delayed(self, meta, messages):
         has_mid = isinstance(meta.authentication, (MemberAuthentication, DoubleMemberAuthentication))
         has_seq = isinstance(meta.distribution, FullSyncDistribution) and meta.distribution.enable_sequence_number
@@ -1943,8 +2387,16 @@ class Community(TaskManager):
         new_messages = defaultdict(set)
         new_packets = set()
         for received_key in received_keys:
-            for key in self._delayed_key.keys():
-                if all(k is None or k == rk for k, rk in zip(key, received_key)):
+            # a delayed key matches when all its components are either None or equal to the received key, hence
+            # replacing the None positions of each delayed key pattern in the received key gives the matching keys
+            for wildcards in self._delayed_wildcards.keys():
+                key = list(received_key)
+                for i in wildcards:
+                    key[i] = None
+                key = tuple(key)
+
+                if key in self._delayed_key:
+                    self._forget_delayed_key(key, wildcards)
                     for delayed in self._delayed_key.pop(key):
                         delayed_keys = self._delayed_value[delayed]
                         delayed_keys.remove(key)
@@ -1973,13 +2425,59 @@ class Community(TaskManager):
             self._delayed_key[key].remove(delayed)
             if len(self._delayed_key[key]) == 0:
                 del self._delayed_key[key]
+                self._forget_delayed_key(key)
 
         del self._delayed_value[delayed]
 
+        source = self._delayed_source.pop(delayed)
+        delays = self._delayed_sources[source]
+        self._delayed_bytes -= delays.pop(delayed)
+        if delays:
+            self._push_delayed_largest(source)
+        else:
+            del self._delayed_sources[source]
+
+    def _push_delayed_largest(self, source):
+        """
+        Records the current number of delays from SOURCE in the _delayed_largest heap.
+        """
+        heappush(self._delayed_largest, (-len(self._delayed_sources[source]), source))
+
+        if len(self._delayed_largest) > 2 * len(self._delayed_sources) + 16:
+            # drop the stale entries
+            self._delayed_largest = [(-len(delays), sock_addr) for sock_addr, delays in self._delayed_sources.iteritems()]
+            heapify(self._delayed_largest)
+
+    def _peek_delayed_largest(self):
+        """
+        Returns the source with the most delays, there must be at least one delay.
+        """
+        while True:
+            count, source = self._delayed_largest[0]
+            if -count == len(self._delayed_sources.get(source, ())):
+                return source
+            heappop(self._delayed_largest)
+
+    def _forget_delayed_key(self, key, wildcards=None):
+        """
+        Called when KEY is removed from _delayed_key.
+        """
+        if wildcards is None:
+            wildcards = tuple(i for i, k in enumerate(key) if k is None)
+        self._delayed_wildcards[wildcards] -= 1
+        if self._delayed_wildcards[wildcards] == 0:
+            del self._delayed_wildcards[wildcards]
+
     def _periodically_clean_delayed(self):
         now = time()
-        for delayed in self._delayed_value.keys():
-            if now > delayed.timestamp + 10:
+        for source, (window_start, _) in self._delayed_requests.items():
+            if now - window_start >= 1.0:
+                del self._delayed_requests[source]
+
+        deadline = now - DELAYED_TIMEOUT
+        while self._delayed_timeouts and self._delayed_timeouts[0][0] < deadline:
+            _, delayed = heappop(self._delayed_timeouts)
+            if delayed in self._delayed_value:
                 self._remove_delayed(delayed)
                 delayed.on_timeout()
                 self._statistics.increase_delay_msg_count(u"timeout")
@@ -2007,6 +2505,8 @@ class Community(TaskManager):
                 # TODO(emilon): just have a function that gets a packet type byte
                 conversion = self.get_conversion_for_packet(cur_packets[0][1])
                 meta = conversion.decode_meta_message(cur_packets[0][1])
+                if timestamp:
+                    self._statistics.record_latency(u"receive", meta.name, time() - timestamp, len(cur_packets))
                 batch = [(self.get_candidate(candidate.sock_addr) or candidate, packet, conversion, source)
                          for candidate, packet in cur_packets]
                 if meta.batch.enabled and cache:
@@ -2016,7 +2516,7 @@ class Community(TaskManager):
                         self._logger.debug("adding %d %s messages to existing cache", len(batch), meta.name)
                     else:
                         self.register_task(meta, reactor.callLater(meta.batch.max_window, self._process_message_batch, meta))
-                        self._batch_cache[meta] = (timestamp, batch)
+                        self._batch_cache[meta] = (time(), batch)
                         self._logger.debug("new cache with %d %s messages (batch window: %d)",
                                            len(batch), meta.name, meta.batch.max_window)
                 else:
@@ -2044,8 +2544,9 @@ class Community(TaskManager):
         assert isinstance(meta, Message)
         assert meta in self._batch_cache
 
-        _, batch = self._batch_cache.pop(meta)
+        cached_at, batch = self._batch_cache.pop(meta)
         self.cancel_pending_task(meta)
+        self._statistics.record_latency(u"batch", meta.name, time() - cached_at)
         self._logger.debug("processing %sx %s batched messages", len(batch), meta.name)
 
         return self._on_batch_cache(meta, batch)
@@ -2077,7 +2578,9 @@ class Community(TaskManager):
             assert isinstance(conversion, Conversion)
             try:
                 # convert binary data to internal Message
+                start = time()
                 messages.append(conversion.decode_message(candidate, packet, source=source))
+                self._statistics.record_latency(u"decode", meta.name, time() - start)
 
             except DropPacket as drop:
                 self._drop(drop, packet, candidate)
@@ -2157,6 +2660,7 @@ class Community(TaskManager):
         # drop all duplicate or old messages
         assert type(meta.distribution) in self._dispersy._check_distribution_batch_map
         messages = list(self._dispersy._check_distribution_batch_map[type(meta.distribution)](messages))
+        self._statistics.record_latency(u"distribution", meta.name, time() - debug_begin)
         # TODO(emilon): This seems iffy
         assert len(messages) > 0  # should return at least one item for each message
         assert all(isinstance(message, (Message.Implementation, DropMessage, DelayMessage)) for message in messages)
@@ -2169,7 +2673,9 @@ class Community(TaskManager):
         # check all remaining messages on the community side.  may yield Message.Implementation,
         # DropMessage, and DelayMessage instances
         try:
+            start = time()
             possibly_messages = list(meta.check_callback(messages))
+            self._statistics.record_latency(u"check", meta.name, time() - start)
         except:
             self._logger.exception("exception during check_callback for %s", meta.name)
             return 0
@@ -2463,6 +2969,29 @@ class Community(TaskManager):
         requests = []
         now = time()
 
+        conversion = self.get_conversion_for_message(meta_introduction_response)
+        if extra_payload is None and conversion.can_encode_walker_packets(meta_introduction_response, meta_puncture_request):
+            # fast path: encode the packets directly, the static header is only built once per conversion
+            reuse_signature = self.dispersy_enable_response_signature_reuse
+
+            def create_introduction_response(candidate, args):
+                global_time = self.global_time
+                packet = conversion.encode_introduction_response_packet(meta_introduction_response, self.my_member, global_time, *args, reuse_signature=reuse_signature)
+                signature = packet[-self.my_member.signature_length:]
+                return meta_introduction_response.impl(authentication=(self.my_member, signature), distribution=(global_time,), destination=(candidate,), payload=args, conversion=conversion, packet=packet)
+
+            def create_puncture_request(introduced, args):
+                global_time = self.global_time
+                packet = conversion.encode_puncture_request_packet(meta_puncture_request, global_time, *args)
+                return meta_puncture_request.impl(distribution=(global_time,), destination=(introduced,), payload=args, conversion=conversion, packet=packet)
+
+        else:
+            def create_introduction_response(candidate, args):
+                return meta_introduction_response.impl(authentication=(self.my_member,), distribution=(self.global_time,), destination=(candidate,), payload=args)
+
+            def create_puncture_request(introduced, args):
+                return meta_puncture_request.impl(distribution=(self.global_time,), destination=(introduced,), payload=args)
+
         #
         # make all candidates available for introduction
         #
@@ -2502,10 +3031,10 @@ class Community(TaskManager):
                 introduction_args_list = tuple(introduction_args_list)
 
                 # create introduction response
-                responses.append(meta_introduction_response.impl(authentication=(self.my_member,), distribution=(self.global_time,), destination=(candidate,), payload=introduction_args_list))
+                responses.append(create_introduction_response(candidate, introduction_args_list))
 
                 # create puncture request
-                requests.append(meta_puncture_request.impl(distribution=(self.global_time,), destination=(introduced,), payload=(payload.source_lan_address, payload.source_wan_address, payload.identifier)))
+                requests.append(create_puncture_request(introduced, (payload.source_lan_address, payload.source_wan_address, payload.identifier)))
 
             else:
                 self._logger.debug("responding to %s without an introduction %s", candidate, type(self))
@@ -2517,7 +3046,7 @@ class Community(TaskManager):
                     introduction_args_list += extra_payload
                 introduction_args_list = tuple(introduction_args_list)
 
-                responses.append(meta_introduction_response.impl(authentication=(self.my_member,), distribution=(self.global_time,), destination=(candidate,), payload=introduction_args_list))
+                responses.append(create_introduction_response(candidate, introduction_args_list))
 
         if responses:
             self._dispersy._forward(responses)
@@ -2527,45 +3056,107 @@ class Community(TaskManager):
         #
         # process the bloom filter part of the request
         #
-        messages_with_sync = []
-        for message in messages:
-            payload = message.payload
-            candidate = message.candidate
-            if not candidate:
+        self._on_sync_requests([(message.candidate,
+                                 message.payload.time_low,
+                                 message.payload.time_high,
+                                 message.payload.modulo,
+                                 message.payload.offset,
+                                 message.payload.bloom_filter)
+                                for message in messages if message.candidate and message.payload.sync])
+
+    def _on_sync_requests(self, requests):
+        """
+        Answers the sync part of introduction requests.
+
+        @param requests: A list with (candidate, time_low, time_high, modulo, offset, bloom_filter) tuples, where
+         time_high is zero when the request has no upper bound and bloom_filter is a BloomFilter,
+         InvertibleBloomLookupTable, or RangeDigests
+        @type requests: list
+        """
+        requests_with_sync = []
+        digest_responses = []
+        for candidate, time_low, time_high, modulo, offset, bloom_filter in requests:
+            if isinstance(bloom_filter, RangeDigests):
+                if self.dispersy_sync_bloom_filter_strategy != self._dispersy_claim_sync_digest:
+                    # the digests of the sync table are only maintained in communities that sync using them
+                    self._logger.debug("%s ignoring sync digests from %s", self.cid.encode("HEX"), candidate)
+                    continue
+
+                # reply with the ranges that differ, nothing is sent when all ranges match
+                ranges = get_ranges(time_low, time_high, len(bloom_filter.digests))
+                differences = bloom_filter.get_differences(self._sync_digest.get_digests(ranges))
+                if differences:
+                    self._statistics.sync_digest_differed += 1
+                    meta_digest = self.get_meta_message(u"dispersy-sync-digest")
+                    digest_responses.append(meta_digest.impl(distribution=(self.global_time,),
+                                                             destination=(candidate,),
+                                                             payload=(time_low, time_high, len(ranges), differences)))
+                else:
+                    self._statistics.sync_digest_matched += 1
+
+            elif isinstance(bloom_filter, InvertibleBloomLookupTable) and \
+                    self.dispersy_sync_bloom_filter_strategy != self._dispersy_claim_sync_reconciliation:
+                # listing the difference requires hashing every packet in the range, only communities that sync
+                # using reconciliation tables accept that cost
+                self._logger.debug("%s ignoring sync reconciliation table from %s", self.cid.encode("HEX"), candidate)
                 continue
 
-            if payload.sync:
+            else:
                 # 07/05/12 Boudewijn: for an unknown reason values larger than 2^63-1 cause
                 # overflow exceptions in the sqlite3 wrapper
 
                 # 11/11/13 Niels: according to http://www.sqlite.org/datatype3.html integers are signed and max
                 # 8 bytes, hence the max value is 2 ** 63 - 1 as one bit is used for the sign
-                time_low = min(payload.time_low, 2 ** 63 - 1)
-                time_high = min(payload.time_high if payload.has_time_high else self.global_time, 2 ** 63 - 1)
-
-                offset = long(payload.offset)
-                modulo = long(payload.modulo)
+                time_low = min(time_low, 2 ** 63 - 1)
+                time_high = min(time_high if time_high > 0 else self.global_time, 2 ** 63 - 1)
 
-                messages_with_sync.append((message, time_low, time_high, offset, modulo))
+                requests_with_sync.append((candidate, time_low, time_high, long(offset), long(modulo), bloom_filter))
 
-        if messages_with_sync:
-            for message, generator in self._get_packets_for_bloomfilters(messages_with_sync, include_inactive=False):
-                payload = message.payload
-                # we limit the response by byte_limit bytes
-                byte_limit = self.dispersy_sync_response_limit
+        if digest_responses:
+            self._dispersy._forward(digest_responses)
 
-                packets = []
-                for packet, in payload.bloom_filter.not_filter(generator):
-                    packets.append(packet)
-                    byte_limit -= len(packet)
-                    if byte_limit <= 0:
-                        self._logger.debug("bandwidth throttle")
-                        break
+        if requests_with_sync:
+            responses = []
+            for request, (candidate, packets) in zip(requests_with_sync,
+                                                     self._get_sync_responses(requests_with_sync,
+                                                                              self.dispersy_sync_response_limit,
+                                                                              include_inactive=False)):
+                if isinstance(request[5], InvertibleBloomLookupTable):
+                    if request[5].decoded:
+                        self._statistics.sync_reconciliation_decoded += 1
+                    else:
+                        self._statistics.sync_reconciliation_failed += 1
 
                 if packets:
                     self._logger.debug("syncing %d packets (%d bytes) to %s",
-                                       len(packets), sum(len(packet) for packet in packets), message.candidate)
-                    self._dispersy._send_packets([message.candidate], packets, self, "-caused by sync-")
+                                       len(packets), sum(len(packet) for packet, _ in packets), candidate)
+                    responses.append((candidate, packets))
+
+            # the upload budget is shared by all communities and candidates
+            if responses:
+                self._dispersy.sync_response_scheduler.schedule(self, responses)
+
+    def check_sync_digest(self, messages):
+        for message in messages:
+            request = self._sync_digest.get_request(message.candidate)
+            if not request == (message.payload.time_low, message.payload.time_high, message.payload.ranges):
+                yield DropMessage(message, "unexpected sync digest")
+                continue
+
+            yield message
+
+    def on_sync_digest(self, messages):
+        for message in messages:
+            payload = message.payload
+            ranges = get_ranges(payload.time_low, payload.time_high, payload.ranges)
+            self._sync_digest.on_differences(message.candidate, [ranges[index] for index in payload.differences])
+            self._logger.debug("%d of %d ranges in [%d:%d] differ from %s", len(payload.differences), payload.ranges,
+                               payload.time_low, payload.time_high, message.candidate)
+
+            # visit the differing ranges right away, rather than when the walker returns to this candidate
+            candidate = self.get_candidate(message.candidate.sock_addr)
+            if isinstance(candidate, WalkCandidate) and payload.differences:
+                self.create_introduction_request(candidate, self.dispersy_enable_bloom_filter_sync)
 
     def check_introduction_response(self, messages):
         identifiers_seen = {}
@@ -2646,12 +3237,12 @@ class Community(TaskManager):
 
                 # update statistics
                 if self._dispersy._statistics.received_introductions is not None:
-                    self._dispersy._statistics.received_introductions[candidate.sock_addr][introduced.sock_addr] += 1
+                    self._dispersy._statistics.dict_inc(u"received_introductions", (candidate.sock_addr, introduced.sock_addr))
 
             else:
                 # update statistics
                 if self._dispersy._statistics.received_introductions is not None:
-                    self._dispersy._statistics.received_introductions[candidate.sock_addr]['-ignored-'] += 1
+                    self._dispersy._statistics.dict_inc(u"received_introductions", (candidate.sock_addr, '-ignored-'))
 
     def create_introduction_request(self, destination, allow_sync, forward=True, is_fast_walker=False, extra_payload=None):
         assert isinstance(destination, WalkCandidate), [type(destination), destination]
@@ -2682,12 +3273,12 @@ class Community(TaskManager):
                     assert isinstance(time_high, (int, long)), time_high
                     assert isinstance(modulo, int), modulo
                     assert isinstance(offset, int), offset
-                    assert isinstance(bloom_filter, BloomFilter), bloom_filter
+                    assert isinstance(bloom_filter, (BloomFilter, InvertibleBloomLookupTable, RangeDigests)), bloom_filter
 
                     # verify that the bloom filter is correct
                     try:
                         _, packets = self._get_packets_for_bloomfilters([[None, time_low, self.global_time if time_high == 0 else time_high, offset, modulo]], include_inactive=True).next()
-                        packets = [packet for packet, in packets]
+                        packets = [packet for packet, _ in packets]
 
                     except OverflowError:
                         self._logger.error("time_low:  %d", time_low)
@@ -2697,22 +3288,38 @@ class Community(TaskManager):
                                                " limit time_low and time_high to 2**63-1")
                         assert False
 
-                    # BLOOM_FILTER must be the same after transmission
-                    test_bloom_filter = BloomFilter(bloom_filter.bytes, bloom_filter.functions, prefix=bloom_filter.prefix)
-                    assert bloom_filter.bytes == test_bloom_filter.bytes, "problem with the long <-> binary conversion"
-                    assert list(bloom_filter.not_filter((packet,) for packet in packets)) == [], "does not have all correct bits set before transmission"
-                    assert list(test_bloom_filter.not_filter((packet,) for packet in packets)) == [], "does not have all correct bits set after transmission"
-
-                    # BLOOM_FILTER must have been correctly filled
-                    test_bloom_filter.clear()
-                    test_bloom_filter.add_keys(packets)
-                    if not bloom_filter.bytes == bloom_filter.bytes:
-                        if bloom_filter.bits_checked < test_bloom_filter.bits_checked:
-                            self._logger.error("%d bits in: %s",
-                                               bloom_filter.bits_checked, bloom_filter.bytes.encode("HEX"))
-                            self._logger.error("%d bits in: %s",
-                                               test_bloom_filter.bits_checked, test_bloom_filter.bytes.encode("HEX"))
-                            assert False, "does not match the given range [%d:%d] %%%d+%d packets:%d" % (time_low, time_high, modulo, offset, len(packets))
+                    if isinstance(bloom_filter, RangeDigests):
+                        # the digests must match the packets in the ranges
+                        test_digests = RangeDigests(bloom_filter.bytes)
+                        assert test_digests.digests == bloom_filter.digests, "problem with the binary conversion"
+                        ranges = get_ranges(time_low, time_high, len(bloom_filter.digests))
+                        assert sum(count for count, _ in bloom_filter.digests) == len(packets), "does not match the given range [%d:%d] packets:%d" % (time_low, time_high, len(packets))
+                        assert not test_digests.get_differences(self._sync_digest.get_digests(ranges)), "does not match the sync table"
+
+                    elif isinstance(bloom_filter, InvertibleBloomLookupTable):
+                        # the table must list no difference with PACKETS after transmission
+                        test_table = InvertibleBloomLookupTable(bloom_filter.bytes, bloom_filter.functions, prefix=bloom_filter.prefix)
+                        assert bloom_filter.bytes == test_table.bytes, "problem with the binary conversion"
+                        assert list(test_table.not_filter((packet,) for packet in packets)) == [], "does not contain all packets after transmission"
+                        assert test_table.decoded, "does not match the given range [%d:%d] %%%d+%d packets:%d" % (time_low, time_high, modulo, offset, len(packets))
+
+                    else:
+                        # BLOOM_FILTER must be the same after transmission
+                        test_bloom_filter = BloomFilter(bloom_filter.bytes, bloom_filter.functions, prefix=bloom_filter.prefix)
+                        assert bloom_filter.bytes == test_bloom_filter.bytes, "problem with the binary conversion"
+                        assert list(bloom_filter.not_filter((packet,) for packet in packets)) == [], "does not have all correct bits set before transmission"
+                        assert list(test_bloom_filter.not_filter((packet,) for packet in packets)) == [], "does not have all correct bits set after transmission"
+
+                        # BLOOM_FILTER must have been correctly filled
+                        test_bloom_filter.clear()
+                        test_bloom_filter.add_keys(packets)
+                        if not bloom_filter.bytes == bloom_filter.bytes:
+                            if bloom_filter.bits_checked < test_bloom_filter.bits_checked:
+                                self._logger.error("%d bits in: %s",
+                                                   bloom_filter.bits_checked, bloom_filter.bytes.encode("HEX"))
+                                self._logger.error("%d bits in: %s",
+                                                   test_bloom_filter.bits_checked, test_bloom_filter.bytes.encode("HEX"))
+                                assert False, "does not match the given range [%d:%d] %%%d+%d packets:%d" % (time_low, time_high, modulo, offset, len(packets))
 
         args_list = [destination.sock_addr, self._dispersy._lan_address, self._dispersy._wan_address, advice, self._dispersy._connection_type, sync, cache.number]
         if extra_payload is not None:
@@ -2750,61 +3357,171 @@ class Community(TaskManager):
         @param include_inactive: When False only active packets (due to pruning) are returned
         @type include_inactive: bool
 
-        @return: An generator yielding the original request and a generator consisting of the packets matching the request
+        @return: An generator yielding the original request and a generator consisting of (packet, priority) tuples
+         matching the request, where priority is the priority of the meta message of the packet
         """
 
         assert isinstance(requests, list)
         assert all(isinstance(request, (list, tuple)) for request in requests)
         assert all(len(request) == 5 for request in requests)
 
+        meta_messages = self._get_sync_meta_messages()
+        sql = self._get_sync_select(meta_messages)
+
+        for message, time_low, time_high, offset, modulo in requests:
+            sql_arguments = []
+            for meta in meta_messages:
+                sql_arguments.extend((meta.database_id, self._get_sync_time_low(meta, time_low, include_inactive),
+                                      time_high, offset, modulo))
+            self._logger.debug("%s", sql_arguments)
+
+            self._statistics.sync_scan_count += 1
+            yield message, ((str(packet), priority) for packet, priority, _, _ in self._dispersy._database.execute(sql, sql_arguments))
+
+    def _get_sync_responses(self, requests, byte_limit, include_inactive=True):
+        """
+        Returns the packets that each request is missing, at most BYTE_LIMIT bytes per request.
+
+        Requests with a BloomFilter whose time ranges overlap are served from a single query over their combined
+        range, see _scan_sync_responses.  Other requests are served from their own query, see
+        _get_packets_for_bloomfilters.
+
+        @param requests: A list of requests, each of them being a tuple consisting of the request, time_low,
+         time_high, offset, modulo, and the BloomFilter or InvertibleBloomLookupTable
+        @type requests: list
+
+        @return: A list with (request, [(packet, priority), ...]) tuples, in the order of REQUESTS
+        """
+        assert isinstance(requests, list)
+        assert all(isinstance(request, (list, tuple)) for request in requests)
+        assert all(len(request) == 6 for request in requests)
+
+        # group the bloom filter requests into clusters with overlapping time ranges, [time_low, time_high,
+        # [request, ...]] lists
+        clusters = []
+        for request in sorted((request for request in requests if isinstance(request[5], BloomFilter)),
+                              key=lambda request: request[1]):
+            if clusters and request[1] <= clusters[-1][1]:
+                clusters[-1][1] = max(clusters[-1][1], request[2])
+                clusters[-1][2].append(request)
+            else:
+                clusters.append([request[1], request[2], [request]])
+
+        # id(request):[(packet, priority), ...] for the requests that share a query
+        shared = {}
+        for time_low, time_high, cluster in clusters:
+            if len(cluster) > 1:
+                shared.update(self._scan_sync_responses(cluster, time_low, time_high, byte_limit, include_inactive))
+                self._statistics.sync_shared_scan_requests += len(cluster)
+
+        responses = []
+        for request in requests:
+            packets = shared.get(id(request))
+            if packets is None:
+                _, generator = self._get_packets_for_bloomfilters([request[:5]], include_inactive).next()
+                if isinstance(request[5], InvertibleBloomLookupTable):
+                    # stop reading when the range selects far more packets than the table is meant to cover
+                    generator = request[5].not_filter(generator, SYNC_RECONCILIATION_MAX_ITEMS)
+                else:
+                    generator = request[5].not_filter(generator)
+                limit = byte_limit
+                packets = []
+                for packet, priority in generator:
+                    packets.append((packet, priority))
+                    limit -= len(packet)
+                    if limit <= 0:
+                        self._logger.debug("bandwidth throttle")
+                        break
+            responses.append((request[0], packets))
+        return responses
+
+    def _scan_sync_responses(self, requests, time_low, time_high, byte_limit, include_inactive):
+        """
+        Serves REQUESTS, bloom filter requests within TIME_LOW and TIME_HIGH, from a single query.
+
+        The packets are read lazily, in the same order as _get_packets_for_bloomfilters gives them, and each packet is
+        handed to every request that is not yet full.  Reading stops once every request has received BYTE_LIMIT
+        bytes.
+
+        @return: A list with (id(request), [(packet, priority), ...]) tuples
+        """
+        meta_messages = self._get_sync_meta_messages()
+        sql = self._get_sync_select(meta_messages)
+        sql_arguments = []
+        for meta in meta_messages:
+            sql_arguments.extend((meta.database_id, self._get_sync_time_low(meta, time_low, include_inactive),
+                                  time_high, 0, 1))
+        self._statistics.sync_scan_count += 1
+
+        # [request, meta_message:time_low, remaining bytes, packets] lists for the requests that are not yet full
+        pending = [[request,
+                    dict((meta.database_id, self._get_sync_time_low(meta, request[1], include_inactive))
+                         for meta in meta_messages),
+                    byte_limit,
+                    []]
+                   for request in requests]
+        results = [(id(state[0]), state[3]) for state in pending]
+
+        for packet, priority, global_time, meta_message in self._dispersy._database.execute(sql, sql_arguments):
+            packet = str(packet)
+            for state in pending:
+                request = state[0]
+                _, _, request_time_high, offset, modulo, bloom_filter = request
+                if (state[1][meta_message] <= global_time <= request_time_high and
+                        (global_time + offset) % modulo == 0 and not packet in bloom_filter):
+                    state[3].append((packet, priority))
+                    state[2] -= len(packet)
+
+            if any(state[2] <= 0 for state in pending):
+                pending = [state for state in pending if state[2] > 0]
+                if not pending:
+                    self._logger.debug("bandwidth throttle")
+                    break
+
+        return results
+
+    def _get_sync_meta_messages(self):
+        # the meta messages that are synced, the highest priority first
+        return sorted([meta
+                       for meta
+                       in self.get_meta_messages()
+                       if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32],
+                      key=lambda meta: meta.distribution.priority,
+                      reverse=True)
+
+    def _get_sync_time_low(self, meta, time_low, include_inactive):
+        # the inactive packets of META are excluded by raising TIME_LOW, see GlobalTimePruning
+        if include_inactive or not isinstance(meta.distribution.pruning, GlobalTimePruning):
+            return time_low
+        return min(max(time_low, self.global_time - meta.distribution.pruning.inactive_threshold + 1), 2 ** 63 - 1)
+
+    def _get_sync_select(self, meta_messages):
+        """
+        Returns the multi-part SQL statement selecting the packet, priority, global_time, and meta_message of the
+        packets of META_MESSAGES that are not undone, in the order of META_MESSAGES, where the packets of each meta
+        message are ordered by its synchronization direction.  It takes the meta_message database id, time_low,
+        time_high, offset, and modulo arguments for each meta message.
+        """
         def get_sub_select(meta):
             direction = meta.distribution.synchronization_direction
             if direction == u"ASC":
-                return u"""
- SELECT * FROM
-  (SELECT sync.packet FROM sync    -- """ + meta.name + """
-   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
-   ORDER BY sync.global_time ASC)"""
+                order = u"sync.global_time ASC"
+            elif direction == u"DESC":
+                order = u"sync.global_time DESC"
+            elif direction == u"RANDOM":
+                order = u"RANDOM()"
+            else:
+                raise RuntimeError("Unknown synchronization_direction [%d]" % direction)
 
-            if direction == u"DESC":
-                return u"""
+            return u"""
  SELECT * FROM
-  (SELECT sync.packet FROM sync    -- """ + meta.name + """
+  (SELECT sync.packet, """ + str(meta.distribution.priority) + """ AS priority, sync.global_time, sync.meta_message FROM sync    -- """ + meta.name + """
    WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
-   ORDER BY sync.global_time DESC)"""
+   ORDER BY """ + order + """)"""
 
-            if direction == u"RANDOM":
-                return u"""
- SELECT * FROM
-  (SELECT sync.packet FROM sync    -- """ + meta.name + """
-   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
-   ORDER BY RANDOM())"""
-
-            raise RuntimeError("Unknown synchronization_direction [%d]" % direction)
-
-        # obtain all available messages for this community
-        meta_messages = sorted([meta
-                                for meta
-                                in self.get_meta_messages()
-                                if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32],
-                               key=lambda meta: meta.distribution.priority,
-                               reverse=True)
-        # build multi-part SQL statement from meta_messages
         sql = "".join((u"SELECT * FROM (", " UNION ALL ".join(get_sub_select(meta) for meta in meta_messages), ")"))
         self._logger.debug(sql)
-
-        for message, time_low, time_high, offset, modulo in requests:
-            sql_arguments = []
-            for meta in meta_messages:
-                if include_inactive:
-                    _time_low = time_low
-                else:
-                    _time_low = min(max(time_low, self.global_time - meta.distribution.pruning.inactive_threshold + 1), 2 ** 63 - 1) if isinstance(meta.distribution.pruning, GlobalTimePruning) else time_low
-
-                sql_arguments.extend((meta.database_id, _time_low, time_high, offset, modulo))
-            self._logger.debug("%s", sql_arguments)
-
-            yield message, ((str(packet),) for packet, in self._dispersy._database.execute(sql, sql_arguments))
+        return sql
 
     def check_puncture_request(self, messages):
         for message in messages:
@@ -2891,6 +3608,94 @@ class Community(TaskManager):
         request = meta.impl(distribution=(self.global_time,), destination=(candidate,), payload=(member, [global_time]))
         self._dispersy._forward([request])
 
+    def request_missing_message(self, candidate, member, global_time):
+        """
+        Schedule a dispersy-missing-message request for the message from MEMBER at GLOBAL_TIME.
+
+        Unlike create_missing_message the request is not sent immediately.  All requests to CANDIDATE made within
+        MISSING_REQUEST_WINDOW seconds are combined into as few dispersy-missing-message messages as possible.
+        Messages that have already been requested from CANDIDATE are not requested from CANDIDATE again until their
+        MissingMessageCache times out, other candidates may still be asked.
+
+        Returns True when a request was scheduled.
+        """
+        assert isinstance(candidate, Candidate), type(candidate)
+        assert isinstance(member, Member), type(member)
+        assert isinstance(global_time, (int, long)), type(global_time)
+        cache = self._request_cache.get(u"missing-message", MissingMessageCache.number_for(member, global_time))
+        if cache is None:
+            cache = self._request_cache.add(MissingMessageCache(self._request_cache, member, global_time))
+        elif candidate.sock_addr in cache.candidates:
+            return False
+
+        cache.candidates.add(candidate.sock_addr)
+        self._get_missing_requests(candidate)[2][member].add(global_time)
+        return True
+
+    def request_missing_identity(self, candidate, mid):
+        """
+        Schedule a dispersy-missing-identity request for the member with MID.
+
+        The request is combined with other requests to CANDIDATE, see request_missing_message.
+
+        Returns True when a request was scheduled.
+        """
+        assert isinstance(candidate, Candidate), type(candidate)
+        assert isinstance(mid, str), type(mid)
+        assert len(mid) == 20, len(mid)
+        cache = self._request_cache.get(u"missing-identity", MissingIdentityCache.number_for(mid))
+        if cache is None:
+            cache = self._request_cache.add(MissingIdentityCache(self._request_cache, mid))
+        elif candidate.sock_addr in cache.candidates:
+            return False
+
+        cache.candidates.add(candidate.sock_addr)
+        self._get_missing_requests(candidate)[1].add(mid)
+        return True
+
+    def _get_missing_requests(self, candidate):
+        """
+        Returns the (CANDIDATE, MIDS, {MEMBER:GLOBAL_TIMES}) tuple collecting the requests for CANDIDATE, the
+        requests are sent when the current window ends.
+        """
+        if not self._missing_requests:
+            self.register_task("flush missing requests",
+                               reactor.callLater(MISSING_REQUEST_WINDOW, self._flush_missing_requests))
+
+        requests = self._missing_requests.get(candidate.sock_addr)
+        if requests is None:
+            requests = self._missing_requests[candidate.sock_addr] = (candidate, set(), defaultdict(set))
+        return requests
+
+    def _flush_missing_requests(self):
+        requests = self._missing_requests
+        self._missing_requests = {}
+
+        identity_requests = []
+        message_requests = []
+        for candidate, mids, members in requests.itervalues():
+            if mids:
+                meta = self.get_meta_message(u"dispersy-missing-identity")
+                identity_requests.extend(meta.impl(distribution=(self.global_time,), destination=(candidate,),
+                                                   payload=(mid,))
+                                         for mid in mids)
+
+            if members:
+                meta = self.get_meta_message(u"dispersy-missing-message")
+                for member, global_times in members.iteritems():
+                    global_times = sorted(global_times)
+                    for index in xrange(0, len(global_times), MISSING_MESSAGE_BATCH_SIZE):
+                        message_requests.append(meta.impl(distribution=(self.global_time,), destination=(candidate,),
+                                                          payload=(member, global_times[index:index + MISSING_MESSAGE_BATCH_SIZE])))
+
+            self._logger.debug("requesting %d identities and %d messages from %s",
+                               len(mids), sum(len(global_times) for global_times in members.itervalues()), candidate)
+
+        if identity_requests:
+            self._dispersy._forward(identity_requests)
+        if message_requests:
+            self._dispersy._forward(message_requests)
+
     def on_missing_message(self, messages):
         for message in messages:
 
@@ -3474,6 +4279,7 @@ class Community(TaskManager):
 
         self._dispersy._database.executemany(u"UPDATE sync SET undone = ? "
                                              u"WHERE community = ? AND member = ? AND global_time = ?", parameters)
+        self._sync_digest.invalidate(global_time for _, _, _, global_time in parameters)
 
         for meta, sub_messages in groupby(real_messages, key=lambda x: x.payload.packet.meta):
             meta.undo_callback([(message.payload.member, message.payload.global_time, message.payload.packet) for message in sub_messages])
@@ -3572,6 +4378,7 @@ class Community(TaskManager):
                 # 2. cleanup sync table.  everything except what we need to tell others this
                 # community is no longer available
                 self._dispersy._database.execute(u"DELETE FROM sync WHERE community = ? AND id NOT IN (" + u", ".join(u"?" for _ in packet_ids) + ")", [self.database_id] + list(packet_ids))
+                self._sync_digest.clear()
 
             self._dispersy.reclassify_community(self, new_classification)
 
@@ -3629,6 +4436,7 @@ class Community(TaskManager):
 
         if undo:
             executemany(u"UPDATE sync SET undone = 1 WHERE id = ?", ((message.packet_id,) for message in undo))
+            self._sync_digest.invalidate(message.distribution.global_time for message in undo)
             meta.undo_callback([(message.authentication.member, message.distribution.global_time, message) for message in undo])
 
             # notify that global times have changed
@@ -3636,6 +4444,7 @@ class Community(TaskManager):
 
         if redo:
             executemany(u"UPDATE sync SET undone = 0 WHERE id = ?", ((message.packet_id,) for message in redo))
+            self._sync_digest.invalidate(message.distribution.global_time for message in redo)
             meta.handle_callback(redo)
 
     def _claim_master_member_sequence_number(self, meta):
@@ -1,4 +1,5 @@
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from math import ceil
 from socket import inet_ntoa, inet_aton
 from struct import pack, unpack_from, Struct
@@ -10,11 +11,23 @@ from .candidate import Candidate
 from .destination import Destination, CommunityDestination, CandidateDestination
 from .distribution import Distribution, FullSyncDistribution, LastSyncDistribution, DirectDistribution
 from .exception import MetaNotFoundException
+from .iblt import InvertibleBloomLookupTable, CELL_SIZE, MAX_FUNCTIONS
 from .message import DelayPacketByMissingMember, DropPacket, Message
 from .payload import Payload
 from .resolution import Resolution, PublicResolution, LinearResolution, DynamicResolution
+from .syncdigest import RangeDigests, DIGEST_SIZE, SYNC_DIGEST_MAX_RANGES
 from .util import attach_runtime_statistics
 
+# maximum number of signatures kept for reuse by encode_introduction_response_packet
+SIGNATURE_REUSE_CACHE_SIZE = 1024
+
+
+def _is_method(function, method):
+    """
+    Returns True when FUNCTION is bound to the implementation of the unbound METHOD, i.e. not to an override.
+    """
+    return getattr(function, "im_func", None) is method.im_func
+
 
 class Conversion(object):
 
@@ -167,6 +180,24 @@ class NoDefBinaryConversion(Conversion):
             self.distribution = distribution
             self.payload = payload
 
+    class IntroductionRequestRecord(object):
+        """
+        The fields of a dispersy-introduction-request, see decode_introduction_request_record.
+        """
+        __slots__ = ["candidate", "member", "global_time", "destination_address", "source_lan_address", "source_wan_address", "advice", "connection_type", "identifier", "sync"]
+
+        def __init__(self, candidate, member, global_time, destination_address, source_lan_address, source_wan_address, advice, connection_type, identifier, sync):
+            self.candidate = candidate
+            self.member = member
+            self.global_time = global_time
+            self.destination_address = destination_address
+            self.source_lan_address = source_lan_address
+            self.source_wan_address = source_wan_address
+            self.advice = advice
+            self.connection_type = connection_type
+            self.identifier = identifier
+            self.sync = sync
+
     class DecodeFunctions(object):
         __slots__ = ["meta", "authentication", "resolution", "distribution", "destination", "payload"]
 
@@ -191,8 +222,19 @@ class NoDefBinaryConversion(Conversion):
         self._struct_QH = Struct(">QH")
         self._struct_QL = Struct(">QL")
         self._struct_QQHHBH = Struct(">QQHHBH")
+        self._struct_QQBQ = Struct(">QQBQ")
         self._struct_ccB = Struct(">ccB")
         self._struct_4SH = Struct(">4sH")
+        self._struct_introduction_response = Struct(">4sH4sH4sH4sH4sHBH")
+        self._struct_puncture_request = Struct(">4sH4sHH")
+        self._struct_introduction_request = Struct(">Q4sH4sH4sHBH")
+
+        # (message.name, member) : the static prefix, message-id, and authentication bytes, see _get_header
+        self._headers = dict()
+        # unsigned packet : signature, only for the current _signatures_global_time, see
+        # encode_introduction_response_packet
+        self._signatures = OrderedDict()
+        self._signatures_global_time = 0
 
         self._encode_message_map = dict()  # message.name : EncodeFunctions
         self._decode_message_map = dict()  # byte : DecodeFunctions
@@ -208,7 +250,13 @@ class NoDefBinaryConversion(Conversion):
         # reserve 3rd bit for enable/disable tunnel (02/05/12)
         self._encode_tunnel_map = {True: int("100", 2), False: int("000", 2)}
         self._decode_tunnel_map = dict((value, key) for key, value in self._encode_tunnel_map.iteritems())
-        # 4th, 5th and 6th bits are currently unused
+        # reserve 4th bit for the sync reconciliation table, i.e. an InvertibleBloomLookupTable instead of a BloomFilter
+        self._encode_sync_reconciliation_map = {True: int("1000", 2), False: int("0000", 2)}
+        self._decode_sync_reconciliation_map = dict((value, key) for key, value in self._encode_sync_reconciliation_map.iteritems())
+        # reserve 5th bit for the sync digests, i.e. RangeDigests instead of a BloomFilter
+        self._encode_sync_digest_map = {True: int("10000", 2), False: int("00000", 2)}
+        self._decode_sync_digest_map = dict((value, key) for key, value in self._encode_sync_digest_map.iteritems())
+        # 6th bit is currently unused
         # reserve 7th and 8th bits for connection type
         self._encode_connection_type_map = {u"unknown": int("00000000", 2), u"public": int("10000000", 2), u"symmetric-NAT": int("11000000", 2)}
         self._decode_connection_type_map = dict((value, key) for key, value in self._encode_connection_type_map.iteritems())
@@ -668,6 +716,28 @@ class NoDefBinaryConversion(Conversion):
 
         return offset, placeholder.meta.payload.Implementation(placeholder.meta.payload, member, global_time)
 
+    def _encode_sync_digest(self, message):
+        payload = message.payload
+        return (self._struct_QQBQ.pack(payload.time_low, payload.time_high, payload.ranges,
+                                       sum(1 << index for index in payload.differences)),)
+
+    def _decode_sync_digest(self, placeholder, offset, data):
+        if len(data) < offset + 25:
+            raise DropPacket("Insufficient packet size (_decode_sync_digest)")
+
+        time_low, time_high, ranges, bitmap = self._struct_QQBQ.unpack_from(data, offset)
+        offset += 25
+
+        if not 0 < time_low <= time_high:
+            raise DropPacket("Invalid time_low or time_high value")
+        if not 0 < ranges <= SYNC_DIGEST_MAX_RANGES:
+            raise DropPacket("Invalid ranges value")
+        if bitmap >> ranges:
+            raise DropPacket("Invalid differences value")
+
+        differences = [index for index in xrange(ranges) if bitmap & (1 << index)]
+        return offset, placeholder.meta.payload.Implementation(placeholder.meta.payload, time_low, time_high, ranges, differences)
+
     def _encode_dynamic_settings(self, message):
         data = []
         for meta, policy in message.payload.policies:
@@ -712,14 +782,28 @@ class NoDefBinaryConversion(Conversion):
     def _encode_introduction_request(self, message):
         payload = message.payload
 
+        reconciliation = isinstance(payload.bloom_filter, InvertibleBloomLookupTable)
+        digest = isinstance(payload.bloom_filter, RangeDigests)
         data = [inet_aton(payload.destination_address[0]), self._struct_H.pack(payload.destination_address[1]),
                 inet_aton(payload.source_lan_address[0]), self._struct_H.pack(payload.source_lan_address[1]),
                 inet_aton(payload.source_wan_address[0]), self._struct_H.pack(payload.source_wan_address[1]),
-                self._struct_B.pack(self._encode_advice_map[payload.advice] | self._encode_connection_type_map[payload.connection_type] | self._encode_sync_map[payload.sync]),
+                self._struct_B.pack(self._encode_advice_map[payload.advice] | self._encode_connection_type_map[payload.connection_type] | self._encode_sync_map[payload.sync] | self._encode_sync_reconciliation_map[reconciliation] | self._encode_sync_digest_map[digest]),
                 self._struct_H.pack(payload.identifier)]
 
+        # add optional sync digests, the size field contains the number of ranges
+        if payload.sync and digest:
+            data.extend((self._struct_QQHHBH.pack(payload.time_low, payload.time_high, 1, 0, 1, len(payload.bloom_filter.digests)),
+                         "\x00", payload.bloom_filter.bytes))
+
+        # add optional sync reconciliation table, the size field contains the number of cells
+        elif payload.sync and reconciliation:
+            assert len(payload.bloom_filter.prefix) == 1, "must have a one character prefix"
+            assert payload.bloom_filter.cells < 2 ** 16, payload.bloom_filter.cells
+            data.extend((self._struct_QQHHBH.pack(payload.time_low, payload.time_high, payload.modulo, payload.offset, payload.bloom_filter.functions, payload.bloom_filter.cells),
+                         payload.bloom_filter.prefix, payload.bloom_filter.bytes))
+
         # add optional sync
-        if payload.sync:
+        elif payload.sync:
             assert payload.bloom_filter.size % 8 == 0
             assert 0 < payload.bloom_filter.functions < 256, "assuming that we choose BITS to ensure the bloom filter will fit in one MTU, it is unlikely that there will be more than 255 functions.  hence we can encode this in one byte"
             assert len(payload.bloom_filter.prefix) == 1, "must have a one character prefix"
@@ -729,6 +813,76 @@ class NoDefBinaryConversion(Conversion):
 
         return data
 
+    def _decode_introduction_request_sync(self, flags, offset, data):
+        """
+        Decodes the optional sync part of a dispersy-introduction-request that starts at OFFSET and continues until
+        the end of DATA.
+
+        Returns a (offset, (time_low, time_high, modulo, offset, bloom_filter)) tuple.
+        """
+        if len(data) < offset + 24:
+            raise DropPacket("Insufficient packet size")
+
+        time_low, time_high, modulo, modulo_offset, functions, size = self._struct_QQHHBH.unpack_from(data, offset)
+        offset += 23
+
+        prefix = data[offset]
+        offset += 1
+
+        if not time_low > 0:
+            raise DropPacket("Invalid time_low value")
+        if not (time_high == 0 or time_low <= time_high):
+            raise DropPacket("Invalid time_high value")
+        if not 0 < modulo:
+            raise DropPacket("Invalid modulo value")
+        if not 0 <= modulo_offset < modulo:
+            raise DropPacket("Invalid offset value")
+        if not 0 < functions:
+            raise DropPacket("Invalid functions value")
+        if not 0 < size:
+            raise DropPacket("Invalid size value")
+
+        if self._decode_sync_digest_map[flags & int("10000", 2)]:
+            if self._decode_sync_reconciliation_map[flags & int("1000", 2)]:
+                raise DropPacket("Invalid flags, sync digests and reconciliation table are exclusive")
+            if not (modulo == 1 and modulo_offset == 0):
+                raise DropPacket("Invalid modulo value, sync digests must cover the entire range")
+            if not time_high > 0:
+                raise DropPacket("Invalid time_high value, sync digests must have a time_high value")
+            if not size <= SYNC_DIGEST_MAX_RANGES:
+                raise DropPacket("Invalid size value")
+
+            length = size * DIGEST_SIZE
+            if not length == len(data) - offset:
+                raise DropPacket("Invalid number of bytes available")
+
+            bloom_filter = RangeDigests(data[offset:offset + length])
+
+        elif self._decode_sync_reconciliation_map[flags & int("1000", 2)]:
+            if not functions <= MAX_FUNCTIONS:
+                raise DropPacket("Invalid functions value")
+            if not size % functions == 0:
+                raise DropPacket("Invalid size value, must be a multiple of the functions value")
+
+            length = size * CELL_SIZE
+            if not length == len(data) - offset:
+                raise DropPacket("Invalid number of bytes available")
+
+            bloom_filter = InvertibleBloomLookupTable(data[offset:offset + length], functions, prefix=prefix)
+
+        else:
+            if not size % 8 == 0:
+                raise DropPacket("Invalid size value, must be a multiple of eight")
+
+            length = int(ceil(size / 8))
+            if not length == len(data) - offset:
+                raise DropPacket("Invalid number of bytes available")
+
+            bloom_filter = BloomFilter(data[offset:offset + length], functions, prefix=prefix)
+        offset += length
+
+        return offset, (time_low, time_high, modulo, modulo_offset, bloom_filter)
+
     def _decode_introduction_request(self, placeholder, offset, data):
         if len(data) < offset + 21:
             raise DropPacket("Insufficient packet size")
@@ -760,39 +914,7 @@ class NoDefBinaryConversion(Conversion):
         if sync is None:
             raise DropPacket("Invalid sync flag")
         if sync:
-            if len(data) < offset + 24:
-                raise DropPacket("Insufficient packet size")
-
-            time_low, time_high, modulo, modulo_offset, functions, size = self._struct_QQHHBH.unpack_from(data, offset)
-            offset += 23
-
-            prefix = data[offset]
-            offset += 1
-
-            if not time_low > 0:
-                raise DropPacket("Invalid time_low value")
-            if not (time_high == 0 or time_low <= time_high):
-                raise DropPacket("Invalid time_high value")
-            if not 0 < modulo:
-                raise DropPacket("Invalid modulo value")
-            if not 0 <= modulo_offset < modulo:
-                raise DropPacket("Invalid offset value")
-            if not 0 < functions:
-                raise DropPacket("Invalid functions value")
-            if not 0 < size:
-                raise DropPacket("Invalid size value")
-            if not size % 8 == 0:
-                raise DropPacket("Invalid size value, must be a multiple of eight")
-
-            length = int(ceil(size / 8))
-            if not length == len(data) - offset:
-                raise DropPacket("Invalid number of bytes available")
-
-            bloom_filter = BloomFilter(data[offset:offset + length], functions, prefix=prefix)
-            offset += length
-
-            sync = (time_low, time_high, modulo, modulo_offset, bloom_filter)
-
+            offset, sync = self._decode_introduction_request_sync(flags, offset, data)
         else:
             sync = None
 
@@ -972,6 +1094,97 @@ class NoDefBinaryConversion(Conversion):
         assert isinstance(message, (Message, Message.Implementation)), type(message)
         return message.name in self._encode_message_map
 
+    def can_encode_walker_packets(self, introduction_response, puncture_request):
+        """
+        Returns True when the INTRODUCTION_RESPONSE and PUNCTURE_REQUEST meta messages can be encoded with
+        encode_introduction_response_packet and encode_puncture_request_packet, i.e. when both use the
+        default policies and payload encoders of NoDefBinaryConversion, not overrides.
+        """
+        assert isinstance(introduction_response, Message), type(introduction_response)
+        assert isinstance(puncture_request, Message), type(puncture_request)
+        response_functions = self._encode_message_map.get(introduction_response.name)
+        request_functions = self._encode_message_map.get(puncture_request.name)
+        default = NoDefBinaryConversion
+        return (response_functions is not None and
+                request_functions is not None and
+                _is_method(response_functions.authentication, default._encode_member_authentication) and
+                _is_method(response_functions.resolution, default._encode_public_resolution) and
+                _is_method(response_functions.distribution, default._encode_direct_distribution) and
+                _is_method(response_functions.payload, default._encode_introduction_response) and
+                _is_method(request_functions.authentication, default._encode_no_authentication) and
+                _is_method(request_functions.resolution, default._encode_public_resolution) and
+                _is_method(request_functions.distribution, default._encode_direct_distribution) and
+                _is_method(request_functions.payload, default._encode_puncture_request))
+
+    def _get_header(self, meta, member=None):
+        """
+        Returns the community prefix, message-id, and, when MEMBER is given, the member authentication bytes of
+        META.  These are identical for every message of META created by MEMBER and are therefore only built once.
+        """
+        key = (meta.name, member)
+        header = self._headers.get(key)
+        if header is None:
+            container = [self._prefix, self._encode_message_map[meta.name].byte]
+            if member:
+                encoding = self.__get_authentication_encoding(meta.authentication)
+                if encoding == "sha1":
+                    container.append(member.mid)
+                elif encoding == "bin":
+                    container.extend((self._struct_H.pack(len(member.public_key)), member.public_key))
+                else:
+                    raise NotImplementedError(encoding)
+            header = self._headers[key] = "".join(container)
+        return header
+
+    def encode_introduction_response_packet(self, meta, member, global_time, destination_address, source_lan_address,
+                                            source_wan_address, lan_introduction_address, wan_introduction_address,
+                                            connection_type, tunnel, identifier, reuse_signature=False):
+        """
+        Returns the signed packet of a dispersy-introduction-response, identical to the result of encode_message
+        but without creating the Message.Implementation first.  Only available when can_encode_walker_packets
+        returns True.
+
+        When REUSE_SIGNATURE is True, the signature of a byte-identical response created earlier with the same
+        GLOBAL_TIME is used instead of signing the packet again.
+        """
+        assert isinstance(global_time, (int, long)), type(global_time)
+        packet = "".join((self._get_header(meta, member),
+                          self._struct_Q.pack(global_time),
+                          self._struct_introduction_response.pack(
+                              inet_aton(destination_address[0]), destination_address[1],
+                              inet_aton(source_lan_address[0]), source_lan_address[1],
+                              inet_aton(source_wan_address[0]), source_wan_address[1],
+                              inet_aton(lan_introduction_address[0]), lan_introduction_address[1],
+                              inet_aton(wan_introduction_address[0]), wan_introduction_address[1],
+                              self._encode_connection_type_map[connection_type] | self._encode_tunnel_map[tunnel],
+                              identifier)))
+
+        if not reuse_signature:
+            return packet + member.sign(packet)
+
+        if global_time != self._signatures_global_time:
+            self._signatures.clear()
+            self._signatures_global_time = global_time
+
+        signature = self._signatures.get(packet)
+        if signature is None:
+            signature = self._signatures[packet] = member.sign(packet)
+            if len(self._signatures) > SIGNATURE_REUSE_CACHE_SIZE:
+                self._signatures.popitem(False)
+        return packet + signature
+
+    def encode_puncture_request_packet(self, meta, global_time, lan_walker_address, wan_walker_address, identifier):
+        """
+        Returns the packet of a dispersy-puncture-request, identical to the result of encode_message but without
+        creating the Message.Implementation first.  Only available when can_encode_walker_packets returns True.
+        """
+        assert isinstance(global_time, (int, long)), type(global_time)
+        return "".join((self._get_header(meta),
+                        self._struct_Q.pack(global_time),
+                        self._struct_puncture_request.pack(inet_aton(lan_walker_address[0]), lan_walker_address[1],
+                                                           inet_aton(wan_walker_address[0]), wan_walker_address[1],
+                                                           identifier)))
+
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {1.name}")
     def encode_message(self, message, sign=True):
         assert isinstance(message, Message.Implementation), message
@@ -1231,6 +1444,107 @@ class NoDefBinaryConversion(Conversion):
 
         return placeholder.meta.Implementation(placeholder.meta, placeholder.authentication, placeholder.resolution, placeholder.distribution, placeholder.destination, placeholder.payload, conversion=self, candidate=candidate, source=source, packet=placeholder.data)
 
+    def can_decode_introduction_request_record(self, meta):
+        """
+        Returns True when packets of the dispersy-introduction-request META can be decoded with
+        decode_introduction_request_record, i.e. when META uses the default policies and payload decoder of
+        NoDefBinaryConversion, not overrides.
+        """
+        assert isinstance(meta, Message), type(meta)
+        decode_functions = self._decode_message_map.get(self._encode_message_map[meta.name].byte) if meta.name in self._encode_message_map else None
+        default = NoDefBinaryConversion
+        return (decode_functions is not None and
+                decode_functions.meta is meta and
+                _is_method(decode_functions.authentication, default._decode_member_authentication) and
+                _is_method(decode_functions.resolution, default._decode_public_resolution) and
+                _is_method(decode_functions.distribution, default._decode_direct_distribution) and
+                _is_method(decode_functions.payload, default._decode_introduction_request))
+
+    def decode_introduction_request_record(self, candidate, data, verify=True):
+        """
+        Decodes the dispersy-introduction-request DATA into an IntroductionRequestRecord, without creating the
+        Placeholder, policy implementations, and Message.Implementation that decode_message creates.  Only
+        available when can_decode_introduction_request_record returns True.
+
+        The optional sync part is decoded into the sync field, a (time_low, time_high, modulo, offset, bloom_filter)
+        tuple or None.  Raises DropPacket and DelayPacketByMissingMember in the same cases as decode_message.
+        """
+        assert isinstance(candidate, Candidate), candidate
+        assert isinstance(data, str), type(data)
+        assert isinstance(verify, bool), type(verify)
+
+        if not self.can_decode_message(data):
+            raise DropPacket("Cannot decode message")
+
+        offset = 23
+        meta = self._decode_message_map[data[22]].meta
+        assert meta.name == u"dispersy-introduction-request", meta.name
+        encoding = self.__get_authentication_encoding(meta.authentication)
+        if encoding == "sha1":
+            member_id = data[offset:offset + 20]
+            offset += 20
+            member = self._community.get_member(mid=member_id) if len(member_id) == 20 else None
+            if not member:
+                if len(member_id) < 20:
+                    raise DropPacket("Insufficient packet size (_decode_member_authentication sha1)")
+                raise DelayPacketByMissingMember(self._community, member_id)
+
+        elif encoding == "bin":
+            if len(data) < offset + 2:
+                raise DropPacket("Insufficient packet size (_decode_member_authentication bin)")
+            key_length, = self._struct_H.unpack_from(data, offset)
+            offset += 2
+            if len(data) < offset + key_length:
+                raise DropPacket("Insufficient packet size (_decode_member_authentication bin)")
+            try:
+                member = self._community.get_member(public_key=data[offset:offset + key_length])
+            except:
+                raise DropPacket("Invalid cryptographic key (_decode_member_authentication)")
+            if not member:
+                raise DropPacket("Invalid cryptographic key (_decode_member_authentication)")
+            offset += key_length
+
+        else:
+            raise NotImplementedError(encoding)
+
+        first_signature_offset = len(data) - member.signature_length
+        if first_signature_offset - offset < self._struct_introduction_request.size:
+            raise DropPacket("Insufficient packet size")
+
+        (global_time, destination_ip, destination_port, source_lan_ip, source_lan_port, source_wan_ip, source_wan_port,
+         flags, identifier) = self._struct_introduction_request.unpack_from(data, offset)
+        offset += self._struct_introduction_request.size
+
+        sync = self._decode_sync_map.get(flags & int("10", 2))
+        if sync is None:
+            raise DropPacket("Invalid sync flag")
+        if sync:
+            offset, sync = self._decode_introduction_request_sync(flags, offset, data[:first_signature_offset])
+        else:
+            sync = None
+
+        if offset != first_signature_offset:
+            raise DropPacket("Invalid packet size (there are unconverted bytes %d-%d)" % (offset, first_signature_offset))
+
+        if not global_time:
+            raise DropPacket("Invalid global time value (_decode_direct_distribution)")
+
+        connection_type = self._decode_connection_type_map.get(flags & int("11000000", 2))
+        if connection_type is None:
+            raise DropPacket("Invalid connection type flag")
+
+        if verify and not member.verify(data[:first_signature_offset], data[first_signature_offset:]):
+            raise DropPacket("Invalid signature")
+
+        return self.IntroductionRequestRecord(candidate, member, global_time,
+                                              (inet_ntoa(destination_ip), destination_port),
+                                              (inet_ntoa(source_lan_ip), source_lan_port),
+                                              (inet_ntoa(source_wan_ip), source_wan_port),
+                                              self._decode_advice_map[flags & int("1", 2)],
+                                              connection_type,
+                                              identifier,
+                                              sync)
+
     def __str__(self):
         return "<%s %s%s [%s]>" % (self.__class__.__name__, self.dispersy_version.encode("HEX"), self.community_version.encode("HEX"), ", ".join(self._encode_message_map.iterkeys()))
 
@@ -1277,6 +1591,7 @@ class BinaryConversion(NoDefBinaryConversion):
         define(237, u"dispersy-undo-other", self._encode_undo_other, self._decode_undo_other)
         define(236, u"dispersy-dynamic-settings", self._encode_dynamic_settings, self._decode_dynamic_settings)
         # 235 for obsolete dispersy-missing-last-message
+        define(234, u"dispersy-sync-digest", self._encode_sync_digest, self._decode_sync_digest)
 
         if __debug__:
             if debug_non_available:
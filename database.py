@@ -10,6 +10,7 @@ import sys
 import thread
 from abc import ABCMeta, abstractmethod
 from sqlite3 import Connection
+from time import time
 
 from .util import attach_runtime_statistics
 
@@ -77,6 +78,9 @@ class Database(object):
         self._cursor = None
         self._database_version = 0
 
+        # _open_phases contains the duration, in seconds, of each step of the most recent open(...)
+        self._open_phases = {}
+
         # _commit_callbacks contains a list with functions that are called on each database commit
         self._commit_callbacks = []
 
@@ -93,11 +97,18 @@ class Database(object):
         if __debug__:
             self._debug_thread_ident = thread.get_ident()
         self._logger.debug("open database [%s]", self._file_path)
+        self._open_phases = {}
+        start = time()
         self._connect()
+        self._open_phases[u"connect"] = time() - start
         if initial_statements:
+            start = time()
             self._initial_statements()
+            self._open_phases[u"initial_statements"] = time() - start
         if prepare_visioning:
+            start = time()
             self._prepare_version()
+            self._open_phases[u"prepare_version"] = time() - start
         return True
 
     def close(self, commit=True):
@@ -197,6 +208,14 @@ class Database(object):
     def database_version(self):
         return self._database_version
 
+    @property
+    def open_phases(self):
+        """
+        Returns a PHASE:SECONDS dictionary with the duration of the connect, initial_statements, and
+        prepare_version (including any database upgrades) steps of the most recent open(...).
+        """
+        return self._open_phases
+
     @property
     def file_path(self):
         """
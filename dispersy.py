@@ -38,9 +38,9 @@ of, the name it uses as an internal identifier, and the class that will contain
 """
 import logging
 import os
-from collections import defaultdict, Iterable, OrderedDict
+from collections import defaultdict, deque, Iterable, OrderedDict
 from hashlib import sha1
-from itertools import groupby, count
+from itertools import groupby, count, islice
 from pprint import pformat
 from socket import inet_aton
 from struct import unpack_from
@@ -65,12 +65,13 @@ from .distribution import (SyncDistribution, FullSyncDistribution, LastSyncDistr
 from .endpoint import Endpoint
 from .exception import CommunityNotFoundException, ConversionNotFoundException, MetaNotFoundException
 from .member import DummyMember, Member
-from .message import (Message, DropMessage, DelayMessageBySequence,
+from .message import (Message, DropMessage, DropMessageByDuplicate, DelayMessageBySequence,
                       DropPacket, DelayPacket)
-from .statistics import DispersyStatistics, _runtime_statistics
+from .statistics import DispersyStatistics, PhaseTimer, _runtime_statistics
+from .syncscheduler import SyncResponseScheduler
 from .taskmanager import TaskManager
 from .util import (attach_runtime_statistics, init_instrumentation, blocking_call_on_reactor_thread, is_valid_address,
-                   get_lan_address_without_netifaces, address_is_lan_without_netifaces)
+                   get_lan_address_without_netifaces, address_is_lan_without_netifaces, TokenBucket)
 
 
 # Set up the instrumentation utilities
@@ -78,6 +79,16 @@ init_instrumentation()
 
 FLUSH_DATABASE_INTERVAL = 60.0
 STATS_DETAILED_CANDIDATES_INTERVAL = 5.0
+# seconds that lazy communities may be initialized before control is returned to the reactor
+LAZY_LOAD_SLICE = 0.05
+# maximum number of incoming packets handed to one community before the next community gets its turn
+INCOMING_SLICE_PACKETS = 100
+# seconds that incoming packets may be dispatched before control is returned to the reactor
+INCOMING_DISPATCH_SLICE = 0.05
+# maximum number of per-community token buckets, the least recently used bucket is discarded first
+INCOMING_COMMUNITY_BUCKETS = 10000
+# maximum number of per-candidate token buckets, the least recently used bucket is discarded first
+INCOMING_CANDIDATE_BUCKETS = 10000
 
 
 class Dispersy(TaskManager):
@@ -148,6 +159,21 @@ class Dispersy(TaskManager):
         # loaded communities.  cid:Community pairs.
         self._communities = {}
 
+        # communities that are defined but not yet initialized, they are loaded on first use or in the
+        # background.  cid:(cls, master, my_member, args, kargs) pairs.
+        self._lazy_communities = OrderedDict()
+
+        # incoming packets that were admitted but not yet handed to their community, dispatched in round-robin order.
+        # cid:deque([(packets, cache, timestamp, source), ...]) pairs.
+        self._incoming = OrderedDict()
+        self._incoming_dispatching = False
+        # token buckets limiting the incoming packets.  cid:TokenBucket and (cid, sock_addr):TokenBucket pairs.
+        self._incoming_buckets = OrderedDict()
+        self._incoming_candidate_buckets = OrderedDict()
+
+        # sends the sync responses of all communities within the upload budget
+        self._sync_response_scheduler = SyncResponseScheduler(self)
+
         self._check_distribution_batch_map = {DirectDistribution: self._check_direct_distribution_batch,
                                               FullSyncDistribution: self._check_full_sync_distribution_batch,
                                               LastSyncDistribution: self._check_last_sync_distribution_batch}
@@ -273,6 +299,14 @@ class Dispersy(TaskManager):
         """
         return self._endpoint
 
+    @property
+    def sync_response_scheduler(self):
+        """
+        The scheduler that sends the sync responses of all communities.
+        @rtype: SyncResponseScheduler
+        """
+        return self._sync_response_scheduler
+
     def _endpoint_ready(self):
         """
         Guess our LAN and WAN address from information provided by endpoint.
@@ -373,7 +407,7 @@ class Dispersy(TaskManager):
         """
         return self._statistics
 
-    def define_auto_load(self, community_cls, my_member, args=(), kargs=None, load=False):
+    def define_auto_load(self, community_cls, my_member, args=(), kargs=None, load=False, lazy=False):
         """
         Tell Dispersy how to load COMMUNITY if need be.
 
@@ -386,6 +420,10 @@ class Dispersy(TaskManager):
 
         When LOAD is True all available communities of this type will be immediately loaded.
 
+        When LAZY is True, together with LOAD, the available communities are not initialized immediately.
+        Instead they are initialized when a packet arrives for them or when get_community is called, while the
+        remaining ones are initialized in the background during idle reactor ticks.
+
         Returns a list with loaded communities.
         """
         assert isInIOThread(), "Must be called from the callback thread"
@@ -394,6 +432,7 @@ class Dispersy(TaskManager):
         assert kargs is None or isinstance(kargs, dict), type(kargs)
         assert not community_cls.get_classification() in self._auto_load_communities
         assert isinstance(load, bool), type(load)
+        assert isinstance(lazy, bool), type(lazy)
 
         if kargs is None:
             kargs = {}
@@ -403,11 +442,20 @@ class Dispersy(TaskManager):
         if load:
             for master in community_cls.get_master_members(self):
                 if not master.mid in self._communities:
-                    self._logger.debug("Loading %s at start", community_cls.get_classification())
-                    community = community_cls.init_community(self, master, my_member, *args, **kargs)
-                    communities.append(community)
-                    assert community.master_member.mid == master.mid
-                    assert community.master_member.mid in self._communities
+                    if lazy:
+                        self._logger.debug("Lazy loading %s", community_cls.get_classification())
+                        self._lazy_communities[master.mid] = (community_cls, master, my_member, args, kargs)
+                        self._statistics.lazy_pending = len(self._lazy_communities)
+
+                    else:
+                        self._logger.debug("Loading %s at start", community_cls.get_classification())
+                        community = community_cls.init_community(self, master, my_member, *args, **kargs)
+                        communities.append(community)
+                        assert community.master_member.mid == master.mid
+                        assert community.master_member.mid in self._communities
+
+            if self._lazy_communities and not self.is_pending_task_active("load lazy communities"):
+                self.register_task("load lazy communities", reactor.callLater(0, self._load_lazy_communities))
 
         return communities
 
@@ -421,6 +469,61 @@ class Dispersy(TaskManager):
         assert community.get_classification() in self._auto_load_communities
         del self._auto_load_communities[community.get_classification()]
 
+        for cid, (cls, _, _, _, _) in self._lazy_communities.items():
+            if cls is community:
+                del self._lazy_communities[cid]
+        self._statistics.lazy_pending = len(self._lazy_communities)
+
+    def _load_lazy_community(self, cid, on_demand):
+        """
+        Initializes the lazy community identified by CID.
+
+        Returns the Community instance.
+        """
+        assert cid in self._lazy_communities, cid
+        cls, master, my_member, args, kargs = self._lazy_communities.pop(cid)
+
+        start = time()
+        community = cls.init_community(self, master, my_member, *args, **kargs)
+        duration = time() - start
+
+        self._logger.debug("Lazy loaded %s in %.3fs (%s)", community, duration, "on demand" if on_demand else "background")
+        self._statistics.lazy_pending = len(self._lazy_communities)
+        self._statistics.lazy_load_duration += duration
+        if on_demand:
+            self._statistics.lazy_loaded_on_demand += 1
+        else:
+            self._statistics.lazy_loaded_background += 1
+
+        assert community.master_member.mid in self._communities
+        return community
+
+    def _load_lazy_communities(self):
+        """
+        Initializes lazy communities for at most LAZY_LOAD_SLICE seconds, the remaining ones are initialized
+        during the next reactor tick.
+        """
+        deadline = time() + LAZY_LOAD_SLICE
+        while self._lazy_communities and time() < deadline:
+            cid = next(iter(self._lazy_communities))
+            if cid in self._communities:
+                # loaded in a different way in the meantime
+                del self._lazy_communities[cid]
+            else:
+                self._load_lazy_community(cid, False)
+
+        if self._lazy_communities:
+            self.register_task("load lazy communities", reactor.callLater(0, self._load_lazy_communities))
+
+        else:
+            statistics = self._statistics
+            statistics.lazy_pending = 0
+            self._logger.info("lazy loaded %d communities (%d on demand) in %.2fs, all available after %.2fs",
+                              statistics.lazy_loaded_background + statistics.lazy_loaded_on_demand,
+                              statistics.lazy_loaded_on_demand,
+                              statistics.lazy_load_duration,
+                              time() - statistics.start)
+
     def attach_community(self, community):
         # add community to communities dict
         self._communities[community.cid] = community
@@ -432,6 +535,8 @@ class Dispersy(TaskManager):
 
     def detach_community(self, community):
         del self._communities[community.cid]
+        self._incoming_buckets.pop(community.cid, None)
+        self._sync_response_scheduler.discard(community)
 
     def attach_progress_handler(self, func):
         assert callable(func), "handler must be callable"
@@ -479,6 +584,17 @@ class Dispersy(TaskManager):
         if member:
             return member
 
+        start = time()
+        try:
+            return self._load_member(mid, public_key, private_key)
+        finally:
+            self._statistics.member_load_duration += time() - start
+
+    def _load_member(self, mid, public_key, private_key):
+        """
+        Returns a Member instance associated with MID, parsing the key and consulting the database.  See
+        get_member.
+        """
         if private_key:
             key = self.crypto.key_from_private_bin(private_key)
             public_key = self.crypto.key_to_bin(key.pub())
@@ -636,7 +752,8 @@ class Dispersy(TaskManager):
 
         When the community is available but not currently loaded it will be automatically loaded
         when (a) the load parameter is True or (b) the auto_load parameter is True and the auto_load
-        flag for this community is True (this flag is set in the database).
+        flag for this community is True (this flag is set in the database).  Communities that are
+        waiting to be lazy loaded, see define_auto_load, are loaded when either parameter is True.
 
         @param cid: The community identifier.
         @type cid: string, of any size
@@ -659,6 +776,9 @@ class Dispersy(TaskManager):
             return self._communities[cid]
 
         except KeyError:
+            if (load or auto_load) and cid in self._lazy_communities:
+                return self._load_lazy_community(cid, True)
+
             if load or auto_load:
                 try:
                     # have we joined this community
@@ -927,6 +1047,7 @@ class Dispersy(TaskManager):
 
                         # notify that global times have changed
                         # community.update_sync_range(message.meta, [message.distribution.global_time])
+                        community.sync_digest.invalidate([message.distribution.global_time])
 
                 else:
                     self._logger.warning("received message with duplicate community/member/global-time triplet from %s."
@@ -991,7 +1112,7 @@ class Dispersy(TaskManager):
 
                 key = (message.authentication.member.database_id, message.distribution.global_time)
                 if key in unique:
-                    yield DropMessage(message, "duplicate message by member^global_time (1)")
+                    yield DropMessageByDuplicate(message, "duplicate message by member^global_time (1)")
                     continue
 
                 unique.add(key)
@@ -1005,7 +1126,7 @@ class Dispersy(TaskManager):
                                                   (message.authentication.member.database_id, message.database_id, message.distribution.sequence_number - 1)).next()
                     packet = str(packet)
                     if message.packet == packet:
-                        yield DropMessage(message, "duplicate message by binary packet")
+                        yield DropMessageByDuplicate(message, "duplicate message by binary packet")
                         continue
 
                     else:
@@ -1016,11 +1137,15 @@ class Dispersy(TaskManager):
                             # reply with the packet to let the peer know
                             self._send_packets([message.candidate], [packet],
                                 message.community, "-caused by check_full_sync-")
-                            yield DropMessage(message, "duplicate message by sequence number (1)")
+                            yield DropMessageByDuplicate(message, "duplicate message by sequence number (1)")
                             continue
 
                         else:
                             # TODO we should undo the messages that we are about to remove (when applicable)
+                            if message.community.sync_digest.loaded:
+                                message.community.sync_digest.invalidate(
+                                    removed for removed, in execute(u"SELECT global_time FROM sync WHERE member = ? AND meta_message = ? AND global_time >= ?",
+                                                                    (message.authentication.member.database_id, message.database_id, global_time)))
                             execute(u"DELETE FROM sync WHERE member = ? AND meta_message = ? AND global_time >= ?",
                                     (message.authentication.member.database_id, message.database_id, global_time))
 
@@ -1040,7 +1165,7 @@ class Dispersy(TaskManager):
                 # member, and global_time
                 if self._is_duplicate_sync_message(message):
                     # we have the previous message (drop)
-                    yield DropMessage(message, "duplicate message by global_time (1)")
+                    yield DropMessageByDuplicate(message, "duplicate message by global_time (1)")
                     continue
 
                 # ensure that MESSAGE.distribution.global_time > LAST_GLOBAL_TIME
@@ -1066,7 +1191,7 @@ class Dispersy(TaskManager):
 
                 key = (message.authentication.member.database_id, message.distribution.global_time)
                 if key in unique:
-                    yield DropMessage(message, "duplicate message by member^global_time (2)")
+                    yield DropMessageByDuplicate(message, "duplicate message by member^global_time (2)")
                     continue
 
                 unique.add(key)
@@ -1074,7 +1199,7 @@ class Dispersy(TaskManager):
                 # check for duplicates based on community, member, and global_time
                 if self._is_duplicate_sync_message(message):
                     # we have the previous message (drop)
-                    yield DropMessage(message, "duplicate message by global_time (2)")
+                    yield DropMessageByDuplicate(message, "duplicate message by global_time (2)")
                     continue
 
                 # we accept this message
@@ -1140,7 +1265,7 @@ class Dispersy(TaskManager):
                 tim = times[message.authentication.member.database_id]
 
                 if message.distribution.global_time in tim and self._is_duplicate_sync_message(message):
-                    return DropMessage(message, "duplicate message by member^global_time (3)")
+                    return DropMessageByDuplicate(message, "duplicate message by member^global_time (3)")
 
                 elif len(tim) >= message.distribution.history_size and min(tim) > message.distribution.global_time:
                     # we have newer messages (drop)
@@ -1200,7 +1325,7 @@ class Dispersy(TaskManager):
                         # we have the previous message (drop)
                         self._logger.debug("drop %s %s@%d (_is_duplicate_sync_message)",
                                            message.name, members, message.distribution.global_time)
-                        return DropMessage(message, "duplicate message by member^global_time (4)")
+                        return DropMessageByDuplicate(message, "duplicate message by member^global_time (4)")
 
                     if not members in times:
                         # the next query obtains a list with all global times that we have in the
@@ -1230,7 +1355,7 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                                                members,
                                                message.distribution.global_time,
                                                message.candidate)
-                            return DropMessage(message, "duplicate message by binary packet (1)")
+                            return DropMessageByDuplicate(message, "duplicate message by binary packet (1)")
 
                         else:
                             signature_length = sum(member.signature_length for member in message.authentication.members)
@@ -1248,6 +1373,7 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                                     # replace our current message with the other one
                                     self._database.execute(u"UPDATE sync SET member = ?, packet = ? WHERE id = ?",
                                                            (message.authentication.member.database_id, buffer(message.packet), packet_id))
+                                    message.community.sync_digest.invalidate([message.distribution.global_time])
 
                                     return DropMessage(message, "replaced existing packet with other packet with the same payload")
 
@@ -1257,7 +1383,7 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                                 self._logger.warning("received message with duplicate community/members/global-time"
                                                      " triplet from %s.  possibly malicious behavior",
                                                      message.candidate)
-                                return DropMessage(message, "duplicate message by binary packet (2)")
+                                return DropMessageByDuplicate(message, "duplicate message by binary packet (2)")
 
                     elif len(tim) >= message.distribution.history_size and min(tim) > message.distribution.global_time:
                         # we have newer messages (drop)
@@ -1450,7 +1576,10 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
 
         2. Try to obtain the community.
 
-        3. In case 2 suceeded: Pass the packets to the community for further processing.
+        3. In case 2 suceeded: Drop the packets exceeding the incoming packet rate of the community or of their
+           candidate, see _admit_incoming_packets.  Packets with source u"resumed" were admitted before.
+
+        4. Queue the remaining packets and hand them to their communities, see _dispatch_incoming_packets.
 
         """
         assert isinstance(packets, (tuple, list)), packets
@@ -1468,6 +1597,7 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
 
         if self.running:
             self._statistics.total_received += len(packets)
+            now = time()
 
             # Ugly hack to sort the identity messages before any other to avoid sending missing identity requests
             # for identities we have already received but not processed yet. (248 == identity message ID)
@@ -1478,7 +1608,6 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                 # find associated community
                 try:
                     community = self.get_community(community_id)
-                    community.on_incoming_packets(list(iterator), cache, timestamp, source)
 
                 except CommunityNotFoundException:
                     packets = list(iterator)
@@ -1487,9 +1616,124 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                                          len(packets), map(str, candidates))
                     self._statistics.msg_statistics.increase_count(
                         u"drop", u"_convert_packets_into_batch:unknown community")
+
+                else:
+                    packets = list(iterator)
+                    if source != u"resumed":
+                        packets = self._admit_incoming_packets(community, packets, now)
+
+                    if packets:
+                        queue = self._incoming.get(community_id)
+                        if queue is None:
+                            queue = self._incoming[community_id] = deque()
+                        queue.append((packets, cache, timestamp, source))
+
+            # packets arriving while dispatching, i.e. given by a community, are dispatched by the ongoing loop
+            if not self._incoming_dispatching:
+                self._dispatch_incoming_packets()
+
         else:
             self._logger.info("dropping %d packets as dispersy is not running", len(packets))
 
+    def _admit_incoming_packets(self, community, packets, now):
+        """
+        Returns the PACKETS that fit within the per-candidate and per-community token buckets, see
+        Community.dispersy_incoming_packet_rate_per_candidate and Community.dispersy_incoming_packet_rate.
+
+        The candidate buckets are applied first, hence the packets of a flooding candidate do not consume the
+        tokens of the community.  Dropped packets are counted in the MessageStatistics.
+        """
+        buckets = self._incoming_candidate_buckets
+        rate, burst = community.dispersy_incoming_packet_rate_per_candidate
+        admitted = []
+        for packet in packets:
+            candidate = packet[0]
+            if isinstance(candidate, LoopbackCandidate):
+                admitted.append(packet)
+                continue
+
+            key = (community.cid, candidate.sock_addr)
+            # pop and reinsert to keep BUCKETS in least recently used order
+            bucket = buckets.pop(key, None)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst, now)
+                if len(buckets) >= INCOMING_CANDIDATE_BUCKETS:
+                    buckets.popitem(False)
+            buckets[key] = bucket
+
+            if bucket.take(1, now):
+                admitted.append(packet)
+
+        if len(admitted) < len(packets):
+            community.statistics.increase_msg_count(u"drop", u"on_incoming_packets:candidate rate limit",
+                                                    len(packets) - len(admitted))
+
+        buckets = self._incoming_buckets
+        # pop and reinsert to keep BUCKETS in least recently used order
+        bucket = buckets.pop(community.cid, None)
+        if bucket is None:
+            rate, burst = community.dispersy_incoming_packet_rate
+            bucket = TokenBucket(rate, burst, now)
+            if len(buckets) >= INCOMING_COMMUNITY_BUCKETS:
+                buckets.popitem(False)
+        buckets[community.cid] = bucket
+
+        taken = bucket.take(len(admitted), now)
+        if taken < len(admitted):
+            community.statistics.increase_msg_count(u"drop", u"on_incoming_packets:community rate limit",
+                                                    len(admitted) - taken)
+            admitted = admitted[:taken]
+
+        return admitted
+
+    def _dispatch_incoming_packets(self):
+        """
+        Hands the queued incoming packets to their communities, at most INCOMING_SLICE_PACKETS packets per community
+        per turn, in round-robin order.  Hence a community receiving a large burst does not delay the packets of the
+        other communities until its burst is processed.
+
+        Packets are dispatched for at most INCOMING_DISPATCH_SLICE seconds, the remaining packets are dispatched
+        during the next reactor tick.
+        """
+        incoming = self._incoming
+        self._incoming_dispatching = True
+        deadline = time() + INCOMING_DISPATCH_SLICE
+        try:
+            while incoming and self.running:
+                community_id, queue = incoming.popitem(False)
+                packets, cache, timestamp, source = queue[0]
+                if len(packets) > INCOMING_SLICE_PACKETS:
+                    queue[0] = (packets[INCOMING_SLICE_PACKETS:], cache, timestamp, source)
+                    packets = packets[:INCOMING_SLICE_PACKETS]
+                else:
+                    queue.popleft()
+
+                if queue:
+                    # the community is queued again behind all other communities
+                    incoming[community_id] = queue
+
+                try:
+                    community = self.get_community(community_id)
+                except CommunityNotFoundException:
+                    self._statistics.msg_statistics.increase_count(
+                        u"drop", u"_convert_packets_into_batch:unknown community", len(packets))
+                else:
+                    community.on_incoming_packets(packets, cache, timestamp, source)
+
+                if time() >= deadline:
+                    break
+
+        finally:
+            if incoming and self.running:
+                # packets arriving in the meantime are queued and dispatched by the scheduled call
+                self.register_task("dispatch incoming packets",
+                                   reactor.callLater(0, self._dispatch_incoming_packets))
+            else:
+                self._incoming_dispatching = False
+
+        if not self.running:
+            incoming.clear()
+
     @attach_runtime_statistics(u"Dispersy.{function_name} {1[0].name}")
     def _store(self, messages):
         """
@@ -1564,6 +1808,8 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                 highest_sequence_number[message.authentication.member.database_id] = max(highest_sequence_number[message.authentication.member.database_id], message.distribution.sequence_number)
 
 
+        meta.community.sync_digest.add(messages)
+
         if __debug__ and highest_sequence_number:
             # when sequence numbers are enabled, we must have exactly
             # message.distribution.sequence_number messages in the database
@@ -1612,6 +1858,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                     self._database.executemany(u"DELETE FROM double_signed_sync WHERE sync = ?", [(syncid,) for syncid, _ in items])
 
                 # update_sync_range.update(global_time for _, _, global_time in items)
+                meta.community.sync_digest.invalidate(global_time for _, global_time in items)
 
             # 12/10/11 Boudewijn: verify that we do not have to many packets in the database
             if __debug__:
@@ -1709,13 +1956,20 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         assert all(message.community == messages[0].community for message in messages)
         assert all(message.meta == messages[0].meta for message in messages)
 
+        statistics = messages[0].community.statistics
+        name = messages[0].name
+
         store = store and isinstance(messages[0].meta.distribution, SyncDistribution)
         if store:
+            start = time()
             self._store(messages)
+            statistics.record_latency(u"store", name, time() - start)
 
         if update:
+            start = time()
             if self._update(possibly_messages) == False:
                 return False
+            statistics.record_latency(u"handle", name, time() - start)
 
         # 07/10/11 Boudewijn: we will only commit if it the message was create by our self.
         # Otherwise we can safely skip the commit overhead, since, if a crash occurs, we will be
@@ -1729,7 +1983,10 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                 messages[0].community.statistics.increase_msg_count(u"created", messages[0].meta.name, my_messages)
 
         if forward:
-            return self._forward(messages)
+            start = time()
+            result = self._forward(messages)
+            statistics.record_latency(u"forward", name, time() - start)
+            return result
 
         return True
 
@@ -1761,7 +2018,8 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
            message.destination.candidates.
 
          - CommunityDestination causes a message to be sent to one or more addresses to be picked
-           from the database candidate table.
+           from the database candidate table.  The candidates are picked once for all MESSAGES, and
+           all packets are handed to the endpoint in a single send_many call.
 
         @param messages: A sequence with one or more messages.
         @type messages: [Message.Implementation]
@@ -1774,19 +2032,38 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
 
         result = True
         meta = messages[0].meta
-        if isinstance(meta.destination, (CommunityDestination, CandidateDestination)):
+        if isinstance(meta.destination, CommunityDestination) and meta.destination.node_count > 0:
+            node_count = meta.destination.node_count
+            # pick the candidates once for all messages, enough to complete any message whose explicit
+            # candidates are among them
+            picked = list(islice(meta.community.dispersy_yield_verified_candidates(),
+                                 node_count + max(len(message.destination.candidates) for message in messages)))
+
+            sends = []
+            message_candidates = []
             for message in messages:
-                # CandidateDestination.candidates may be empty
                 candidates = set(message.destination.candidates)
-                # CommunityDestination.node_count is allowed to be zero
-                if isinstance(meta.destination, CommunityDestination) and meta.destination.node_count > 0:
-                    max_candidates = meta.destination.node_count + len(candidates)
-                    for candidate in meta.community.dispersy_yield_verified_candidates():
-                        if len(candidates) < max_candidates:
-                            candidates.add(candidate)
-                        else:
-                            break
-                result = result and self._send(tuple(candidates), [message])
+                max_candidates = node_count + len(candidates)
+                for candidate in picked:
+                    if len(candidates) < max_candidates:
+                        candidates.add(candidate)
+                    else:
+                        break
+                if candidates:
+                    sends.extend((candidate, message.packet) for candidate in candidates)
+                    message_candidates.append((message, candidates))
+                else:
+                    result = False
+
+            if sends and self._endpoint.send_many(sends):
+                self._update_send_statistics(message_candidates)
+            else:
+                result = False
+
+        elif isinstance(meta.destination, (CommunityDestination, CandidateDestination)):
+            for message in messages:
+                # CandidateDestination.candidates may be empty, CommunityDestination.node_count is allowed to be zero
+                result = self._send(tuple(message.destination.candidates), [message]) and result
         else:
             raise NotImplementedError(meta.destination)
 
@@ -1835,20 +2112,36 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
             messages_send = self._endpoint.send(candidates, packets)
 
         if messages_send:
-            for message in messages:
-                if message.meta.name == u"dispersy-introduction-request":
-                    for candidate in candidates:
-                        message.community.statistics.msg_statistics.walk_attempt_count += 1
-                        message.community.statistics.increase_msg_count(u"outgoing_intro", candidate.sock_addr)
+            self._update_send_statistics([(message, candidates) for message in messages])
 
-                        self.statistics.walk_attempt_count += 1
-                        self.statistics.outgoing_intro_count += 1
-                        self.statistics.dict_inc(u"outgoing_intro_dict", candidate.sock_addr)
+        return messages_send
 
-                message.community.statistics.increase_msg_count(
-                    u"outgoing", message.meta.name, len(candidates))
+    def _update_send_statistics(self, message_candidates):
+        """
+        Update the statistics for messages that were sent.
 
-        return messages_send
+        The outgoing message count is increased once for each meta message, rather than once for
+        each message.
+
+        @param message_candidates: A sequence with (message, candidates) tuples.
+        @type message_candidates: [(Message.Implementation, [Candidate])]
+        """
+        outgoing = {}
+        for message, candidates in message_candidates:
+            if message.meta.name == u"dispersy-introduction-request":
+                for candidate in candidates:
+                    message.community.statistics.msg_statistics.walk_attempt_count += 1
+                    message.community.statistics.increase_msg_count(u"outgoing_intro", candidate.sock_addr)
+
+                    self.statistics.walk_attempt_count += 1
+                    self.statistics.outgoing_intro_count += 1
+                    self.statistics.dict_inc(u"outgoing_intro_dict", candidate.sock_addr)
+
+            key = (message.community, message.meta.name)
+            outgoing[key] = outgoing.get(key, 0) + len(candidates)
+
+        for (community, name), value in outgoing.iteritems():
+            community.statistics.increase_msg_count(u"outgoing", name, value)
 
     def _send_packets(self, candidates, packets, community, msg_type):
         """A wrap method to use send() in endpoint.
@@ -2111,15 +2404,21 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         # start
         self._logger.info("starting the Dispersy core...")
         results = []
+        timer = PhaseTimer(self._statistics, u"startup")
 
         assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
 
         results.append((u"database", self._database.open()))
         assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
+        timer.phase(u"database")
+        for phase, duration in self._database.open_phases.iteritems():
+            self._statistics.startup[u"database:" + phase] = duration
+            self._statistics.mark_dirty(u"startup", u"database:" + phase)
 
         results.append((u"endpoint", self._endpoint.open(self)))
         assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
         self._endpoint_ready()
+        timer.phase(u"endpoint")
 
         # commit changes to the database periodically
         self.register_task("flush_database", LoopingCall(self._flush_database)).start(FLUSH_DATABASE_INTERVAL)
@@ -2139,6 +2438,10 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
 
                 # TODO: pass None instead of new member, let community decide if we need a new member or not.
                 self._discovery_community = self.define_auto_load(DiscoveryCommunity, self.get_new_member(), load=True)[0]
+                timer.phase(u"discovery")
+
+            self._logger.info("Dispersy core started in %.2fs",
+                              sum(duration for phase, duration in self._statistics.startup.iteritems() if not u":" in phase))
             return True
 
         else:
@@ -2172,6 +2475,9 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         self.running = False
 
         self.cancel_all_pending_tasks()
+        self._incoming.clear()
+        self._incoming_dispatching = False
+        self._sync_response_scheduler.clear()
 
         def unload_communities(communities):
             for community in communities:
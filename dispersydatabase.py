@@ -12,7 +12,7 @@ from .database import Database
 from .distribution import FullSyncDistribution
 
 
-LATEST_VERSION = 21
+LATEST_VERSION = 22
 
 schema = u"""
 CREATE TABLE member(
@@ -63,6 +63,12 @@ CREATE TABLE sync(
 CREATE INDEX sync_meta_message_undone_global_time_index ON sync(meta_message, undone, global_time);
 CREATE INDEX sync_meta_message_member ON sync(meta_message, member);
 
+CREATE TABLE timeline_snapshot(
+ community INTEGER PRIMARY KEY REFERENCES community(id),
+ sync INTEGER,                                          -- the highest sync(id) that is part of the snapshot
+ count INTEGER,                                         -- the number of permission packets up to sync(id)
+ snapshot BLOB);                                        -- marshalled Timeline.get_snapshot()
+
 CREATE TABLE option(key TEXT PRIMARY KEY, value BLOB);
 INSERT INTO option(key, value) VALUES('database_version', '""" + str(LATEST_VERSION) + """');
 """
@@ -491,10 +497,26 @@ UPDATE option SET value = '21' WHERE key = 'database_version';""")
                 self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
 
             new_db_version = 22
+            if database_version < new_db_version:
+                # add the timeline_snapshot table, allowing the timeline to be restored without replaying every
+                # permission packet
+                self._logger.debug("upgrade database %d -> %d", database_version, new_db_version)
+                self.executescript(u"""
+CREATE TABLE timeline_snapshot(
+ community INTEGER PRIMARY KEY REFERENCES community(id),
+ sync INTEGER,                                          -- the highest sync(id) that is part of the snapshot
+ count INTEGER,                                         -- the number of permission packets up to sync(id)
+ snapshot BLOB);                                        -- marshalled Timeline.get_snapshot()
+
+UPDATE option SET value = '22' WHERE key = 'database_version';""")
+                self.commit()
+                self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
+
+            new_db_version = 23
             if database_version < new_db_version:
                 # there is no version new_db_version yet...
                 # self._logger.debug("upgrade database %d -> %d", database_version, new_db_version)
-                # self.executescript(u"""UPDATE option SET value = '22' WHERE key = 'database_version';""")
+                # self.executescript(u"""UPDATE option SET value = '23' WHERE key = 'database_version';""")
                 # self.commit()
                 # self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
                 pass
@@ -9,6 +9,7 @@ from select import select
 from time import time
 
 from twisted.internet import reactor
+from twisted.python.threadable import isInIOThread
 
 from .candidate import Candidate
 
@@ -41,6 +42,21 @@ class Endpoint(object):
     def send_packet(self, candidate, packet):
         pass
 
+    def send_many(self, sends):
+        """
+        Sends each (candidate, packet) pair in SENDS.
+
+        Endpoints that can send a list of packets to different candidates more efficiently than one send_packet call
+        per packet may override this method.  Such an override must still use send_packet when a subclass overrides
+        send_packet, since send_packet is where subclasses intercept the outgoing packets.
+        @return: True when one or more packets were sent.
+        """
+        send_packet = False
+        for candidate, packet in sends:
+            if self.send_packet(candidate, packet):
+                send_packet = True
+        return send_packet
+
     def open(self, dispersy):
         self._dispersy = dispersy
         return True
@@ -96,14 +112,21 @@ class NullEndpoint(Endpoint):
             raise RuntimeError("UDP does not support %d byte packets" % len(packet))
         self._dispersy.statistics.total_up += len(packet)
 
+    def send_many(self, sends):
+        if any(len(packet) > 2 ** 16 - 60 for _, packet in sends):
+            raise RuntimeError("UDP does not support %d byte packets" % max(len(packet) for _, packet in sends))
+        self._dispersy.statistics.total_up += sum(len(packet) for _, packet in sends)
+
 
 class StandaloneEndpoint(Endpoint):
 
-    def __init__(self, port, ip="0.0.0.0"):
+    def __init__(self, port, ip="0.0.0.0", reuse_port=False):
         super(StandaloneEndpoint, self).__init__()
 
         self._port = port
         self._ip = ip
+        # when True, other processes may bind the same port and the kernel distributes the incoming packets
+        self._reuse_port = reuse_port
         self._running = False
         self._add_task = lambda task, delay = 0.0, id = "": None
         self._sendqueue_lock = threading.RLock()
@@ -132,11 +155,16 @@ class StandaloneEndpoint(Endpoint):
                 self._logger.debug("Listening at %d", self._port)
                 self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
                 self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 870400)
+                if self._reuse_port:
+                    self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
                 self._socket.bind((self._ip, self._port))
                 self._socket.setblocking(0)
 
                 self._port = self._socket.getsockname()[1]
             except socket.error:
+                if self._reuse_port:
+                    # the port is shared with the other processes, trying the next one is pointless
+                    raise
                 self._port += 1
                 continue
             break
@@ -224,7 +252,6 @@ class StandaloneEndpoint(Endpoint):
                 normal_packets.append(packet)
 
         if normal_packets:
-            self._dispersy.statistics.total_down += sum(len(data) for _, data in normal_packets)
             if self._logger.isEnabledFor(logging.DEBUG):
                 for sock_addr, data in normal_packets:
                     self.log_packet(sock_addr, data, outbound=False)
@@ -234,6 +261,8 @@ class StandaloneEndpoint(Endpoint):
 
     def dispersythread_data_came_in(self, packets, timestamp, cache=True):
         assert self._dispersy, "Should not be called before open(...)"
+        # the statistics are only modified on the reactor thread
+        self._dispersy.statistics.total_down += sum(len(data) for _, data in packets)
 
         def strip_if_tunnel(packets):
             for sock_addr, data in packets:
@@ -257,18 +286,10 @@ class StandaloneEndpoint(Endpoint):
         assert all(isinstance(packet, str) for packet in packets), [type(packet) for packet in packets]
         assert all(len(packet) > 0 for packet in packets), [len(packet) for packet in packets]
 
-        prefix = prefix or ''
-        packets = [prefix + packet for packet in packets]
+        if prefix:
+            packets = [prefix + packet for packet in packets]
 
-        if any(len(packet) > 2 ** 16 - 60 for packet in packets):
-            raise RuntimeError("UDP does not support %d byte packets" % max(len(packet) for packet in packets))
-
-        send_packet = False
-        for candidate, packet in product(candidates, packets):
-            if self.send_packet(candidate, packet):
-                send_packet = True
-
-        return send_packet
+        return self.send_many(list(product(candidates, packets)))
 
     def send_packet(self, candidate, packet, prefix=None):
         assert self._dispersy, "Should not be called before open(...)"
@@ -284,6 +305,37 @@ class StandaloneEndpoint(Endpoint):
         self._dispersy.statistics.total_up += len(packet)
         self._dispersy.statistics.total_send += 1
 
+        self._sendto(candidate, packet)
+        return True
+
+    def send_many(self, sends):
+        """
+        Sends each (candidate, packet) pair in SENDS.
+
+        The same packet is usually sent to many candidates, hence the packets are checked and the statistics are
+        updated once for the entire list rather than once per pair.  When a subclass overrides send_packet, each pair
+        is given to send_packet instead.
+        """
+        assert self._dispersy, "Should not be called before open(...)"
+        assert isinstance(sends, list), type(sends)
+        assert all(isinstance(candidate, Candidate) for candidate, _ in sends), [type(candidate) for candidate, _ in sends]
+        assert all(isinstance(packet, str) and len(packet) > 0 for _, packet in sends), [type(packet) for _, packet in sends]
+
+        if type(self).send_packet.im_func is not StandaloneEndpoint.send_packet.im_func:
+            return super(StandaloneEndpoint, self).send_many(sends)
+
+        if any(len(packet) > 2 ** 16 - 60 for _, packet in sends):
+            raise RuntimeError("UDP does not support %d byte packets" % max(len(packet) for _, packet in sends))
+
+        self._dispersy.statistics.total_up += sum(len(packet) for _, packet in sends)
+        self._dispersy.statistics.total_send += len(sends)
+
+        sendto = self._sendto
+        for candidate, packet in sends:
+            sendto(candidate, packet)
+        return bool(sends)
+
+    def _sendto(self, candidate, packet):
         data = TUNNEL_PREFIX + packet if candidate.tunnel else packet
 
         try:
@@ -301,8 +353,6 @@ class StandaloneEndpoint(Endpoint):
             if not did_have_senqueue:
                 self._process_sendqueue()
 
-        return True
-
     def _process_sendqueue(self):
         assert self._dispersy, "Should not be called before start(...)"
         with self._sendqueue_lock:
@@ -340,7 +390,11 @@ class StandaloneEndpoint(Endpoint):
                     self._add_task(self._process_sendqueue, 0.1, "process_sendqueue")
                     self._logger.debug("%d left in sendqueue", len(self._sendqueue))
 
-                self._dispersy.statistics.cur_sendqueue = len(self._sendqueue)
+                # the statistics are only modified on the reactor thread, while _loop runs on the endpoint thread
+                if isInIOThread():
+                    self._dispersy.statistics.cur_sendqueue = len(self._sendqueue)
+                else:
+                    reactor.callFromThread(setattr, self._dispersy.statistics, "cur_sendqueue", len(self._sendqueue))
 
 
 class ManualEnpoint(StandaloneEndpoint):
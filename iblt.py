@@ -0,0 +1,264 @@
+"""
+This module provides the invertible bloom lookup table used for set reconciliation.
+
+An invertible bloom lookup table (IBLT) stores, for each cell, the number of keys that were added to it, the xor of
+those keys, and the xor of a checksum of those keys.  Subtracting the table of one set from the table of another set
+cancels all keys that both sets have in common, the remaining keys, i.e. the difference between the two sets, can then
+be listed by repeatedly removing the keys from cells that contain exactly one key.  Listing succeeds with high
+probability when the difference is smaller than about 2/3 of the number of cells, regardless of the size of the sets.
+
+Each packet is represented by a 64 bit key, the first eight bytes of the sha1 digest of the packet.  The cells are
+stored in the wire format: a big endian unsigned short count (modulo 2^16), unsigned long long key sum, and unsigned
+long check sum.
+"""
+
+from hashlib import sha1
+from itertools import islice
+from struct import Struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# the count, key sum, and check sum of one cell
+_struct_cell = Struct(">HQL")
+_struct_key = Struct(">Q")
+# the cell offsets of, at most, four hash functions followed by the check sum
+_struct_hash = Struct(">LLLLL")
+
+# number of bytes that one cell occupies on the wire
+CELL_SIZE = _struct_cell.size
+# default number of cells that each key is added to
+DEFAULT_FUNCTIONS = 3
+MAX_FUNCTIONS = 4
+
+
+def get_key(packet):
+    """
+    Returns the 64 bit key that represents PACKET.
+    @rtype: long
+    """
+    return _struct_key.unpack_from(sha1(packet).digest())[0]
+
+
+class InvertibleBloomLookupTable(object):
+
+    """
+    An invertible bloom lookup table over packet keys.
+
+    The InvertibleBloomLookupTable constructor takes parameters that are interpreted differently, depending on their
+    type:
+
+    - InvertibleBloomLookupTable(int:m_size, int:k_functions=DEFAULT_FUNCTIONS, str:prefix="")
+
+      Will create an empty table that occupies at most m_size bits on the wire.  The number of cells is rounded down to
+      a multiple of k_functions.
+
+    - InvertibleBloomLookupTable(str:bytes, int:k_functions, str:prefix="")
+
+      Will create a table from its wire format, typically used to retrieve a table that was serialised.
+
+    The cells are divided into k_functions equally sized partitions, each key is added to one cell in each partition.
+    The PREFIX salts the hash functions, tables must have the same size, functions, and prefix to be subtracted.
+    """
+
+    def __init__(self, *args, **kargs):
+        # matches: InvertibleBloomLookupTable(str:bytes, int:k_functions, str:prefix="")
+        if len(args) >= 2 and isinstance(args[0], str) and isinstance(args[1], int):
+            bytes_, k_functions = args[:2]
+            prefix = kargs.get("prefix", args[2] if len(args) >= 3 else "")
+            assert len(bytes_) % CELL_SIZE == 0, len(bytes_)
+            m_cells = len(bytes_) // CELL_SIZE
+            cells = [_struct_cell.unpack_from(bytes_, offset) for offset in xrange(0, len(bytes_), CELL_SIZE)]
+            self._counts = [count for count, _, _ in cells]
+            self._key_sums = [key_sum for _, key_sum, _ in cells]
+            self._check_sums = [check_sum for _, _, check_sum in cells]
+
+        # matches: InvertibleBloomLookupTable(int:m_size, int:k_functions=DEFAULT_FUNCTIONS, str:prefix="")
+        elif len(args) >= 1 and isinstance(args[0], int):
+            m_size = args[0]
+            k_functions = kargs.get("k_functions", args[1] if len(args) >= 2 else DEFAULT_FUNCTIONS)
+            prefix = kargs.get("prefix", args[2] if len(args) >= 3 else "")
+            assert 0 < m_size, m_size
+            m_cells = max(k_functions, m_size // 8 // CELL_SIZE // k_functions * k_functions)
+            self._counts = [0] * m_cells
+            self._key_sums = [0] * m_cells
+            self._check_sums = [0] * m_cells
+
+        else:
+            raise RuntimeError("Unknown combination of argument types %s" % str([type(arg) for arg in args]))
+
+        assert isinstance(k_functions, int), type(k_functions)
+        assert 0 < k_functions <= MAX_FUNCTIONS, k_functions
+        assert m_cells % k_functions == 0, [m_cells, k_functions]
+        assert isinstance(prefix, str), type(prefix)
+        self._m_cells = m_cells
+        self._k_functions = k_functions
+        self._prefix = prefix
+        self._partition = m_cells // k_functions
+        self._salt = sha1(prefix)
+        # True or False after not_filter has tried to list the difference, None before
+        self._decoded = None
+
+    @property
+    def size(self):
+        """
+        The size of the table in bits.
+        @rtype: int
+        """
+        return self._m_cells * CELL_SIZE * 8
+
+    @property
+    def cells(self):
+        return self._m_cells
+
+    @property
+    def functions(self):
+        return self._k_functions
+
+    @property
+    def prefix(self):
+        return self._prefix
+
+    @property
+    def bytes(self):
+        pack = _struct_cell.pack
+        return "".join(pack(count, key_sum, check_sum)
+                       for count, key_sum, check_sum in zip(self._counts, self._key_sums, self._check_sums))
+
+    @property
+    def decoded(self):
+        """
+        True when not_filter listed the difference, False when it failed, or None when not_filter was not used.
+        """
+        return self._decoded
+
+    def get_capacity(self):
+        """
+        Returns the size of the difference that can usually be listed.
+        @rtype: int
+        """
+        return self._m_cells * 2 // 3
+
+    def _hash(self, key):
+        hash_ = self._salt.copy()
+        hash_.update(_struct_key.pack(key))
+        return _struct_hash.unpack(hash_.digest())
+
+    def _update(self, key, delta):
+        counts = self._counts
+        key_sums = self._key_sums
+        check_sums = self._check_sums
+        partition = self._partition
+
+        hashes = self._hash(key)
+        check = hashes[-1]
+        for function in xrange(self._k_functions):
+            index = function * partition + hashes[function] % partition
+            counts[index] = (counts[index] + delta) & 0xFFFF
+            key_sums[index] ^= key
+            check_sums[index] ^= check
+
+    def add(self, packet):
+        """
+        Add the key of PACKET to the table.
+        """
+        self._update(get_key(packet), 1)
+
+    def add_keys(self, packets):
+        """
+        Add the keys of a sequence of PACKETS to the table.
+        """
+        for packet in packets:
+            assert isinstance(packet, str), type(packet)
+            self._update(get_key(packet), 1)
+
+    def subtract(self, other):
+        """
+        Returns a new table containing the keys in SELF that are not in OTHER, with a count of one, and the keys in
+        OTHER that are not in SELF, with a count of minus one.
+        """
+        assert isinstance(other, InvertibleBloomLookupTable), type(other)
+        assert (self._m_cells, self._k_functions, self._prefix) == (other.cells, other.functions, other.prefix)
+        difference = InvertibleBloomLookupTable(self._m_cells * CELL_SIZE * 8, self._k_functions, self._prefix)
+        difference._counts = [(count - other_count) & 0xFFFF for count, other_count in zip(self._counts, other._counts)]
+        difference._key_sums = [key_sum ^ other_key_sum for key_sum, other_key_sum in zip(self._key_sums, other._key_sums)]
+        difference._check_sums = [check_sum ^ other_check_sum
+                                  for check_sum, other_check_sum in zip(self._check_sums, other._check_sums)]
+        return difference
+
+    def decode(self):
+        """
+        Lists the keys in the table.
+
+        Returns a (positive_keys, negative_keys) tuple with the sets of keys that have a count of one and minus one,
+        or None when the table contains too many keys to list them.  The table is emptied in the process.
+        """
+        counts = self._counts
+        key_sums = self._key_sums
+        check_sums = self._check_sums
+        positive = set()
+        negative = set()
+
+        def is_pure(index):
+            return counts[index] in (1, 0xFFFF) and self._hash(key_sums[index])[-1] == check_sums[index]
+
+        pure = [index for index in xrange(self._m_cells) if is_pure(index)]
+        while pure:
+            index = pure.pop()
+            if not is_pure(index):
+                continue
+
+            key = key_sums[index]
+            if counts[index] == 1:
+                positive.add(key)
+                self._update(key, -1)
+            else:
+                negative.add(key)
+                self._update(key, 1)
+
+            partition = self._partition
+            hashes = self._hash(key)
+            pure.extend(index for index in (function * partition + hashes[function] % partition
+                                            for function in xrange(self._k_functions))
+                        if is_pure(index))
+
+        if any(counts) or any(key_sums) or any(check_sums):
+            return None
+        return positive, negative
+
+    def not_filter(self, iterator, max_items=None):
+        """
+        Yields all tuples in ITERATOR where the first element, a packet, is NOT in the table.
+
+        Unlike BloomFilter.not_filter the ITERATOR is consumed before the first tuple is yielded, because the table of
+        all packets in ITERATOR is required to list the difference.  Nothing is yielded when the difference is too large
+        to be listed, see the decoded property.
+
+        When MAX_ITEMS is given and ITERATOR contains more than MAX_ITEMS tuples, at most MAX_ITEMS + 1 tuples are
+        consumed, nothing is hashed, and nothing is yielded.
+        """
+        if max_items is None:
+            tuples = list(iterator)
+        else:
+            tuples = list(islice(iterator, max_items + 1))
+            if len(tuples) > max_items:
+                self._decoded = False
+                logger.debug("not listing the difference with more than %d packets", max_items)
+                return
+
+        local = InvertibleBloomLookupTable(self.size, self._k_functions, self._prefix)
+        keys = [get_key(tup[0]) for tup in tuples]
+        for key in keys:
+            local._update(key, 1)
+
+        difference = local.subtract(self).decode()
+        self._decoded = difference is not None
+        if difference is None:
+            logger.debug("unable to list the difference between %d packets and a table with %d cells",
+                         len(tuples), self._m_cells)
+            return
+
+        missing, _ = difference
+        for key, tup in zip(keys, tuples):
+            if key in missing:
+                yield tup
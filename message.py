@@ -83,8 +83,7 @@ class DelayPacketByMissingMember(DelayPacket):
         return (self._cid, u"dispersy-identity", self._missing_member_id, None, []),
 
     def send_request(self, community, candidate):
-        return community.create_missing_identity(candidate,
-                    community.dispersy.get_member(mid=self._missing_member_id))
+        return community.request_missing_identity(candidate, self._missing_member_id)
 
 
 class DelayPacketByMissingMessage(DelayPacket):
@@ -101,7 +100,7 @@ class DelayPacketByMissingMessage(DelayPacket):
         return (self._cid, None, self._member.mid, self._global_time, []),
 
     def send_request(self, community, candidate):
-        return community.create_missing_message(candidate, self._member, self._global_time)
+        return community.request_missing_message(candidate, self._member, self._global_time)
 
 
 class DropPacket(Exception):
@@ -183,7 +182,7 @@ class DelayMessageByMissingMessage(DelayMessage):
         return (self._cid, None, self._member.mid, self._global_time, []),
 
     def send_request(self, community, candidate):
-        community.create_missing_message(candidate, self._member, self._global_time)
+        community.request_missing_message(candidate, self._member, self._global_time)
 
 
 class DropMessage(Exception):
@@ -214,6 +213,14 @@ class DropMessage(Exception):
         return "".join((super(DropMessage, self).__str__(), " [", self._dropped.name, "]"))
 
 
+class DropMessageByDuplicate(DropMessage):
+
+    """
+    Drops a message because the same message, or another message it conflicts with, was already received.
+    """
+    pass
+
+
 #
 # batch
 #
@@ -1,5 +1,7 @@
 from .meta import MetaObject
 from .bloomfilter import BloomFilter
+from .iblt import InvertibleBloomLookupTable
+from .syncdigest import RangeDigests, SYNC_DIGEST_MAX_RANGES
 
 if __debug__:
     def is_address(address):
@@ -65,7 +67,10 @@ class IntroductionRequestPayload(Payload):
                packets in that range.
 
                BLOOM_FILTER is a BloomFilter object containing all packets that the sender has in
-               the given sync range.
+               the given sync range.  Or an InvertibleBloomLookupTable with those packets, allowing the
+               receiver to list the packets that the sender is missing, see
+               Community._dispersy_claim_sync_reconciliation.  Or RangeDigests summarising those packets,
+               see Community._dispersy_claim_sync_digest, in which case MODULO must be 1 and OFFSET 0.
 
             IDENTIFIER is a number that must be given in the associated introduction-response.  This
             number allows to distinguish between multiple introduction-response messages.
@@ -96,7 +101,7 @@ class IntroductionRequestPayload(Payload):
                 assert 0 < self._modulo < 2 ** 16, self._modulo
                 assert isinstance(self._offset, int), type(self._offset)
                 assert 0 <= self._offset < self._modulo, [self._offset, self._modulo]
-                assert isinstance(self._bloom_filter, BloomFilter)
+                assert isinstance(self._bloom_filter, (BloomFilter, InvertibleBloomLookupTable, RangeDigests))
             else:
                 self._time_low, self._time_high, self._modulo, self._offset, self._bloom_filter = 0, 0, 1, 0, None
 
@@ -629,6 +634,48 @@ class MissingProofPayload(Payload):
             return self._global_time
 
 
+class SyncDigestPayload(Payload):
+
+    class Implementation(Payload.Implementation):
+
+        def __init__(self, meta, time_low, time_high, ranges, differences):
+            """
+            Create a new payload container for a dispersy-sync-digest message.
+
+            This message is the reply to a dispersy-introduction-request with RangeDigests.  The range
+            [TIME_LOW, TIME_HIGH] is divided into RANGES ranges, see syncdigest.get_ranges, DIFFERENCES are the
+            indexes of the ranges whose digest differs from the digest of the sender.
+            """
+            assert isinstance(time_low, (int, long))
+            assert isinstance(time_high, (int, long))
+            assert 0 < time_low <= time_high
+            assert isinstance(ranges, int)
+            assert 0 < ranges <= SYNC_DIGEST_MAX_RANGES
+            assert isinstance(differences, list)
+            assert all(isinstance(index, int) and 0 <= index < ranges for index in differences)
+            super(SyncDigestPayload.Implementation, self).__init__(meta)
+            self._time_low = time_low
+            self._time_high = time_high
+            self._ranges = ranges
+            self._differences = differences
+
+        @property
+        def time_low(self):
+            return self._time_low
+
+        @property
+        def time_high(self):
+            return self._time_high
+
+        @property
+        def ranges(self):
+            return self._ranges
+
+        @property
+        def differences(self):
+            return self._differences
+
+
 class DynamicSettingsPayload(Payload):
 
     class Implementation(Payload.Implementation):
@@ -1,4 +1,6 @@
-from random import random
+from collections import defaultdict
+from random import random, choice
+from struct import unpack_from
 import logging
 
 from twisted.internet import reactor
@@ -52,14 +54,7 @@ class RandomNumberCache(NumberCache):
 
     @classmethod
     def find_unclaimed_identifier(cls, request_cache, prefix):
-        for _ in xrange(1000):
-            number = int(random() * 2 ** 16)
-            if not request_cache.has(prefix, number):
-                break
-        else:
-            raise RuntimeError("Could not find a number that isn't in use")
-
-        return number
+        return request_cache.claim_number(prefix)
 
 
 class SignatureRequestCache(RandomNumberCache):
@@ -128,8 +123,85 @@ class IntroductionRequestCache(RandomNumberCache):
         self._check_if_both_received()
 
 
+class MissingIdentityCache(NumberCache):
+
+    """
+    Marks the dispersy-identity of a member as requested from the candidates in CANDIDATES, these candidates are not
+    asked again until the cache times out.
+    """
+
+    @staticmethod
+    def number_for(mid):
+        return unpack_from(">Q", mid)[0]
+
+    def __init__(self, request_cache, mid):
+        super(MissingIdentityCache, self).__init__(request_cache, u"missing-identity", self.number_for(mid))
+        # the sock_addr of every candidate that was asked
+        self.candidates = set()
+
+    @property
+    def timeout_delay(self):
+        return 5.0
+
+    def on_timeout(self):
+        pass
+
+
+class MissingMessageCache(NumberCache):
+
+    """
+    Marks a message, identified by member and global time, as requested from the candidates in CANDIDATES, these
+    candidates are not asked again until the cache times out.
+    """
+
+    @staticmethod
+    def number_for(member, global_time):
+        return (member.database_id << 64) | global_time
+
+    def __init__(self, request_cache, member, global_time):
+        super(MissingMessageCache, self).__init__(request_cache, u"missing-message", self.number_for(member, global_time))
+        # the sock_addr of every candidate that was asked
+        self.candidates = set()
+
+    @property
+    def timeout_delay(self):
+        return 5.0
+
+    def on_timeout(self):
+        pass
+
+
+class PrefixStatistic(object):
+
+    """
+    Keeps track of how the caches for a single prefix are used.
+    """
+
+    def __init__(self):
+        self.added_count = 0
+        self.popped_count = 0
+        self.timeout_count = 0
+
+    @property
+    def timeout_rate(self):
+        " Returns the fraction of finished caches that ended with a timeout. "
+        finished = self.popped_count + self.timeout_count
+        return float(self.timeout_count) / finished if finished else 0.0
+
+    def get_dict(self, **kargs):
+        " Returns a dictionary with the statistics. "
+        return dict(added=self.added_count, popped=self.popped_count, timeout=self.timeout_count,
+                    timeout_rate=self.timeout_rate, **kargs)
+
+
 class RequestCache(TaskManager):
 
+    # identifiers are claimed from the range [0, IDENTIFIER_SPACE)
+    IDENTIFIER_SPACE = 2 ** 16
+
+    # number of random draws before falling back to picking from the remaining free identifiers
+    _RANDOM_DRAW_ATTEMPTS = 16
+
     def __init__(self):
         """
         Creates a new RequestCache instance.
@@ -140,7 +212,9 @@ class RequestCache(TaskManager):
 
         self._logger = logging.getLogger(self.__class__.__name__)
 
-        self._identifiers = dict()
+        # PREFIX:{NUMBER:CACHE} nested dictionary
+        self._identifiers = defaultdict(dict)
+        self._statistics = defaultdict(PrefixStatistic)
 
     def add(self, cache):
         """
@@ -155,14 +229,15 @@ class RequestCache(TaskManager):
         assert isinstance(cache.timeout_delay, float), type(cache.timeout_delay)
         assert cache.timeout_delay > 0.0, cache.timeout_delay
 
-        identifier = self._create_identifier(cache.number, cache.prefix)
-        if identifier in self._identifiers:
-            self._logger.error("add with duplicate identifier \"%s\"", identifier)
+        caches = self._identifiers[cache.prefix]
+        if cache.number in caches:
+            self._logger.error("add with duplicate identifier \"%s:%d\"", cache.prefix, cache.number)
             return None
 
         else:
             self._logger.debug("add %s", cache)
-            self._identifiers[identifier] = cache
+            caches[cache.number] = cache
+            self._statistics[cache.prefix].added_count += 1
             self.register_task(cache, reactor.callLater(cache.timeout_delay, self._on_timeout, cache))
             return cache
 
@@ -173,7 +248,8 @@ class RequestCache(TaskManager):
         assert isInIOThread(), "RequestCache must be used on the reactor's thread"
         assert isinstance(number, (int, long)), type(number)
         assert isinstance(prefix, unicode), type(prefix)
-        return self._create_identifier(number, prefix) in self._identifiers
+        caches = self._identifiers.get(prefix)
+        return caches is not None and number in caches
 
     def get(self, prefix, number):
         """
@@ -182,7 +258,8 @@ class RequestCache(TaskManager):
         assert isInIOThread(), "RequestCache must be used on the reactor's thread"
         assert isinstance(number, (int, long)), type(number)
         assert isinstance(prefix, unicode), type(prefix)
-        return self._identifiers.get(self._create_identifier(number, prefix))
+        caches = self._identifiers.get(prefix)
+        return None if caches is None else caches.get(number)
 
     def pop(self, prefix, number):
         """
@@ -193,11 +270,46 @@ class RequestCache(TaskManager):
         assert isinstance(number, (int, long)), type(number)
         assert isinstance(prefix, unicode), type(prefix)
 
-        identifier = self._create_identifier(number, prefix)
-        cache = self._identifiers.pop(identifier)
+        caches = self._identifiers.get(prefix)
+        if caches is None:
+            raise KeyError(number)
+        cache = caches.pop(number)
+        self._statistics[prefix].popped_count += 1
         self.cancel_pending_task(cache)
         return cache
 
+    def claim_number(self, prefix):
+        """
+        Returns a random number that is not in use for PREFIX.
+
+        Random draws are checked against the per-prefix dictionary, which takes expected constant time as long as
+        the identifier space is not nearly exhausted.  When it is, the number is chosen from the remaining free
+        identifiers instead.  Raises RuntimeError when every identifier is in use.
+        """
+        assert isinstance(prefix, unicode), type(prefix)
+        caches = self._identifiers.get(prefix)
+        if not caches:
+            return int(random() * self.IDENTIFIER_SPACE)
+
+        for _ in xrange(self._RANDOM_DRAW_ATTEMPTS):
+            number = int(random() * self.IDENTIFIER_SPACE)
+            if number not in caches:
+                return number
+
+        unclaimed = [number for number in xrange(self.IDENTIFIER_SPACE) if number not in caches]
+        if not unclaimed:
+            raise RuntimeError("Could not find a number that isn't in use")
+        return choice(unclaimed)
+
+    def get_statistics(self):
+        """
+        Returns a PREFIX:{occupancy, added, popped, timeout, timeout_rate} dictionary.
+
+        OCCUPANCY is the number of caches that are currently waiting for either a pop or a timeout.
+        """
+        return dict((prefix, statistic.get_dict(occupancy=len(self._identifiers.get(prefix, ()))))
+                    for prefix, statistic in self._statistics.iteritems())
+
     def _on_timeout(self, cache):
         """
         Called CACHE.timeout_delay seconds after CACHE was added to this RequestCache.
@@ -212,16 +324,18 @@ class RequestCache(TaskManager):
         self._logger.debug("timeout on %s", cache)
         cache.on_timeout()
 
+        statistic = self._statistics[cache.prefix]
+        statistic.timeout_count += 1
+
         # the on_timeout call could have already removed the identifier from the cache using pop
-        identifier = self._create_identifier(cache.number, cache.prefix)
-        if identifier in self._identifiers:
-            del self._identifiers[identifier]
+        caches = self._identifiers[cache.prefix]
+        if cache.number in caches:
+            del caches[cache.number]
+        else:
+            statistic.popped_count -= 1
 
         self.cancel_pending_task(cache)
 
-    def _create_identifier(self, number, prefix):
-        return u"%s:%d" % (prefix, number)
-
     def clear(self):
         """
         Clear the cache, canceling all pending tasks.
@@ -229,6 +343,6 @@ class RequestCache(TaskManager):
         """
         assert isInIOThread(), "RequestCache must be used on the reactor's thread"
 
-        self._logger.debug("Clearing %s [%s]", self, len(self._identifiers))
+        self._logger.debug("Clearing %s [%s]", self, sum(len(caches) for caches in self._identifiers.itervalues()))
         self.cancel_all_pending_tasks()
         self._identifiers.clear()
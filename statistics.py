@@ -1,21 +1,73 @@
 from abc import ABCMeta, abstractmethod
+from bisect import bisect_left
 from collections import defaultdict
-from threading import RLock
+from heapq import heapify, heappop, heappush
+from itertools import count
 from time import time
 
+from twisted.internet import reactor
+from twisted.python.threadable import isInIOThread
+
+# the number of (SOURCE, INTRODUCED) address pairs counted in received_introductions
+RECEIVED_INTRODUCTIONS_SIZE = 1024
 
 class Statistics(object):
 
+    """
+    Counters are not protected by a lock, they must only be modified on the reactor thread.  dict_inc relays calls
+    made from other threads, for instance the endpoint thread, to the reactor thread.
+
+    Changes are tracked for get_delta: assigning a public attribute marks it as changed, as does dict_inc for the
+    key it increments.  Dictionaries that are modified in place in any other way must be reported with mark_dirty.
+    """
+
     __metaclass__ = ABCMeta
 
+    # public attributes that get_delta does not report
+    _delta_skip = ()
+
     def __init__(self):
-        self._lock = RLock()
+        # NAME:None for attributes that were assigned, or NAME:set(KEYS) for dictionaries where only KEYS changed
+        object.__setattr__(self, "_dirty", {})
+        # NAME:VALUE for the values that get_delta reported most recently, unless only some of their keys were reported
+        object.__setattr__(self, "_delta_values", {})
+        # names of the public attributes that are nested Statistics
+        object.__setattr__(self, "_nested", set())
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if not name.startswith("_"):
+            self._dirty[name] = None
+            if isinstance(value, Statistics):
+                self._nested.add(name)
+            else:
+                self._nested.discard(name)
+
+    def mark_dirty(self, name, key=None):
+        """
+        Reports that the dictionary NAME was modified in place, either only at KEY or, when KEY is None, entirely.
+        """
+        dirty = self._dirty
+        if key is None:
+            dirty[name] = None
+        else:
+            keys = dirty.get(name, ())
+            if keys is None:
+                return
+            if not keys:
+                keys = dirty[name] = set()
+            keys.add(key)
 
     def dict_inc(self, dictionary, key, value=1):
-        with self._lock:
-            assert hasattr(self, dictionary), u"%s doesn't exist in statistics" % dictionary
-            if getattr(self, dictionary) is not None:
-                getattr(self, dictionary)[key] += value
+        if not isInIOThread():
+            reactor.callFromThread(self.dict_inc, dictionary, key, value)
+            return
+
+        assert hasattr(self, dictionary), u"%s doesn't exist in statistics" % dictionary
+        counters = getattr(self, dictionary)
+        if counters is not None:
+            counters[key] += value
+            self.mark_dirty(dictionary, key)
 
     def get_dict(self):
         """
@@ -23,37 +75,208 @@ class Statistics(object):
 
         Warning: there is no recursion protection, if SELF contains self-references it will hang.
         """
-        def clone(o):
-            if isinstance(o, Statistics):
-                return dict((key, clone(value))
-                            for key, value
-                            in o.__dict__.items()
-                            if not key.startswith("_"))
-
-            if isinstance(o, dict):
-                return dict((clone(key), clone(value))
-                            for key, value
-                            in o.items())
-
-            if isinstance(o, tuple):
-                return tuple(clone(value) for value in o)
+        return _clone(self)
 
-            if isinstance(o, list):
-                return [clone(value) for value in o]
+    def get_delta(self):
+        """
+        Returns a dictionary with the public values of SELF that changed since the previous call to get_delta.
 
-            return o
-        return clone(self)
+        The first call returns all values.  Dictionaries changed through dict_inc or mark_dirty with a key only contain
+        the keys that changed, other changed dictionaries are cloned entirely.  Assigned values that equal the value
+        reported previously are not reported again.  Nested Statistics only report their own delta.  Keys that were
+        removed are not reported.  Only the attributes and keys that were marked as changed are visited, hence the
+        cost depends on what changed rather than on the size of SELF.
+        """
+        dirty = self._dirty
+        object.__setattr__(self, "_dirty", {})
+        values = self._delta_values
+        skip = self._delta_skip
+
+        delta = {}
+        for name, keys in dirty.items():
+            if name in skip or name in self._nested or not name in self.__dict__:
+                continue
+
+            value = self.__dict__[name]
+            if keys is not None and isinstance(value, dict):
+                values.pop(name, None)
+                changes = dict((_clone(key), _clone(value[key])) for key in keys if key in value)
+                if changes:
+                    delta[name] = changes
+
+            else:
+                if isinstance(value, (dict, list, tuple)):
+                    value = _clone(value)
+                if not name in values or values[name] != value:
+                    values[name] = value
+                    delta[name] = _clone(value)
+
+        for name in self._nested:
+            if not name in skip:
+                value_delta = self.__dict__[name].get_delta()
+                if value_delta:
+                    delta[name] = value_delta
+        return delta
 
     @abstractmethod
     def update(self):
         pass
 
 
-class MessageStatistics(object):
+def _clone(o):
+    if isinstance(o, Statistics):
+        return dict((key, _clone(value))
+                    for key, value
+                    in o.__dict__.items()
+                    if not key.startswith("_"))
+
+    if isinstance(o, dict):
+        return dict((_clone(key), _clone(value))
+                    for key, value
+                    in o.items())
+
+    if isinstance(o, tuple):
+        return tuple(_clone(value) for value in o)
+
+    if isinstance(o, list):
+        return [_clone(value) for value in o]
+
+    return o
+
+
+class TopKCounter(dict):
+
+    """
+    A KEY:COUNT dictionary that retains at most SIZE keys, i.e. the keys with the highest counts.
+
+    Uses the space-saving algorithm: when a new key is added while the dictionary is full, the key with the lowest
+    count is evicted and the new key continues from that count.  Hence a count may over-estimate the real count by at
+    most the count of the key it replaced.  This makes it suitable for per-address counters, where the number of
+    distinct keys is not bounded.
+    """
+
+    def __init__(self, size=256):
+        super(TopKCounter, self).__init__()
+        assert isinstance(size, int), type(size)
+        assert size > 0, size
+        self.size = size
+        self.evicted = 0
+        # min-heap with (COUNT, SEQUENCE, KEY) entries.  every assignment pushes an entry, entries whose COUNT no
+        # longer matches the current count of KEY are stale and skipped when looking for the lowest count
+        self._heap = []
+        self._sequence = count()
+
+    def __missing__(self, key):
+        return 0
+
+    def __setitem__(self, key, value):
+        if len(self) >= self.size and not key in self:
+            lowest = self._pop_lowest()
+            value += self.pop(lowest)
+            self.evicted += 1
+        super(TopKCounter, self).__setitem__(key, value)
+        heappush(self._heap, (value, next(self._sequence), key))
+
+        if len(self._heap) > 2 * self.size:
+            # drop the stale entries
+            self._heap = [(current, next(self._sequence), k) for k, current in self.iteritems()]
+            heapify(self._heap)
+
+    def _pop_lowest(self):
+        while True:
+            value, _, key = heappop(self._heap)
+            if key in self and dict.__getitem__(self, key) == value:
+                return key
+
+    def clear(self):
+        super(TopKCounter, self).clear()
+        self.evicted = 0
+        self._heap = []
+
+
+class PhaseTimer(object):
+
+    """
+    Records the duration of consecutive phases, in seconds, into the dictionary NAME of STATISTICS.
+
+        timer = PhaseTimer(statistics, u"startup")
+        ...
+        timer.phase(u"database")
+        ...
+        timer.phase(u"endpoint")
+    """
+
+    def __init__(self, statistics, name):
+        assert isinstance(statistics, Statistics), type(statistics)
+        assert isinstance(getattr(statistics, name), dict), type(getattr(statistics, name))
+        self._statistics = statistics
+        self._name = name
+        self._phases = getattr(statistics, name)
+        self._phases.clear()
+        self._statistics.mark_dirty(name)
+        self._last = time()
+
+    def phase(self, name):
+        """
+        Records the time since the previous phase ended as the duration of phase NAME.
+        """
+        assert isinstance(name, unicode), type(name)
+        now = time()
+        self._phases[name] = self._phases.get(name, 0.0) + now - self._last
+        self._statistics.mark_dirty(self._name, name)
+        self._last = now
+
+
+class LatencyHistogram(object):
+
+    """
+    Counts durations in exponentially growing buckets, allowing percentiles to be estimated in constant memory.
+    """
+
+    # upper bounds, in seconds, of the buckets: 10us, 20us, 40us, ..., ~84s.  the last bucket counts everything
+    # above the highest bound
+    buckets = tuple(0.00001 * 2 ** index for index in xrange(24))
+
+    def __init__(self):
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+
+    @property
+    def count(self):
+        " Returns the number of recorded durations. "
+        return self._count
+
+    def record(self, duration, count=1):
+        " Count DURATION COUNT times in its bucket. "
+        self._counts[bisect_left(self.buckets, duration)] += count
+        self._count += count
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound of the bucket containing the FRACTION percentile, or None when nothing was recorded.
+        Durations above the highest bound are reported as infinite.
+        """
+        assert 0.0 < fraction <= 1.0, fraction
+        if not self._count:
+            return None
+
+        threshold = fraction * self._count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self._counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return bound
+        return float("inf")
+
+    def get_dict(self):
+        " Returns a dictionary with the count, p50, and p99. "
+        return dict(count=self._count, p50=self.percentile(0.5), p99=self.percentile(0.99))
+
+
+class MessageStatistics(Statistics):
 
     def __init__(self):
         super(MessageStatistics, self).__init__()
-        self._lock = RLock()
 
         self.total_received_count = 0
         self.success_count = 0
@@ -65,6 +288,8 @@ class MessageStatistics(object):
         self.delay_send_count = 0
         self.delay_timeout_count = 0
         self.delay_success_count = 0
+        self.delay_evict_count = 0
+        self.delay_send_limited_count = 0
 
         self.success_dict = None
         self.drop_dict = None
@@ -86,71 +311,72 @@ class MessageStatistics(object):
         self._enabled = None
 
     def increase_count(self, category, name, value=1):
-        with self._lock:
-            count_name = u"%s_count" % category
-            dict_name = u"%s_dict" % category
-            if hasattr(self, count_name):
-                setattr(self, count_name, getattr(self, count_name) + value)
-            if getattr(self, dict_name) is not None:
-                getattr(self, dict_name)[name] += value
+        count_name = u"%s_count" % category
+        dict_name = u"%s_dict" % category
+        if hasattr(self, count_name):
+            setattr(self, count_name, getattr(self, count_name) + value)
+        if getattr(self, dict_name) is not None:
+            getattr(self, dict_name)[name] += value
+            self.mark_dirty(dict_name, name)
 
     def increase_delay_count(self, category, value=1):
-        with self._lock:
-            count_name = u"delay_%s_count" % category
-            setattr(self, count_name, getattr(self, count_name) + value)
+        count_name = u"delay_%s_count" % category
+        setattr(self, count_name, getattr(self, count_name) + value)
 
     def enable(self, enabled):
-        with self._lock:
-            if self._enabled != enabled:
-                self._enabled = enabled
-                assigned_value = lambda: defaultdict(int) if enabled else None
-
-                self.success_dict = assigned_value()
-                self.outgoing_dict = assigned_value()
-                self.created_dict = assigned_value()
-                self.drop_dict = assigned_value()
-                self.delay_dict = assigned_value()
+        if self._enabled != enabled:
+            self._enabled = enabled
+            assigned_value = lambda: defaultdict(int) if enabled else None
+            # per-address dictionaries
+            assigned_counter = lambda: TopKCounter() if enabled else None
+
+            self.success_dict = assigned_value()
+            self.outgoing_dict = assigned_value()
+            self.created_dict = assigned_value()
+            self.drop_dict = assigned_value()
+            self.delay_dict = assigned_value()
+
+            self.walk_failure_dict = assigned_counter()
+            self.incoming_intro_dict = assigned_counter()
+            self.outgoing_intro_dict = assigned_counter()
 
-                self.walk_failure_dict = assigned_value()
-                self.incoming_intro_dict = assigned_value()
-                self.outgoing_intro_dict = assigned_value()
+    def update(self):
+        pass
 
     def reset(self):
-        with self._lock:
-            self.total_received_count = 0
-            self.success_count = 0
-            self.drop_count = 0
-            self.created_count = 0
-            self.outgoing_count = 0
-
-            self.delay_received_count = 0
-            self.delay_send_count = 0
-            self.delay_timeout_count = 0
-            self.delay_success_count = 0
+        self.total_received_count = 0
+        self.success_count = 0
+        self.drop_count = 0
+        self.created_count = 0
+        self.outgoing_count = 0
 
-            self.walk_attempt_count = 0
-            self.walk_success_count = 0
-            self.walk_failure_count = 0
+        self.delay_received_count = 0
+        self.delay_send_count = 0
+        self.delay_timeout_count = 0
+        self.delay_success_count = 0
+        self.delay_evict_count = 0
+        self.delay_send_limited_count = 0
 
-            self.invalid_response_identifier_count = 0
+        self.walk_attempt_count = 0
+        self.walk_success_count = 0
+        self.walk_failure_count = 0
 
-            self.incoming_intro_count = 0
-            self.outgoing_intro_count = 0
+        self.invalid_response_identifier_count = 0
 
-            if self._enabled:
-                self.success_dict.clear()
-                self.drop_dict.clear()
-                self.created_dict.clear()
-                self.delay_dict.clear()
-                self.outgoing_dict.clear()
+        self.incoming_intro_count = 0
+        self.outgoing_intro_count = 0
 
-                self.walk_failure_dict.clear()
-                self.incoming_intro_dict.clear()
-                self.outgoing_intro_dict.clear()
+        if self._enabled:
+            for name in (u"success_dict", u"drop_dict", u"created_dict", u"delay_dict", u"outgoing_dict",
+                         u"walk_failure_dict", u"incoming_intro_dict", u"outgoing_intro_dict"):
+                getattr(self, name).clear()
+                self.mark_dirty(name)
 
 
 class DispersyStatistics(Statistics):
 
+    _delta_skip = ("communities",)
+
     def __init__(self, dispersy):
         super(DispersyStatistics, self).__init__()
         self._dispersy = dispersy
@@ -182,12 +408,26 @@ class DispersyStatistics(Statistics):
         self.outgoing_intro_count = 0
         self.outgoing_intro_dict = None
 
+        # PHASE:SECONDS dictionary with the duration of each step of the most recent Dispersy.start
+        self.startup = dict()
+
+        # seconds spent loading members that were not cached, i.e. key parsing and database lookups, in
+        # Dispersy.get_member
+        self.member_load_duration = 0.0
+
+        # lazy community loading, see Dispersy.define_auto_load.  the number of communities not yet initialized,
+        # the number initialized on demand and in the background, and the seconds spent initializing them
+        self.lazy_pending = 0
+        self.lazy_loaded_on_demand = 0
+        self.lazy_loaded_background = 0
+        self.lazy_load_duration = 0.0
+
         self.attachment = None
         self.endpoint_recv = None
         self.endpoint_send = None
         self.received_introductions = None
 
-        # list with {count=int, duration=float, average=float, entry=str} dictionaries.  each entry
+        # list with {count=int, duration=float, average=float, histogram=list, entry=str} dictionaries.  each entry
         # represents a key from the attach_runtime_statistics decorator
         self.runtime = None
 
@@ -219,16 +459,18 @@ class DispersyStatistics(Statistics):
             self.msg_statistics.enable(enable)
 
             dict_assigned_value = lambda: defaultdict(int) if enable else None
-            self.walk_failure_dict = dict_assigned_value()
-            self.incoming_intro_dict = dict_assigned_value()
-            self.outgoing_intro_dict = dict_assigned_value()
+            # per-address dictionaries
+            counter_assigned_value = lambda: TopKCounter() if enable else None
+            self.walk_failure_dict = counter_assigned_value()
+            self.incoming_intro_dict = counter_assigned_value()
+            self.outgoing_intro_dict = counter_assigned_value()
 
             self.attachment = dict_assigned_value()
             self.endpoint_recv = dict_assigned_value()
             self.endpoint_send = dict_assigned_value()
 
-            # SOURCE:INTRODUCED:COUNT nested dictionary
-            self.received_introductions = defaultdict(lambda: defaultdict(int)) if enable else None
+            # (SOURCE, INTRODUCED):COUNT dictionary
+            self.received_introductions = TopKCounter(RECEIVED_INTRODUCTIONS_SIZE) if enable else None
 
             for community in self._dispersy.get_communities():
                 community.statistics.enable_debug_statistics(enable)
@@ -243,12 +485,27 @@ class DispersyStatistics(Statistics):
         for community in self.communities:
             community.update(database=database)
 
-        # list with {count=int, duration=float, average=float, entry=str} dictionaries.  each entry
+        # list with {count=int, duration=float, average=float, histogram=list, entry=str} dictionaries.  each entry
         # represents a key from the attach_runtime_statistics decorator
         self.runtime = [(statistic.duration, statistic.get_dict(entry=entry)) for entry, statistic in _runtime_statistics.iteritems() if statistic.duration > 1]
         self.runtime.sort(reverse=True)
         self.runtime = [statistic[1] for statistic in self.runtime]
 
+    def get_delta(self):
+        """
+        Returns the changes since the previous call, see Statistics.get_delta.  The communities are reported as a
+        HEX_CID:DELTA dictionary.
+        """
+        delta = super(DispersyStatistics, self).get_delta()
+        communities = {}
+        for community in self.communities or ():
+            community_delta = community.get_delta()
+            if community_delta:
+                communities[community.hex_cid] = community_delta
+        if communities:
+            delta["communities"] = communities
+        return delta
+
     def reset(self):
         self.total_down = 0
         self.total_up = 0
@@ -272,14 +529,14 @@ class DispersyStatistics(Statistics):
         self.msg_statistics.reset()
 
         if self.are_debug_statistics_enabled():
-            self.walk_failure_dict = defaultdict(int)
-            self.incoming_intro_dict = defaultdict(int)
-            self.outgoing_intro_dict = defaultdict(int)
+            self.walk_failure_dict = TopKCounter()
+            self.incoming_intro_dict = TopKCounter()
+            self.outgoing_intro_dict = TopKCounter()
 
             self.attachment = defaultdict(int)
             self.endpoint_recv = defaultdict(int)
             self.endpoint_send = defaultdict(int)
-            self.received_introductions = defaultdict(lambda: defaultdict(int))
+            self.received_introductions = TopKCounter(RECEIVED_INTRODUCTIONS_SIZE)
 
 
 class CommunityStatistics(Statistics):
@@ -298,6 +555,25 @@ class CommunityStatistics(Statistics):
 
         self.database = dict()
 
+        # PHASE:SECONDS dictionary with the duration of each step of Community.initialize
+        self.startup = dict()
+
+        # STAGE:{META_NAME:{count, p50, p99}} dictionary, with the latencies in seconds for each stage of the
+        # incoming packet pipeline, see record_latency.  updated by update()
+        self.latency = dict()
+        self._latency = defaultdict(dict)
+
+        # PREFIX:{occupancy, added, popped, timeout, timeout_rate} dictionary, see RequestCache.get_statistics
+        self.request_cache = dict()
+
+        # number and total size of the packets/messages that are currently delayed
+        self.delayed_count = 0
+        self.delayed_bytes = 0
+
+        # number of Timeline permission checks that were, or were not, answered from the check cache
+        self.timeline_cache_hits = 0
+        self.timeline_cache_misses = 0
+
         self.total_candidates_discovered = 0
 
         self.msg_statistics = MessageStatistics()
@@ -307,6 +583,41 @@ class CommunityStatistics(Statistics):
         self.sync_bloom_send = 0
         self.sync_bloom_skip = 0
 
+        # bytes of sync bloom filters sent, and the new and duplicate messages received, see SyncController
+        self.sync_bloom_bytes = 0
+        self.sync_new_messages = 0
+        self.sync_new_bytes = 0
+        self.sync_duplicate_messages = 0
+        self.sync_duplicate_bytes = 0
+        # smoothed number of new messages received per KiB of sync bloom filter sent
+        self.sync_yield_per_kib = 0.0
+        # the most recent bloom filter size and skip probability chosen by the SyncController
+        self.sync_adaptive_bloom_bits = 0
+        self.sync_adaptive_skip_probability = 0.0
+
+        # bytes of sync responses that were sent, that had to wait for the upload budget, and that were dropped, see
+        # SyncResponseScheduler
+        self.sync_response_sent_bytes = 0
+        self.sync_response_deferred_bytes = 0
+        self.sync_response_dropped_bytes = 0
+
+        # number of sync table queries made for bloom filter requests, and the number of requests that were served from
+        # a query shared with other requests that have an overlapping time range
+        self.sync_scan_count = 0
+        self.sync_shared_scan_requests = 0
+
+        # number of received sync reconciliation tables whose difference could, or could not, be listed
+        self.sync_reconciliation_decoded = 0
+        self.sync_reconciliation_failed = 0
+
+        # number of sync digest requests sent, and the number of differing ranges synced with a bloom filter, see
+        # SyncDigest
+        self.sync_digest_sent = 0
+        self.sync_digest_descend = 0
+        # number of received sync digest requests where all ranges matched, or where some ranges differed
+        self.sync_digest_matched = 0
+        self.sync_digest_differed = 0
+
         self.dispersy_acceptable_global_time_range = self._community.dispersy_acceptable_global_time_range
 
         self.dispersy_enable_candidate_walker = self._community.dispersy_enable_candidate_walker
@@ -329,6 +640,19 @@ class CommunityStatistics(Statistics):
         self.msg_statistics.increase_delay_count(category, value)
         self._dispersy.statistics.msg_statistics.increase_delay_count(category, value)
 
+    def record_latency(self, stage, name, duration, count=1):
+        """
+        Record that STAGE of the pipeline took DURATION seconds for COUNT packets or batches of NAME messages.
+
+        The stages are: receive (endpoint to Community.on_incoming_packets), batch (waiting in the batch cache),
+        decode (per packet), distribution, check, store, handle, and forward (per batch).
+        """
+        histograms = self._latency[stage]
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = LatencyHistogram()
+        histogram.record(duration, count)
+
     @property
     def acceptable_global_time(self):
         return self._community.acceptable_global_time
@@ -354,25 +678,43 @@ class CommunityStatistics(Statistics):
         else:
             self.database = dict()
 
+        if self._community.request_cache:
+            self.request_cache = self._community.request_cache.get_statistics()
+
+        self.delayed_count, self.delayed_bytes = self._community.delayed_size
+
+        self.latency = dict((stage, dict((name, histogram.get_dict()) for name, histogram in histograms.iteritems()))
+                            for stage, histograms in self._latency.iteritems())
+
+        self.timeline_cache_hits = self._community.timeline.check_cache_hits
+        self.timeline_cache_misses = self._community.timeline.check_cache_misses
+
     def reset(self):
         self.total_candidates_discovered = 0
         self.msg_statistics.reset()
+        self._latency.clear()
+        self.latency = dict()
 
 
 class RuntimeStatistic(object):
 
+    # upper bounds, in seconds, of the histogram buckets.  the last bucket counts everything above
+    # the highest bound
+    histogram_buckets = (0.0001, 0.001, 0.01, 0.1, 1.0)
+
     def __init__(self):
         self._count = 0
         self._duration = 0.0
+        self._histogram = [0] * (len(self.histogram_buckets) + 1)
 
     @property
     def count(self):
-        " Returns the number of times a method was called. "
-        return self._count
+        " Returns the (estimated when sampling) number of times a method was called. "
+        return int(round(self._count))
 
     @property
     def duration(self):
-        " Returns the cumulative time spent in a method. "
+        " Returns the (estimated when sampling) cumulative time spent in a method. "
         return self._duration
 
     @property
@@ -380,14 +722,20 @@ class RuntimeStatistic(object):
         " Returns the average time spent in a method. "
         return self._duration / self._count
 
-    def increment(self, duration):
-        " Increase self.count with 1 and self.duration with DURATION. "
+    @property
+    def histogram(self):
+        " Returns the (estimated when sampling) number of calls per bucket in histogram_buckets. "
+        return [int(round(count)) for count in self._histogram]
+
+    def increment(self, duration, weight=1):
+        " Increase self.count with WEIGHT and self.duration with DURATION * WEIGHT. "
         assert isinstance(duration, float), type(duration)
-        self._duration += duration
-        self._count += 1
+        self._duration += duration * weight
+        self._count += weight
+        self._histogram[bisect_left(self.histogram_buckets, duration)] += weight
 
     def get_dict(self, **kargs):
         " Returns a dictionary with the statistics. "
-        return dict(count=self.count, duration=self.duration, average=self.average, **kargs)
+        return dict(count=self.count, duration=self.duration, average=self.average, histogram=self.histogram, **kargs)
 
 _runtime_statistics = defaultdict(RuntimeStatistic)
@@ -0,0 +1,155 @@
+from collections import OrderedDict
+
+
+# the smallest sync bloom filter, in bits, that the controller will choose
+SYNC_ADAPTIVE_MIN_BITS = 64 * 8
+# number of consecutive rounds without new messages after which the sync bloom filter is halved
+SYNC_ADAPTIVE_SHRINK_ROUNDS = 3
+# weight of the most recent round in the smoothed yield
+SYNC_ADAPTIVE_YIELD_WEIGHT = 0.25
+# maximum number of candidates whose yield is tracked, the least recently used candidate is discarded first
+SYNC_ADAPTIVE_CANDIDATES = 1000
+
+
+class SyncYield(object):
+
+    """
+    The yield of the sync bloom filters sent to one candidate, or to all candidates of a community.
+
+    A round starts when a bloom filter is sent and ends when the next bloom filter is sent.  The messages received
+    from a candidate are counted in its current round.
+    """
+
+    __slots__ = ["rounds", "empty_rounds", "bloom_bytes", "new_messages", "new_bytes", "duplicate_messages",
+                 "duplicate_bytes", "yield_per_kib"]
+
+    def __init__(self):
+        self.rounds = 0
+        # number of consecutive finished rounds that did not deliver any new message
+        self.empty_rounds = 0
+        # the current round
+        self.bloom_bytes = 0
+        self.new_messages = 0
+        self.new_bytes = 0
+        self.duplicate_messages = 0
+        self.duplicate_bytes = 0
+        # smoothed number of new messages received per KiB of bloom filter sent
+        self.yield_per_kib = 0.0
+
+    def finish_round(self):
+        if self.bloom_bytes:
+            self.rounds += 1
+            self.empty_rounds = 0 if self.new_messages else self.empty_rounds + 1
+            self.yield_per_kib += SYNC_ADAPTIVE_YIELD_WEIGHT * \
+                (1024.0 * self.new_messages / self.bloom_bytes - self.yield_per_kib)
+
+        self.bloom_bytes = 0
+        self.new_messages = 0
+        self.new_bytes = 0
+        self.duplicate_messages = 0
+        self.duplicate_bytes = 0
+
+
+class SyncController(object):
+
+    """
+    Chooses the size of the sync bloom filters, and the probability that a sync is skipped, from the observed yield.
+
+    Quiescent communities get smaller bloom filters, each SYNC_ADAPTIVE_SHRINK_ROUNDS consecutive rounds without new
+    messages halve the filter down to SYNC_ADAPTIVE_MIN_BITS.  A smaller filter has a smaller capacity, hence the
+    bloom filter strategy also selects a narrower global time range.  A candidate that delivered new messages in its
+    previous round always gets a full size filter and is never skipped.
+    """
+
+    def __init__(self, community):
+        self._community = community
+        self._yield = SyncYield()
+        # sock_addr:SyncYield pairs in least recently used order
+        self._candidates = OrderedDict()
+
+    @property
+    def community_yield(self):
+        return self._yield
+
+    def get_candidate_yield(self, candidate):
+        """
+        Returns the SyncYield for CANDIDATE or None when it was not sent a bloom filter recently.
+        """
+        return self._candidates.get(candidate.sock_addr) if candidate else None
+
+    def get_bloom_filter_bits(self, candidate):
+        """
+        Returns the number of bits, a multiple of eight, for the next bloom filter sent to CANDIDATE.
+        @rtype: int
+        """
+        max_bits = self._community.dispersy_sync_bloom_filter_bits
+        candidate_yield = self.get_candidate_yield(candidate)
+        if candidate_yield and candidate_yield.rounds and not candidate_yield.empty_rounds:
+            bits = max_bits
+        else:
+            # halve the number of bytes to keep the number of bits a multiple of eight
+            bits = ((max_bits // 8) >> (self._yield.empty_rounds // SYNC_ADAPTIVE_SHRINK_ROUNDS)) * 8
+            bits = min(max_bits, max(SYNC_ADAPTIVE_MIN_BITS, bits))
+
+        self._community.statistics.sync_adaptive_bloom_bits = bits
+        return bits
+
+    def get_skip_probability(self, candidate):
+        """
+        Returns the probability that the next sync with CANDIDATE is skipped.
+        @rtype: float
+        """
+        candidate_yield = self.get_candidate_yield(candidate)
+        if candidate_yield and candidate_yield.rounds and not candidate_yield.empty_rounds:
+            probability = 0.0
+        else:
+            curve = self._community._SKIP_CURVE_STEPS
+            probability = curve[min(self._yield.empty_rounds, len(curve) - 1)]
+
+        self._community.statistics.sync_adaptive_skip_probability = probability
+        return probability
+
+    def on_bloom_filter(self, candidate, bloom_bytes):
+        """
+        Starts a new round after a bloom filter of BLOOM_BYTES bytes was claimed for CANDIDATE.
+        """
+        self._yield.finish_round()
+        self._yield.bloom_bytes = bloom_bytes
+
+        candidates = self._candidates
+        # pop and reinsert to keep CANDIDATES in least recently used order
+        candidate_yield = candidates.pop(candidate.sock_addr, None) if candidate else None
+        if candidate_yield is None:
+            candidate_yield = SyncYield()
+            if len(candidates) >= SYNC_ADAPTIVE_CANDIDATES:
+                candidates.popitem(False)
+        else:
+            candidate_yield.finish_round()
+        candidate_yield.bloom_bytes = bloom_bytes
+        if candidate:
+            candidates[candidate.sock_addr] = candidate_yield
+
+        statistics = self._community.statistics
+        statistics.sync_bloom_bytes += bloom_bytes
+        statistics.sync_yield_per_kib = self._yield.yield_per_kib
+
+    def on_message(self, candidate, length, duplicate):
+        """
+        Counts a new, or DUPLICATE, message of LENGTH bytes received from CANDIDATE.
+        """
+        statistics = self._community.statistics
+        if duplicate:
+            statistics.sync_duplicate_messages += 1
+            statistics.sync_duplicate_bytes += length
+        else:
+            statistics.sync_new_messages += 1
+            statistics.sync_new_bytes += length
+
+        candidate_yield = self.get_candidate_yield(candidate)
+        for sync_yield in (self._yield, candidate_yield) if candidate_yield else (self._yield,):
+            if duplicate:
+                sync_yield.duplicate_messages += 1
+                sync_yield.duplicate_bytes += length
+            else:
+                sync_yield.new_messages += 1
+                sync_yield.new_bytes += length
@@ -0,0 +1,300 @@
+"""
+This module provides the range digests that summarise the sync table of a community.
+
+The global time is divided into buckets of SYNC_DIGEST_BUCKET_SIZE.  The digest of a bucket is the number of syncable
+packets in that bucket and the xor of their keys, see iblt.get_key.  Hence the digest of a range of global time is the
+combination of the digests of the buckets that it covers, and two peers that have the same packets in a range have the
+same digest for that range.
+
+A peer sends the digests of up to SYNC_DIGEST_RANGES consecutive ranges, the receiver replies with the ranges whose
+digest differs from its own.  The requested time range starts and ends at bucket boundaries, hence the receiver can
+combine its bucket digests without querying the database.  Matching ranges need no further sync, a differing range is divided again, until it is
+small enough to be synced with a bloom filter, see Community._dispersy_claim_sync_digest.
+"""
+
+from bisect import bisect_right
+from collections import OrderedDict
+from struct import Struct
+
+from .distribution import SyncDistribution
+from .iblt import get_key
+
+# global time covered by one bucket.  all peers must use the same value, since the ranges are divided at bucket
+# boundaries
+SYNC_DIGEST_BUCKET_SIZE = 64
+# default number of ranges in one dispersy-introduction-request
+SYNC_DIGEST_RANGES = 16
+# maximum number of ranges in one dispersy-introduction-request, limited by the dispersy-sync-digest bitmap
+SYNC_DIGEST_MAX_RANGES = 64
+# maximum number of candidates whose outstanding requests and differing ranges are remembered, the least recently
+# used candidate is discarded first
+SYNC_DIGEST_CANDIDATES = 1000
+
+# the count and key xor of one range
+_struct_digest = Struct(">LQ")
+
+# number of bytes that one range digest occupies on the wire
+DIGEST_SIZE = _struct_digest.size
+
+
+def get_bucket_time_high(global_time):
+    """
+    Returns the last global time of the bucket that contains GLOBAL_TIME.
+    @rtype: int or long
+    """
+    return (global_time // SYNC_DIGEST_BUCKET_SIZE + 1) * SYNC_DIGEST_BUCKET_SIZE - 1
+
+
+def get_ranges(time_low, time_high, ranges=SYNC_DIGEST_RANGES):
+    """
+    Divides [TIME_LOW, TIME_HIGH] into at most RANGES consecutive (time_low, time_high) ranges.
+
+    Each range covers the same number of buckets, give or take one, and all ranges except the first and the last start
+    and end at a bucket boundary.  Fewer ranges are returned when [TIME_LOW, TIME_HIGH] covers fewer than RANGES
+    buckets.
+    @rtype: [(int or long, int or long)]
+    """
+    assert 0 < time_low <= time_high, [time_low, time_high]
+    assert 0 < ranges, ranges
+    first = time_low // SYNC_DIGEST_BUCKET_SIZE
+    buckets = time_high // SYNC_DIGEST_BUCKET_SIZE - first + 1
+    ranges = min(ranges, buckets)
+    return [(max(time_low, (first + buckets * index // ranges) * SYNC_DIGEST_BUCKET_SIZE),
+             min(time_high, (first + buckets * (index + 1) // ranges) * SYNC_DIGEST_BUCKET_SIZE - 1))
+            for index in xrange(ranges)]
+
+
+class RangeDigests(object):
+
+    """
+    The digests of the ranges that get_ranges returns, as sent in a dispersy-introduction-request.
+
+    The RangeDigests constructor takes either a list of (count, key_xor) tuples, or the wire format.  The size and
+    bytes properties mirror those of BloomFilter, allowing it to take the place of the bloom filter in the sync part
+    of a dispersy-introduction-request.
+    """
+
+    def __init__(self, digests):
+        if isinstance(digests, str):
+            assert len(digests) % DIGEST_SIZE == 0, len(digests)
+            digests = [_struct_digest.unpack_from(digests, offset) for offset in xrange(0, len(digests), DIGEST_SIZE)]
+        assert isinstance(digests, list), type(digests)
+        assert 0 < len(digests) <= SYNC_DIGEST_MAX_RANGES, len(digests)
+        self._digests = digests
+
+    @property
+    def digests(self):
+        return self._digests
+
+    @property
+    def size(self):
+        """
+        The size of the digests in bits.
+        @rtype: int
+        """
+        return len(self._digests) * DIGEST_SIZE * 8
+
+    @property
+    def bytes(self):
+        pack = _struct_digest.pack
+        return "".join(pack(count, key_xor) for count, key_xor in self._digests)
+
+    def get_differences(self, digests):
+        """
+        Returns the indexes of the ranges where DIGESTS, a list of (count, key_xor) tuples, differs from SELF.
+        @rtype: [int]
+        """
+        assert len(digests) == len(self._digests), [len(digests), len(self._digests)]
+        return [index for index, (digest, other) in enumerate(zip(self._digests, digests)) if not digest == other]
+
+
+class SyncDigest(object):
+
+    """
+    The bucket digests of the sync table of one community, and the state of the digest requests sent to candidates.
+
+    Only the packets of meta messages with a SyncDistribution priority above 32 that are not undone are included, i.e.
+    the packets that the sync strategies include in their bloom filters.
+
+    The buckets are loaded from the database the first time a digest is needed.  Afterwards packets are added as they
+    are stored, while buckets that change in any other way, i.e. undo, redo, and pruning, are invalidated and reloaded
+    the next time a digest is needed.  Nothing is maintained while the buckets are not loaded.
+    """
+
+    def __init__(self, community):
+        self._community = community
+        # bucket:[count, key_xor] pairs, or None when the buckets are not loaded
+        self._buckets = None
+        # buckets that must be reloaded
+        self._invalid = set()
+        # sock_addr:(time_low, time_high, ranges) pairs for digest requests that were not answered yet
+        self._requests = OrderedDict()
+        # sock_addr:[(time_low, time_high)] pairs with the ranges that differ, in least recently used order
+        self._differences = OrderedDict()
+
+    @property
+    def loaded(self):
+        return self._buckets is not None
+
+    @staticmethod
+    def _is_syncable(meta):
+        return isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32
+
+    def _select(self, time_low, time_high):
+        # yields the (global_time, packet) tuples for all syncable packets in [TIME_LOW, TIME_HIGH]
+        community = self._community
+        syncable_messages = u", ".join(unicode(meta.database_id) for meta in community.get_meta_messages()
+                                       if self._is_syncable(meta))
+        if syncable_messages:
+            for global_time, packet in community.dispersy.database.execute(
+                    u"SELECT global_time, packet FROM sync WHERE meta_message IN (%s) AND undone = 0 AND "
+                    u"global_time BETWEEN ? AND ?" % syncable_messages, (time_low, time_high)):
+                yield global_time, str(packet)
+
+    def _load(self):
+        if self._buckets is None:
+            self._buckets = {}
+            self._invalid.clear()
+            rows = self._select(0, 2 ** 63 - 1)
+
+        elif self._invalid:
+            rows = []
+            for bucket in self._invalid:
+                self._buckets.pop(bucket, None)
+                rows.extend(self._select(bucket * SYNC_DIGEST_BUCKET_SIZE, (bucket + 1) * SYNC_DIGEST_BUCKET_SIZE - 1))
+            self._invalid.clear()
+
+        else:
+            return
+
+        buckets = self._buckets
+        for global_time, packet in rows:
+            digest = buckets.get(global_time // SYNC_DIGEST_BUCKET_SIZE)
+            if digest is None:
+                digest = buckets[global_time // SYNC_DIGEST_BUCKET_SIZE] = [0, 0]
+            digest[0] += 1
+            digest[1] ^= get_key(packet)
+
+    def add(self, messages):
+        """
+        Adds the packets of newly stored MESSAGES.
+        """
+        if self._buckets is not None:
+            buckets = self._buckets
+            for message in messages:
+                if self._is_syncable(message.meta):
+                    bucket = message.distribution.global_time // SYNC_DIGEST_BUCKET_SIZE
+                    if not bucket in self._invalid:
+                        digest = buckets.get(bucket)
+                        if digest is None:
+                            digest = buckets[bucket] = [0, 0]
+                        digest[0] += 1
+                        digest[1] ^= get_key(message.packet)
+
+    def invalidate(self, global_times):
+        """
+        Invalidates the buckets of packets at GLOBAL_TIMES that were changed or removed from the sync table.
+        """
+        if self._buckets is not None:
+            self._invalid.update(global_time // SYNC_DIGEST_BUCKET_SIZE for global_time in global_times)
+
+    def clear(self):
+        """
+        Invalidates all buckets.
+        """
+        self._buckets = None
+        self._invalid.clear()
+
+    def get_digests(self, ranges):
+        """
+        Returns a (count, key_xor) tuple for each (time_low, time_high) in RANGES.
+
+        RANGES must be consecutive, as returned by get_ranges.
+        @rtype: [(int, long)]
+        """
+        assert ranges, ranges
+        assert all(high + 1 == low for (_, high), (low, _) in zip(ranges, ranges[1:])), ranges
+        self._load()
+        time_low = ranges[0][0]
+        time_high = ranges[-1][1]
+        starts = [low for low, _ in ranges]
+        digests = [[0, 0] for _ in ranges]
+
+        for bucket, (count, key_xor) in self._buckets.iteritems():
+            # global time starts at 1, hence a range starting at 1 covers the entire first bucket
+            low = bucket * SYNC_DIGEST_BUCKET_SIZE or 1
+            high = low + SYNC_DIGEST_BUCKET_SIZE - 1
+            if high < time_low or time_high < low:
+                continue
+
+            index = bisect_right(starts, max(low, time_low)) - 1
+            if ranges[index][0] <= low and high <= ranges[index][1]:
+                digests[index][0] += count
+                digests[index][1] ^= key_xor
+
+            else:
+                # the bucket is divided over more than one range, or only partially in [TIME_LOW, TIME_HIGH]
+                for global_time, packet in self._select(max(low, time_low), min(high, time_high)):
+                    digest = digests[bisect_right(starts, global_time) - 1]
+                    digest[0] += 1
+                    digest[1] ^= get_key(packet)
+
+        return [(count, key_xor) for count, key_xor in digests]
+
+    def get_count(self, time_low, time_high):
+        """
+        Returns the number of syncable packets in [TIME_LOW, TIME_HIGH].
+        @rtype: int
+        """
+        return self.get_digests([(time_low, time_high)])[0][0]
+
+    def on_request(self, candidate, time_low, time_high, ranges):
+        """
+        Remembers that a request with the digests of RANGES ranges in [TIME_LOW, TIME_HIGH] was sent to CANDIDATE.
+        """
+        self._requests.pop(candidate.sock_addr, None)
+        if len(self._requests) >= SYNC_DIGEST_CANDIDATES:
+            self._requests.popitem(False)
+        self._requests[candidate.sock_addr] = (time_low, time_high, ranges)
+
+    def get_request(self, candidate):
+        """
+        Returns the (time_low, time_high, ranges) of the request sent to CANDIDATE, or None.
+        """
+        return self._requests.get(candidate.sock_addr)
+
+    def on_differences(self, candidate, ranges):
+        """
+        Remembers the (time_low, time_high) RANGES that differ from CANDIDATE, in reply to the request sent to it.
+        """
+        self._requests.pop(candidate.sock_addr, None)
+        differences = self._differences.pop(candidate.sock_addr, [])
+        if len(self._differences) >= SYNC_DIGEST_CANDIDATES:
+            self._differences.popitem(False)
+        # the most recently reported ranges are visited first, from low to high global time
+        differences.extend(reversed(ranges))
+        if differences:
+            self._differences[candidate.sock_addr] = differences
+
+    def has_differences(self, candidate):
+        return bool(candidate and candidate.sock_addr in self._differences)
+
+    def peek_difference(self, candidate):
+        """
+        Returns the (time_low, time_high) range that pop_difference will return next, or None.
+        """
+        differences = self._differences.get(candidate.sock_addr) if candidate else None
+        return differences[-1] if differences else None
+
+    def pop_difference(self, candidate):
+        """
+        Returns a (time_low, time_high) range that differs from CANDIDATE, or None.
+        """
+        differences = self._differences.get(candidate.sock_addr) if candidate else None
+        if not differences:
+            return None
+
+        time_range = differences.pop()
+        if not differences:
+            del self._differences[candidate.sock_addr]
+        return time_range
@@ -0,0 +1,185 @@
+from collections import OrderedDict
+from heapq import heapify, heappop, heappush
+from itertools import count
+from time import time
+import logging
+
+from twisted.internet import reactor
+
+from .taskmanager import TaskManager
+from .util import TokenBucket
+
+
+# bytes per second, and the maximum burst in bytes, that all sync responses together may upload
+SYNC_RESPONSE_RATE = 1024 * 1024.0
+SYNC_RESPONSE_BURST = 4 * 1024 * 1024
+# bytes per second, and the maximum burst in bytes, that the sync responses to a single candidate may upload
+SYNC_RESPONSE_CANDIDATE_RATE = 64 * 1024.0
+SYNC_RESPONSE_CANDIDATE_BURST = 256 * 1024
+# maximum number of bytes waiting for the global budget, the lowest priority packets are dropped first
+SYNC_RESPONSE_DEFERRED_BYTES = 1024 * 1024
+# seconds that a packet may wait for the global budget.  by then the candidate has sent a new sync request
+SYNC_RESPONSE_DEFERRED_AGE = 5.0
+# maximum number of per-candidate token buckets, the least recently used bucket is discarded first
+SYNC_RESPONSE_CANDIDATE_BUCKETS = 10000
+
+
+class SyncResponseScheduler(TaskManager):
+
+    """
+    Sends the packets of sync responses within a global and a per-candidate upload budget.
+
+    Packets are sent in order of their meta message priority, the packets of different candidates with the same
+    priority are interleaved.  A packet exceeding the budget of its candidate is dropped, the candidate will request it
+    again using its next bloom filter.  A packet exceeding the global budget is deferred until the budget allows it
+    or until it is SYNC_RESPONSE_DEFERRED_AGE seconds old.  The sent, deferred, and dropped bytes are counted in the
+    community statistics.
+    """
+
+    def __init__(self, dispersy, rate=SYNC_RESPONSE_RATE, burst=SYNC_RESPONSE_BURST,
+                 candidate_rate=SYNC_RESPONSE_CANDIDATE_RATE, candidate_burst=SYNC_RESPONSE_CANDIDATE_BURST,
+                 deferred_bytes=SYNC_RESPONSE_DEFERRED_BYTES, deferred_age=SYNC_RESPONSE_DEFERRED_AGE):
+        assert isinstance(rate, float), type(rate)
+        assert isinstance(burst, int), type(burst)
+        assert isinstance(candidate_rate, float), type(candidate_rate)
+        assert isinstance(candidate_burst, int), type(candidate_burst)
+        assert isinstance(deferred_bytes, int), type(deferred_bytes)
+        assert isinstance(deferred_age, float), type(deferred_age)
+        super(SyncResponseScheduler, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._dispersy = dispersy
+        self._bucket = TokenBucket(rate, burst, time())
+        self._candidate_rate = candidate_rate
+        self._candidate_burst = candidate_burst
+        # sock_addr:TokenBucket pairs in least recently used order
+        self._candidate_buckets = OrderedDict()
+
+        self._deferred_limit = deferred_bytes
+        self._deferred_age = deferred_age
+        # heap with (-priority, index, sequence, timestamp, community, candidate, packet) tuples
+        self._deferred = []
+        self._deferred_bytes = 0
+        self._sequence = count()
+
+    @property
+    def deferred_bytes(self):
+        """
+        The number of bytes waiting for the global budget.
+        @rtype: int
+        """
+        return self._deferred_bytes
+
+    def schedule(self, community, responses, now=None):
+        """
+        Sends, defers, or drops the RESPONSES of COMMUNITY.
+
+        RESPONSES is a list with (candidate, [(packet, priority), ...]) tuples, where the packets of each candidate are
+        given in the order they should be sent.
+        """
+        assert isinstance(responses, list), type(responses)
+        assert all(isinstance(packets, list) for _, packets in responses)
+        if now is None:
+            now = time()
+
+        deferred = self._deferred
+        for candidate, packets in responses:
+            for index, (packet, priority) in enumerate(packets):
+                heappush(deferred, (-priority, index, next(self._sequence), now, community, candidate, packet))
+                self._deferred_bytes += len(packet)
+
+        self._process(now, new=True)
+
+    def clear(self):
+        """
+        Drops all deferred packets without counting them, used when Dispersy stops.
+        """
+        self.cancel_all_pending_tasks()
+        del self._deferred[:]
+        self._deferred_bytes = 0
+        self._candidate_buckets.clear()
+
+    def discard(self, community):
+        """
+        Drops the deferred packets of COMMUNITY without counting them, used when COMMUNITY is unloaded.
+        """
+        deferred = [item for item in self._deferred if item[4] is not community]
+        if len(deferred) < len(self._deferred):
+            heapify(deferred)
+            self._deferred[:] = deferred
+            self._deferred_bytes = sum(len(item[6]) for item in deferred)
+            if not deferred:
+                self.cancel_pending_task("process")
+
+    def _get_candidate_bucket(self, sock_addr, now):
+        buckets = self._candidate_buckets
+        # pop and reinsert to keep BUCKETS in least recently used order
+        bucket = buckets.pop(sock_addr, None)
+        if bucket is None:
+            bucket = TokenBucket(self._candidate_rate, self._candidate_burst, now)
+            if len(buckets) >= SYNC_RESPONSE_CANDIDATE_BUCKETS:
+                buckets.popitem(False)
+        buckets[sock_addr] = bucket
+        return bucket
+
+    def _process(self, now=None, new=False):
+        """
+        Sends the deferred packets in priority order until the global budget is used.  When NEW is True the
+        packets that remain deferred are the ones that were just scheduled, hence they are counted as deferred.
+        """
+        if now is None:
+            now = time()
+
+        deferred = self._deferred
+        expire_before = now - self._deferred_age
+        # (community, candidate):[packet, ...] in the order the first packet for each pair was sent
+        outgoing = OrderedDict()
+        dropped = {}
+
+        while deferred:
+            _, _, _, timestamp, community, candidate, packet = deferred[0]
+            length = len(packet)
+
+            if timestamp >= expire_before:
+                if self._bucket.get_delay(length, now) > 0.0:
+                    break
+
+                if self._get_candidate_bucket(candidate.sock_addr, now).take_all(length, now):
+                    self._bucket.take_all(length, now)
+                    heappop(deferred)
+                    self._deferred_bytes -= length
+                    outgoing.setdefault((community, candidate), []).append(packet)
+                    continue
+
+            heappop(deferred)
+            self._deferred_bytes -= length
+            dropped[community] = dropped.get(community, 0) + length
+
+        # keep the highest priority packets when too many bytes are deferred
+        if self._deferred_bytes > self._deferred_limit:
+            deferred.sort()
+            kept = 0
+            for index, item in enumerate(deferred):
+                if kept + len(item[6]) > self._deferred_limit:
+                    for item in deferred[index:]:
+                        dropped[item[4]] = dropped.get(item[4], 0) + len(item[6])
+                    del deferred[index:]
+                    break
+                kept += len(item[6])
+            self._deferred_bytes = kept
+
+        for (community, candidate), packets in outgoing.iteritems():
+            community.statistics.sync_response_sent_bytes += sum(len(packet) for packet in packets)
+            self._dispersy._send_packets([candidate], packets, community, "-caused by sync-")
+
+        for community, length in dropped.iteritems():
+            community.statistics.sync_response_dropped_bytes += length
+
+        if new:
+            for item in deferred:
+                if item[3] == now:
+                    item[4].statistics.sync_response_deferred_bytes += len(item[6])
+
+        if deferred and not self.is_pending_task_active("process"):
+            delay = max(0.01, self._bucket.get_delay(len(deferred[0][6]), now))
+            self.register_task("process", reactor.callLater(delay, self._process))
@@ -1,13 +1,11 @@
 from threading import Lock
 
-from .util import blocking_call_on_reactor_thread
+from .util import blockingCallFromThread
 from twisted.internet import reactor
 from twisted.internet.base import DelayedCall
 from twisted.internet.defer import Deferred
 from twisted.internet.task import LoopingCall
-
-
-CLEANUP_FREQUENCY = 100
+from twisted.python.threadable import isInIOThread
 
 
 class TaskManager(object):
@@ -15,12 +13,14 @@ class TaskManager(object):
     """
     Provides a set of tools to mantain a list of twisted "tasks" (Deferred, LoopingCall, DelayedCall) that are to be
     executed during the lifetime of an arbitrary object, usually getting killed with it.
+
+    Finished DelayedCalls and Deferreds remove themselves from the task list when they fire, hence registering and
+    canceling a task takes constant time regardless of the number of tasks that have been registered before.
     """
     _reactor = reactor
 
     def __init__(self):
         self._pending_tasks = {}
-        self._cleanup_counter = CLEANUP_FREQUENCY
         self._task_lock = Lock()
 
     def replace_task(self, name, task):
@@ -49,23 +49,30 @@ class TaskManager(object):
             else:
                 raise ValueError("Expecting Deferred or LoopingCall if task is delayed")
 
-            task = (dc, task)
+            handle = (dc, task)
+
+        else:
+            handle = task
 
-        self._maybe_clean_task_list()
         with self._task_lock:
-            self._pending_tasks[name] = task
-        return task
+            self._pending_tasks[name] = handle
+
+        # a delayed Deferred is removed once it fires, a delayed LoopingCall remains until it is stopped
+        if isinstance(task, Deferred):
+            task.addBoth(self._forget_task_callback, name, handle)
+        elif isinstance(task, DelayedCall) and task.active():
+            self._forget_task_when_called(name, task)
+
+        return handle
 
-    @blocking_call_on_reactor_thread
     def cancel_pending_task(self, name):
         """
         Cancels the named task
         """
-        self._maybe_clean_task_list()
-        is_active, stopfn = self._get_isactive_stopper(name)
-        if is_active and stopfn:
-            stopfn()
-            self._pending_tasks.pop(name)
+        if isInIOThread():
+            self._cancel_pending_task(name)
+        else:
+            blockingCallFromThread(reactor, self._cancel_pending_task, name)
 
     def cancel_all_pending_tasks(self):
         """
@@ -75,50 +82,82 @@ class TaskManager(object):
         assert all([isinstance(task, (Deferred, DelayedCall, LoopingCall, tuple))
                     for task in self._pending_tasks.itervalues()]), self._pending_tasks
 
-        for name in self._pending_tasks.keys():
-            self.cancel_pending_task(name)
+        if isInIOThread():
+            self._cancel_all_pending_tasks()
+        else:
+            blockingCallFromThread(reactor, self._cancel_all_pending_tasks)
 
     def is_pending_task_active(self, name):
         """
         Return a boolean determining if a task is active.
         """
-        return self._get_isactive_stopper(name)[0]
+        return self._get_isactive_stopper(self._pending_tasks.get(name))[0]
 
-    def _get_isactive_stopper(self, name):
+    def _cancel_pending_task(self, name):
         """
-        Return a boolean determining if a task is active and its cancel/stop method if the task is registered.
+        Cancels the named task.  Must be called on the reactor thread.
         """
-        task = self._pending_tasks.get(name, None)
+        with self._task_lock:
+            task = self._pending_tasks.pop(name, None)
 
-        def do_get(task):
-            if isinstance(task, Deferred):
-                # Have in mind that any deferred in the pending tasks list should have been constructed with a
-                # canceller function.
-                return not task.called, getattr(task, 'cancel', None)
-            elif isinstance(task, DelayedCall):
-                return task.active(), task.cancel
-            elif isinstance(task, LoopingCall):
-                return task.running, task.stop
-            elif isinstance(task, tuple):
-                if task[0].active():
-                    return task[0].active(), task[0].cancel
-                else:
-                    return do_get(task[1])
-            else:
-                return False, None
+        is_active, stopfn = self._get_isactive_stopper(task)
+        if is_active and stopfn:
+            stopfn()
+
+    def _cancel_all_pending_tasks(self):
+        """
+        Cancels all the registered tasks.  Must be called on the reactor thread.
+        """
+        with self._task_lock:
+            tasks = self._pending_tasks
+            self._pending_tasks = {}
 
-        return do_get(task)
+        for task in tasks.itervalues():
+            is_active, stopfn = self._get_isactive_stopper(task)
+            if is_active and stopfn:
+                stopfn()
 
-    def _maybe_clean_task_list(self):
+    def _get_isactive_stopper(self, task):
         """
-        Removes finished tasks from the task list.
+        Return a boolean determining if TASK is active and its cancel/stop method if the task is registered.
         """
-        if self._cleanup_counter:
-            self._cleanup_counter -= 1
+        if isinstance(task, Deferred):
+            # Have in mind that any deferred in the pending tasks list should have been constructed with a
+            # canceller function.
+            return not task.called, getattr(task, 'cancel', None)
+        elif isinstance(task, DelayedCall):
+            return task.active(), task.cancel
+        elif isinstance(task, LoopingCall):
+            return task.running, task.stop
+        elif isinstance(task, tuple):
+            if task[0].active():
+                return True, task[0].cancel
+            else:
+                return self._get_isactive_stopper(task[1])
         else:
-            self._cleaup_counter = CLEANUP_FREQUENCY
-            for name in self._pending_tasks.keys():
-                if not self.is_pending_task_active(name):
-                    self._pending_tasks.pop(name)
+            return False, None
+
+    def _forget_task(self, name, handle):
+        """
+        Removes NAME from the task list, unless it has been re-registered with a different task in the meantime.
+        """
+        with self._task_lock:
+            if self._pending_tasks.get(name) is handle:
+                del self._pending_tasks[name]
+
+    def _forget_task_callback(self, result, name, handle):
+        self._forget_task(name, handle)
+        return result
+
+    def _forget_task_when_called(self, name, dc):
+        """
+        Wraps the function of DC so that NAME is removed from the task list when DC is called.
+        """
+        func = dc.func
+
+        def forget_and_call(*args, **kargs):
+            self._forget_task(name, dc)
+            return func(*args, **kargs)
+        dc.func = forget_and_call
 
 __all__ = ["TaskManager"]
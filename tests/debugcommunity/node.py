@@ -11,9 +11,11 @@ from ...bloomfilter import BloomFilter
 from ...candidate import Candidate
 from ...endpoint import TUNNEL_PREFIX
 from ...exception import ConversionNotFoundException
+from ...iblt import InvertibleBloomLookupTable
 from ...member import Member
 from ...message import Message
 from ...resolution import PublicResolution, LinearResolution
+from ...syncdigest import RangeDigests
 from .community import DebugCommunity
 from ...util import blocking_call_on_reactor_thread, blockingCallFromThread
 
@@ -157,6 +159,11 @@ class DebugNode(object):
         self._logger.debug("%s giving %d bytes", self.my_candidate, sum(len(packet) for packet in packets))
         self._dispersy.endpoint.process_packets([(source.lan_address, TUNNEL_PREFIX + packet if source.tunnel else packet) for packet in packets], cache=cache)
 
+        if not isInIOThread():
+            # large bursts are dispatched over several reactor ticks, see Dispersy._dispatch_incoming_packets
+            while self.call(lambda: self._dispersy._incoming_dispatching):
+                sleep(0.001)
+
     def give_message(self, message, source, cache=False):
         self.give_messages([message], source, cache=cache)
 
@@ -612,11 +619,14 @@ class DebugNode(object):
             assert isinstance(time_high, (int, long))
             assert isinstance(modulo, int)
             assert isinstance(offset, int)
-            assert isinstance(bloom_packets, list)
-            assert all(isinstance(packet, str) for packet in bloom_packets)
-            bloom_filter = BloomFilter(512 * 8, 0.001, prefix="x")
-            for packet in bloom_packets:
-                bloom_filter.add(packet)
+            if isinstance(bloom_packets, (InvertibleBloomLookupTable, RangeDigests)):
+                bloom_filter = bloom_packets
+            else:
+                assert isinstance(bloom_packets, list)
+                assert all(isinstance(packet, str) for packet in bloom_packets)
+                bloom_filter = BloomFilter(512 * 8, 0.001, prefix="x")
+                for packet in bloom_packets:
+                    bloom_filter.add(packet)
             sync = (time_low, time_high, modulo, offset, bloom_filter)
         assert isinstance(identifier, int), type(identifier)
 
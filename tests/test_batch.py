@@ -1,5 +1,8 @@
 from time import time, sleep
 
+from .. import dispersy as dispersy_module
+from ..candidate import Candidate
+from ..util import blocking_call_on_reactor_thread, TokenBucket
 from .dispersytestclass import DispersyTestFunc
 
 
@@ -25,6 +28,99 @@ class TestBatch(DispersyTestFunc):
         # all of the messages must be stored in the database, as batch_window expired
         other.assert_count(messages[0], 10)
 
+    def test_batch_latency(self):
+        """
+        The latency of each pipeline stage is available per meta message.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        messages = [node.create_batched_text("latency", i + 10) for i in range(10)]
+        other.give_messages(messages, node, cache=True)
+        sleep(messages[0].meta.batch.max_window + 1.0)
+        other.assert_count(messages[0], 10)
+
+        @blocking_call_on_reactor_thread
+        def get_latency():
+            other.community.statistics.update()
+            return other.community.statistics.latency
+        latency = get_latency()
+
+        for stage, count in ((u"receive", 10), (u"batch", 1), (u"decode", 10), (u"distribution", 1), (u"check", 1),
+                             (u"store", 1), (u"handle", 1)):
+            self.assertEqual(latency[stage][u"batched-text"]["count"], count, stage)
+            self.assertLessEqual(latency[stage][u"batched-text"]["p50"], latency[stage][u"batched-text"]["p99"])
+        self.assertGreaterEqual(latency[u"batch"][u"batched-text"]["p50"], messages[0].meta.batch.max_window)
+
+    def test_candidate_rate_limit(self):
+        """
+        Packets exceeding the incoming packet rate of their candidate are dropped before they are decoded.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        @blocking_call_on_reactor_thread
+        def limit_candidate():
+            key = (other.community.cid, node.lan_address)
+            other._dispersy._incoming_candidate_buckets[key] = TokenBucket(0.001, 5, time())
+        limit_candidate()
+
+        messages = [node.create_full_sync_text("rate limited #%d" % global_time, global_time)
+                    for global_time in xrange(10, 20)]
+        other.give_messages(messages, node)
+        other.assert_count(messages[0], 5)
+
+        @blocking_call_on_reactor_thread
+        def get_drop_count():
+            return other.community.statistics.msg_statistics.drop_dict[u"on_incoming_packets:candidate rate limit"]
+        self.assertEqual(get_drop_count(), 5)
+
+    def test_unload_drops_rate_limit(self):
+        """
+        The token bucket of a community is discarded when the community is unloaded.
+        """
+        node, other = self.create_nodes(2)
+        other.give_message(node.create_full_sync_text("Hello World", 10), node)
+
+        @blocking_call_on_reactor_thread
+        def unload():
+            cid = other.community.cid
+            self.assertIn(cid, other._dispersy._incoming_buckets)
+            other.community.unload_community()
+            self.assertNotIn(cid, other._dispersy._incoming_buckets)
+        unload()
+
+    def test_dispatch_slices(self):
+        """
+        A burst of incoming packets is dispatched over several reactor ticks.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        messages = [node.create_full_sync_text("slice #%d" % global_time, global_time)
+                    for global_time in xrange(10, 10 + 3 * dispersy_module.INCOMING_SLICE_PACKETS)]
+
+        @blocking_call_on_reactor_thread
+        def give_burst():
+            dispersy = other._dispersy
+            slice_ = dispersy_module.INCOMING_DISPATCH_SLICE
+            dispersy_module.INCOMING_DISPATCH_SLICE = 0.0
+            try:
+                dispersy.on_incoming_packets([(Candidate(node.lan_address, False), message.packet)
+                                              for message in messages], True, time(), u"standalone_ep")
+            finally:
+                dispersy_module.INCOMING_DISPATCH_SLICE = slice_
+
+            # only the first slice was handed to the community, the remainder is dispatched later
+            self.assertTrue(dispersy._incoming_dispatching)
+            self.assertEqual(sum(len(packets) for queue in dispersy._incoming.itervalues()
+                                 for packets, _, _, _ in queue), 2 * dispersy_module.INCOMING_SLICE_PACKETS)
+        give_burst()
+
+        while other.call(lambda: other._dispersy._incoming_dispatching):
+            sleep(0.01)
+        other.assert_count(messages[0], len(messages))
+
     def test_multiple_batch(self):
         node, other = self.create_nodes(2)
         other.send_identity(node)
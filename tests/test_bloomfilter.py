@@ -78,6 +78,21 @@ class TestBloomFilter(TestCase):
             self.assertEqual(bloom.prefix, "p")
             self.assertTrue(all(str(i) in bloom for i in xrange(100)))
 
+    def test_wire_format(self):
+        """
+        Bit POS is stored in byte POS / 8 as 1 << (POS % 8), for bloom filters built locally and from bytes.
+        """
+        bloom = BloomFilter(64, 0.1, "p")
+        bloom.add_keys(["a", "b"])
+        self.assertEqual(bloom.bytes, "00400801800a2800".decode("HEX"))
+        self.assertEqual(bloom.bits_checked, 8)
+
+        bloom = BloomFilter("0100000000000080".decode("HEX"), 4, "p")
+        self.assertEqual(bloom.bits_checked, 2)
+        bloom.add("a")
+        self.assertIn("a", bloom)
+        self.assertEqual(bloom.bytes, "01400000800a0080".decode("HEX"))
+
     def test_clear(self):
         """
         Testing BloomFilter.clear()
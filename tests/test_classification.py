@@ -1,5 +1,7 @@
+from time import sleep
+
 from ..exception import CommunityNotFoundException
-from ..util import call_on_reactor_thread
+from ..util import call_on_reactor_thread, blocking_call_on_reactor_thread
 from .debugcommunity.community import DebugCommunity
 from .dispersytestclass import DispersyTestFunc
 
@@ -171,3 +173,57 @@ class TestClassification(DispersyTestFunc):
 
     def test_enable_disable_autoload(self):
         self.test_enable_autoload(False)
+
+    def test_lazy_load_communities(self):
+        """
+        Lazy loaded communities are initialized on first use, the others are initialized in the background.
+        """
+        class LazyCommunity(DebugCommunity):
+            pass
+
+        @blocking_call_on_reactor_thread
+        def create_communities():
+            cids = []
+            for _ in xrange(3):
+                community = LazyCommunity.create_community(self._dispersy, self._mm.my_member)
+                cids.append(community.cid)
+                community.unload_community()
+            return cids
+
+        @blocking_call_on_reactor_thread
+        def define_auto_load():
+            loaded = self._dispersy.define_auto_load(LazyCommunity, self._mm.my_member, load=True, lazy=True)
+            self.assertEqual(loaded, [])
+            self.assertEqual(self._dispersy.statistics.lazy_pending, 3)
+            self.assertFalse(any(cid in self._dispersy._communities for cid in cids))
+
+            # first use initializes the community immediately
+            community = self._dispersy.get_community(cids[1])
+            self.assertIsInstance(community, LazyCommunity)
+            self.assertEqual(self._dispersy.statistics.lazy_pending, 2)
+            self.assertEqual(self._dispersy.statistics.lazy_loaded_on_demand, 1)
+
+        @blocking_call_on_reactor_thread
+        def verify_loaded():
+            self.assertTrue(all(cid in self._dispersy._communities for cid in cids))
+            self.assertEqual(self._dispersy.statistics.lazy_pending, 0)
+            self.assertEqual(self._dispersy.statistics.lazy_loaded_background, 2)
+
+        cids = create_communities()
+        define_auto_load()
+        sleep(0.5)
+        verify_loaded()
+
+    @blocking_call_on_reactor_thread
+    def test_startup_statistics(self):
+        """
+        The duration of each Dispersy.start and Community.initialize phase is available in the statistics.
+        """
+        startup = self._dispersy.statistics.startup
+        for phase in (u"database", u"database:connect", u"database:prepare_version", u"endpoint"):
+            self.assertIn(phase, startup)
+            self.assertGreaterEqual(startup[phase], 0.0)
+
+        startup = self._community.statistics.startup
+        self.assertEqual(sorted(startup), sorted([u"community", u"meta_messages", u"global_time", u"sequence_numbers",
+                                                  u"timeline", u"identity", u"check_database"]))
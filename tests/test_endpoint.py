@@ -0,0 +1,36 @@
+from ..candidate import Candidate
+from ..endpoint import StandaloneEndpoint
+from .dispersytestclass import DispersyTestFunc
+
+
+class RecordingEndpoint(StandaloneEndpoint):
+
+    """
+    StandaloneEndpoint that records the packets given to send_packet instead of sending them.
+    """
+
+    def __init__(self, *args, **kargs):
+        super(RecordingEndpoint, self).__init__(*args, **kargs)
+        self.packets = []
+
+    def send_packet(self, candidate, packet, prefix=None):
+        self.packets.append((candidate, packet))
+        return True
+
+
+class TestEndpoint(DispersyTestFunc):
+
+    def test_send_packet_override(self):
+        """
+        send and send_many must use send_packet when a subclass overrides it.
+        """
+        endpoint = RecordingEndpoint(0)
+        endpoint._dispersy = self._dispersy
+        candidates = [Candidate(("127.0.0.1", port), False) for port in (1, 2)]
+
+        self.assertTrue(endpoint.send(candidates, ["a", "b"]))
+        self.assertEqual(endpoint.packets, [(candidates[0], "a"), (candidates[0], "b"),
+                                            (candidates[1], "a"), (candidates[1], "b")])
+
+        self.assertTrue(endpoint.send_many([(candidates[1], "c")]))
+        self.assertEqual(endpoint.packets[-1], (candidates[1], "c"))
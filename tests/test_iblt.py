@@ -0,0 +1,72 @@
+from unittest import TestCase
+
+from ..iblt import InvertibleBloomLookupTable, CELL_SIZE, get_key
+
+
+class TestInvertibleBloomLookupTable(TestCase):
+
+    def test_constructor(self):
+        """
+        Testing InvertibleBloomLookupTable(int:m_size, ...) and InvertibleBloomLookupTable(str:bytes, ...)
+        """
+        table = InvertibleBloomLookupTable(1000 * 8, 3, "p")
+        table.add_keys(str(i) for i in xrange(500))
+        self.assertEqual(table.cells, 1000 // CELL_SIZE // 3 * 3)
+        self.assertEqual(table.size, table.cells * CELL_SIZE * 8)
+        self.assertEqual(len(table.bytes), table.cells * CELL_SIZE)
+
+        clone = InvertibleBloomLookupTable(table.bytes, table.functions, table.prefix)
+        self.assertEqual((clone.cells, clone.functions, clone.prefix), (table.cells, 3, "p"))
+        self.assertEqual(clone.bytes, table.bytes)
+
+    def test_decode(self):
+        """
+        Subtracting two tables lists the keys that only one of them contains.
+        """
+        common = [str(i) for i in xrange(1000)]
+        left = InvertibleBloomLookupTable(1000 * 8, prefix="p")
+        left.add_keys(common + ["left %d" % i for i in xrange(20)])
+        right = InvertibleBloomLookupTable(1000 * 8, prefix="p")
+        right.add_keys(common + ["right %d" % i for i in xrange(10)])
+
+        positive, negative = left.subtract(right).decode()
+        self.assertEqual(positive, set(get_key("left %d" % i) for i in xrange(20)))
+        self.assertEqual(negative, set(get_key("right %d" % i) for i in xrange(10)))
+
+    def test_not_filter(self):
+        """
+        not_filter yields the packets missing from the table, or nothing when the difference is too large.
+        """
+        common = [(str(i),) for i in xrange(1000)]
+        missing = [("missing %d" % i,) for i in xrange(20)]
+        table = InvertibleBloomLookupTable(1000 * 8, prefix="p")
+        table.add_keys(packet for packet, in common)
+        table.add("unknown")
+
+        received = InvertibleBloomLookupTable(table.bytes, table.functions, table.prefix)
+        self.assertIsNone(received.decoded)
+        self.assertEqual(list(received.not_filter(common + missing)), missing)
+        self.assertTrue(received.decoded)
+
+        received = InvertibleBloomLookupTable(table.bytes, table.functions, table.prefix)
+        self.assertEqual(list(received.not_filter(common[:500] + missing)), [])
+        self.assertFalse(received.decoded)
+
+    def test_not_filter_max_items(self):
+        """
+        not_filter stops consuming the iterator and yields nothing when it contains more than MAX_ITEMS tuples.
+        """
+        packets = [(str(i),) for i in xrange(100)]
+        table = InvertibleBloomLookupTable(1000 * 8, prefix="p")
+        table.add_keys(packet for packet, in packets[:90])
+
+        received = InvertibleBloomLookupTable(table.bytes, table.functions, table.prefix)
+        self.assertEqual(list(received.not_filter(packets, max_items=100)), packets[90:])
+        self.assertTrue(received.decoded)
+
+        iterator = iter(packets)
+        received = InvertibleBloomLookupTable(table.bytes, table.functions, table.prefix)
+        self.assertEqual(list(received.not_filter(iterator, max_items=50)), [])
+        self.assertFalse(received.decoded)
+        # only MAX_ITEMS + 1 tuples were consumed
+        self.assertEqual(len(list(iterator)), 49)
@@ -1,8 +1,51 @@
 from random import shuffle
 
+from ..candidate import Candidate
+from ..message import DelayMessage
+from ..util import blocking_call_on_reactor_thread
+from .debugcommunity.community import DebugCommunity
 from .dispersytestclass import DispersyTestFunc
 
 
+class DelayMessageByKey(DelayMessage):
+
+    def __init__(self, delayed, key):
+        super(DelayMessageByKey, self).__init__(delayed)
+        self._key = key
+        self.resumed = False
+        self.timed_out = False
+        self.requested = False
+
+    @property
+    def match_info(self):
+        return (self._cid,) + self._key,
+
+    def send_request(self, community, candidate):
+        self.requested = True
+
+    def on_success(self):
+        self.resumed = True
+        return super(DelayMessageByKey, self).on_success()
+
+    def on_timeout(self):
+        self.timed_out = True
+
+
+class LimitedDelayCommunity(DebugCommunity):
+
+    @property
+    def dispersy_delayed_max_count(self):
+        return 4
+
+    @property
+    def dispersy_delayed_max_count_per_candidate(self):
+        return 3
+
+    @property
+    def dispersy_delayed_request_limit(self):
+        return 2
+
+
 class TestMissingMessage(DispersyTestFunc):
 
     def _test_with_order(self, batchFUNC):
@@ -45,3 +88,157 @@ class TestMissingMessage(DispersyTestFunc):
                 batches.append([messages[i], messages[i + 1]])
             return batches
         self._test_with_order(batch)
+
+    @blocking_call_on_reactor_thread
+    def _delay(self, community, delays, candidate=None):
+        for delay in delays:
+            for key in delay.match_info:
+                community._delay(key[1:], delay, delay.delayed.packet, candidate)
+
+    @blocking_call_on_reactor_thread
+    def _resume(self, community, message):
+        community._resume_delayed(message.meta, [message])
+
+    def test_resume_delayed_matching_keys(self):
+        """
+        Only delays with a key matching a received message are resumed, where None matches anything.
+        """
+        node, = self.create_nodes(1)
+        community = self._community
+        mid = node.my_member.mid
+
+        exact = DelayMessageByKey(node.create_full_sync_text("exact", 10), (u"full-sync-text", mid, 42, None))
+        wildcard = DelayMessageByKey(node.create_full_sync_text("wildcard", 11), (u"full-sync-text", None, None, None))
+        other = DelayMessageByKey(node.create_full_sync_text("other", 12), (u"full-sync-text", mid, 43, None))
+        self._delay(community, [exact, wildcard, other])
+        self._resume(community, node.create_full_sync_text("trigger", 42))
+
+        self.assertTrue(exact.resumed)
+        self.assertTrue(wildcard.resumed)
+        self.assertFalse(other.resumed)
+        self.assertEqual(community._delayed_value.keys(), [other])
+        self.assertEqual(community._delayed_wildcards, {(3,): 1})
+
+    def test_delayed_timeout(self):
+        """
+        Delays time out when they are old enough, delays that have been resumed are skipped.
+        """
+        node, = self.create_nodes(1)
+        community = self._community
+        mid = node.my_member.mid
+
+        delays = [DelayMessageByKey(node.create_full_sync_text("text", 10 + i), (u"full-sync-text", mid, 42 + i, None))
+                  for i in xrange(3)]
+        # only the first two delays are old enough to time out
+        delays[0]._timestamp -= 60.0
+        delays[1]._timestamp -= 30.0
+        self._delay(community, delays)
+        self._resume(community, node.create_full_sync_text("trigger", 42))
+        blocking_call_on_reactor_thread(community._periodically_clean_delayed)()
+
+        self.assertEqual([(delay.resumed, delay.timed_out) for delay in delays],
+                         [(True, False), (False, True), (False, False)])
+        self.assertEqual(community._delayed_value.keys(), [delays[2]])
+
+    def test_delayed_limits(self):
+        """
+        Delays are evicted when a candidate exceeds its quota or when the community exceeds its limits, in which
+        case the candidate with the most delays loses its oldest one.  Requests are rate limited per candidate.
+        """
+        node, = self.create_nodes(1, community_class=LimitedDelayCommunity)
+        community = node._community
+        mid = node.my_member.mid
+        statistics = community.statistics.msg_statistics
+
+        def create_delays(count, global_time):
+            return [DelayMessageByKey(node.create_full_sync_text("text", global_time + i),
+                                      (u"full-sync-text", mid, global_time + 100 + i, None))
+                    for i in xrange(count)]
+
+        a = create_delays(4, 10)
+        b = create_delays(2, 20)
+        self._delay(community, a, Candidate(("127.0.0.1", 1), False))
+        self.assertEqual([delay.timed_out for delay in a], [True, False, False, False])
+
+        self._delay(community, b, Candidate(("127.0.0.2", 1), False))
+        self.assertEqual([delay.timed_out for delay in a], [True, True, False, False])
+        self.assertEqual(set(community._delayed_value), set(a[2:] + b))
+        self.assertEqual(community.delayed_size[0], 4)
+        self.assertEqual(community.delayed_size[1], sum(len(delay.delayed.packet) for delay in a[2:] + b))
+        self.assertEqual(statistics.delay_evict_count, 2)
+
+        self.assertEqual([delay.requested for delay in a + b], [True, True, False, False, True, True])
+        self.assertEqual(statistics.delay_send_limited_count, 2)
+
+    def test_delayed_fair_eviction(self):
+        """
+        The fair eviction policy uses the current number of delays per candidate, also after delays were resumed.
+        """
+        node, = self.create_nodes(1, community_class=LimitedDelayCommunity)
+        community = node._community
+        mid = node.my_member.mid
+
+        def create_delays(count, global_time):
+            return [DelayMessageByKey(node.create_full_sync_text("text", global_time + i),
+                                      (u"full-sync-text", mid, global_time + 100 + i, None))
+                    for i in xrange(count)]
+
+        a = create_delays(3, 10)
+        b = create_delays(3, 20)
+        c = create_delays(1, 30)
+        self._delay(community, a, Candidate(("127.0.0.1", 1), False))
+        for delay in a[:2]:
+            self._resume(community, node.create_full_sync_text("trigger", delay.match_info[0][3]))
+        self.assertEqual([delay.resumed for delay in a], [True, True, False])
+
+        # B now has the most delays, even though A had as many before
+        self._delay(community, b, Candidate(("127.0.0.2", 1), False))
+        self._delay(community, c, Candidate(("127.0.0.3", 1), False))
+        self.assertEqual([delay.timed_out for delay in a + b + c], [False, False, False, True, False, False, False])
+        self.assertEqual(set(community._delayed_value), set(a[2:] + b[1:] + c))
+
+    def test_coalesced_missing_message_requests(self):
+        """
+        OTHER requests several messages from NODE, the requests are combined into a single dispersy-missing-message
+        and messages that are still being requested are not requested again.
+        """
+        node, other = self.create_nodes(2)
+        node.send_identity(other)
+
+        @blocking_call_on_reactor_thread
+        def request(global_times):
+            member = other.community.dispersy.get_member(public_key=node.my_member.public_key)
+            return [other.community.request_missing_message(node.my_candidate, member, global_time)
+                    for global_time in global_times]
+
+        self.assertEqual(request([10, 11, 12]), [True, True, True])
+        self.assertEqual(request([11, 13]), [False, True])
+
+        responses = node.receive_messages(names=[u"dispersy-missing-message"])
+        self.assertEqual(len(responses), 1)
+        _, response = responses[0]
+        self.assertEqual(list(response.payload.global_times), [10, 11, 12, 13])
+
+    def test_missing_message_other_candidate(self):
+        """
+        A message that is being requested from NODE is not requested from NODE again, but may be requested from
+        THIRD.
+        """
+        node, other, third = self.create_nodes(3)
+        node.send_identity(other)
+
+        @blocking_call_on_reactor_thread
+        def request(candidate):
+            member = other.community.dispersy.get_member(public_key=node.my_member.public_key)
+            return other.community.request_missing_message(candidate, member, 10)
+
+        self.assertTrue(request(node.my_candidate))
+        self.assertFalse(request(node.my_candidate))
+        self.assertTrue(request(third.my_candidate))
+        self.assertFalse(request(third.my_candidate))
+
+        for receiver in (node, third):
+            responses = receiver.receive_messages(names=[u"dispersy-missing-message"])
+            self.assertEqual(len(responses), 1)
+            _, response = responses[0]
+            self.assertEqual(list(response.payload.global_times), [10])
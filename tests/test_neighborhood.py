@@ -83,3 +83,29 @@ class TestNeighborhood(DispersyTestFunc):
 
         # We should never send to more than node_count + targeted_node_count nodes
         self.assertEqual(forwarded_node_count, min(total_node_count, meta.destination.node_count + targeted_node_count))
+
+    def test_forward_batch(self):
+        """
+        SELF should send a batch of messages to the same candidates using a single endpoint call.
+        """
+        nodes = self.create_nodes(5)
+        messages = [self._mm.create_full_sync_text("Hello World #%d" % i, global_time=42 + i) for i in xrange(3)]
+
+        sends = []
+        send_many = self._dispersy.endpoint.send_many
+        def mock_send_many(packets):
+            sends.append(packets)
+            return send_many(packets)
+        self._dispersy.endpoint.send_many = mock_send_many
+
+        outgoing_count = self._community.statistics.msg_statistics.outgoing_count
+        self.assertTrue(self._dispersy._forward(messages))
+
+        self.assertEqual(len(sends), 1)
+        self.assertEqual(len(sends[0]), len(nodes) * len(messages))
+        self.assertEqual(self._community.statistics.msg_statistics.outgoing_count - outgoing_count,
+                         len(nodes) * len(messages))
+
+        for node in nodes:
+            forwarded = [m for _, m in node.receive_messages(names=[u"full-sync-text"], timeout=0.1)]
+            self.assertEqual(sorted(m.packet for m in forwarded), sorted(m.packet for m in messages))
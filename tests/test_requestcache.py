@@ -94,3 +94,53 @@ class TestRequestCache(DispersyTestFunc):
 
         # request_cache is not bound to any Community so we need to clean up ourselves
         request_cache.clear()
+
+    @blocking_call_on_reactor_thread
+    def test_claim_number_skips_used_numbers(self):
+        """
+        Tests that claim_number never returns a number that is in use for the same prefix.
+        """
+        request_cache = RequestCache()
+        request_cache.IDENTIFIER_SPACE = 8
+
+        for number in xrange(7):
+            request_cache.add(NumberCache(request_cache, u"test", number))
+
+        # only one number is left, the fallback must find it
+        self.assertEqual(request_cache.claim_number(u"test"), 7)
+        request_cache.add(NumberCache(request_cache, u"test", 7))
+        self.assertRaises(RuntimeError, request_cache.claim_number, u"test")
+
+        # other prefixes are unaffected
+        self.assertIn(request_cache.claim_number(u"other"), xrange(8))
+
+        request_cache.clear()
+
+    @blocking_call_on_reactor_thread
+    def test_statistics(self):
+        """
+        Tests the per-prefix occupancy and timeout statistics.
+        """
+        class TimeoutCache(NumberCache):
+            def on_timeout(self):
+                pass
+
+        request_cache = RequestCache()
+        popped = request_cache.add(TimeoutCache(request_cache, u"test", 1))
+        timed_out = request_cache.add(TimeoutCache(request_cache, u"test", 2))
+        request_cache.add(TimeoutCache(request_cache, u"test", 3))
+        request_cache.add(TimeoutCache(request_cache, u"other", 1))
+
+        request_cache.pop(u"test", popped.number)
+        request_cache._on_timeout(timed_out)
+
+        statistics = request_cache.get_statistics()
+        self.assertEqual(statistics[u"test"]["occupancy"], 1)
+        self.assertEqual(statistics[u"test"]["added"], 3)
+        self.assertEqual(statistics[u"test"]["popped"], 1)
+        self.assertEqual(statistics[u"test"]["timeout"], 1)
+        self.assertEqual(statistics[u"test"]["timeout_rate"], 0.5)
+        self.assertEqual(statistics[u"other"]["occupancy"], 1)
+        self.assertEqual(statistics[u"other"]["timeout_rate"], 0.0)
+
+        request_cache.clear()
@@ -0,0 +1,108 @@
+from unittest import TestCase
+
+from ..statistics import RuntimeStatistic, _runtime_statistics
+from ..util import attach_runtime_statistics, set_runtime_statistics_sample_rate, RUNTIME_STATISTICS_KEY_CACHE_SIZE
+
+
+class Name(object):
+
+    formatted = 0
+
+    def __format__(self, format_spec):
+        Name.formatted += 1
+        return u"name"
+
+
+class Message(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Foo(object):
+
+    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} bar={1} moo={moo} returns={return_value}")
+    def foo(self, bar, moo=u"milk"):
+        return bar + 40
+
+    @attach_runtime_statistics(u"Foo.{function_name}")
+    def constant(self):
+        pass
+
+    @attach_runtime_statistics(u"Foo.{function_name} {1}")
+    def unhashable(self, values):
+        pass
+
+    @attach_runtime_statistics(u"Foo.{function_name} {1.name}")
+    def named(self, message):
+        pass
+
+
+class TestRuntimeStatistics(TestCase):
+
+    def setUp(self):
+        _runtime_statistics.clear()
+
+    def tearDown(self):
+        set_runtime_statistics_sample_rate(1.0)
+        _runtime_statistics.clear()
+
+    def test_entries(self):
+        """
+        Each distinct combination of field values results in its own entry.
+        """
+        foo = Foo()
+        foo.foo(1, moo=u"milk")
+        foo.foo(2, moo=u"milk")
+        foo.foo(2, moo=u"milk")
+        foo.constant()
+        foo.unhashable([1, 2])
+        foo.unhashable([1, 2])
+
+        self.assertEqual(dict((entry, statistic.count) for entry, statistic in _runtime_statistics.iteritems()),
+                         {u"Foo.foo bar=1 moo=milk returns=41": 1,
+                          u"Foo.foo bar=2 moo=milk returns=42": 2,
+                          u"Foo.constant": 1,
+                          u"Foo.unhashable [1, 2]": 2})
+
+    def test_cached_entries(self):
+        """
+        The key is cached by the field values that the format reads, the least recently used values are evicted.
+        """
+        foo = Foo()
+        name = Name()
+        formatted = Name.formatted
+        for _ in xrange(10):
+            foo.named(Message(name))
+        self.assertEqual(Name.formatted - formatted, 1)
+
+        for index in xrange(RUNTIME_STATISTICS_KEY_CACHE_SIZE):
+            foo.named(Message(index))
+        foo.named(Message(name))
+        foo.named(Message(name))
+        self.assertEqual(Name.formatted - formatted, 2)
+        self.assertEqual(_runtime_statistics[u"Foo.named name"].count, 12)
+
+    def test_sampling(self):
+        """
+        When sampling, only some calls are measured while the count estimates the total.
+        """
+        set_runtime_statistics_sample_rate(0.5)
+        foo = Foo()
+        for _ in xrange(1000):
+            foo.constant()
+
+        statistic = _runtime_statistics[u"Foo.constant"]
+        self.assertTrue(800 <= statistic.count <= 1200, statistic.count)
+        self.assertEqual(sum(statistic.histogram), statistic.count)
+
+    def test_histogram(self):
+        """
+        Each duration is counted in the bucket of the lowest bound that is not exceeded.
+        """
+        statistic = RuntimeStatistic()
+        for duration in (0.00001, 0.0005, 0.0005, 0.5, 10.0):
+            statistic.increment(duration)
+
+        self.assertEqual(statistic.histogram, [1, 2, 0, 0, 1, 1])
+        self.assertEqual(statistic.get_dict()["histogram"], [1, 2, 0, 0, 1, 1])
@@ -0,0 +1,121 @@
+from unittest import TestCase
+
+from ..statistics import MessageStatistics, TopKCounter
+
+
+class TestTopKCounter(TestCase):
+
+    def test_bounded(self):
+        """
+        The counter never holds more than SIZE keys and retains the keys with the highest counts.
+        """
+        counter = TopKCounter(size=4)
+        for _ in xrange(100):
+            counter["heavy"] += 1
+        for _ in xrange(50):
+            counter["medium"] += 1
+        for index in xrange(20):
+            counter[("10.0.0.1", index)] += 1
+
+        self.assertEqual(len(counter), 4)
+        self.assertEqual(counter["heavy"], 100)
+        self.assertEqual(counter["medium"], 50)
+        self.assertEqual(counter.evicted, 18)
+
+    def test_space_saving(self):
+        """
+        A new key continues from the count of the key it evicted.
+        """
+        counter = TopKCounter(size=2)
+        counter["a"] += 3
+        counter["b"] += 2
+        counter["c"] += 1
+
+        self.assertEqual(dict(counter), {"a": 3, "c": 3})
+
+        counter.clear()
+        self.assertEqual(len(counter), 0)
+        self.assertEqual(counter.evicted, 0)
+
+    def test_evict_lowest(self):
+        """
+        The key with the lowest current count is evicted, also after counts changed and keys were removed.
+        """
+        counter = TopKCounter(size=3)
+        counter["a"] += 1
+        counter["b"] += 2
+        counter["c"] += 3
+        counter["a"] += 5
+        self.assertEqual(counter["a"], 6)
+
+        counter["d"] += 1
+        self.assertEqual(dict(counter), {"a": 6, "c": 3, "d": 3})
+
+        del counter["a"]
+        counter["e"] += 1
+        counter["f"] += 1
+        self.assertEqual(len(counter), 3)
+        self.assertNotIn("a", counter)
+        self.assertIn("f", counter)
+
+    def test_heap_bounded(self):
+        """
+        Repeated increments do not grow the internal heap beyond twice the size.
+        """
+        counter = TopKCounter(size=4)
+        for index in xrange(1000):
+            counter[index % 6] += 1
+        self.assertEqual(len(counter), 4)
+        self.assertLessEqual(len(counter._heap), 2 * counter.size)
+        self.assertEqual(sum(counter.itervalues()), 1000)
+
+
+class TestDelta(TestCase):
+
+    def test_delta(self):
+        """
+        get_delta returns everything once and afterwards only what changed.
+        """
+        statistics = MessageStatistics()
+        statistics.enable(True)
+
+        delta = statistics.get_delta()
+        self.assertEqual(delta["success_count"], 0)
+        self.assertEqual(delta["success_dict"], {})
+
+        self.assertEqual(statistics.get_delta(), {})
+
+        statistics.increase_count(u"success", u"introduction-request")
+        statistics.increase_count(u"success", u"introduction-request")
+        statistics.increase_count(u"drop", u"invalid")
+        self.assertEqual(statistics.get_delta(), {"success_count": 2,
+                                                  "success_dict": {u"introduction-request": 2},
+                                                  "drop_count": 1,
+                                                  "drop_dict": {u"invalid": 1}})
+
+        statistics.increase_count(u"success", u"puncture")
+        self.assertEqual(statistics.get_delta(), {"success_count": 3,
+                                                  "success_dict": {u"puncture": 1}})
+
+    def test_delta_dirty(self):
+        """
+        get_delta reports assigned values only when they changed, and dictionaries that changed in place as a whole.
+        """
+        statistics = MessageStatistics()
+        statistics.enable(True)
+        statistics.get_delta()
+
+        statistics.success_count = 0
+        statistics.drop_dict = {u"invalid": 1}
+        self.assertEqual(statistics.get_delta(), {"drop_dict": {u"invalid": 1}})
+        statistics.drop_dict = {u"invalid": 1}
+        self.assertEqual(statistics.get_delta(), {})
+
+        statistics.increase_count(u"success", u"puncture")
+        self.assertEqual(statistics.get_delta(), {"success_count": 1, "success_dict": {u"puncture": 1}})
+        statistics.reset()
+        self.assertEqual(statistics.get_delta(), {"success_count": 0, "success_dict": {}, "drop_dict": {}})
+
+        statistics.walk_failure_dict[("1.2.3.4", 5)] += 1
+        statistics.mark_dirty("walk_failure_dict", ("1.2.3.4", 5))
+        self.assertEqual(statistics.get_delta(), {"walk_failure_dict": {("1.2.3.4", 5): 1}})
@@ -1,10 +1,30 @@
+from ..bloomfilter import BloomFilter
+from ..iblt import InvertibleBloomLookupTable
+from ..message import DropMessageByDuplicate
+from ..syncdigest import SyncDigest, RangeDigests, get_ranges, SYNC_DIGEST_BUCKET_SIZE
+from ..util import blocking_call_on_reactor_thread
+from .debugcommunity.community import DebugCommunity
 from .dispersytestclass import DispersyTestFunc
 
 
+class ReconciliationCommunity(DebugCommunity):
+
+    @property
+    def dispersy_sync_bloom_filter_strategy(self):
+        return self._dispersy_claim_sync_reconciliation
+
+
+class DigestCommunity(DebugCommunity):
+
+    @property
+    def dispersy_sync_bloom_filter_strategy(self):
+        return self._dispersy_claim_sync_digest
+
+
 class TestSync(DispersyTestFunc):
 
-    def _create_nodes_messages(self, messagetype="create_full_sync_text"):
-        node, other = self.create_nodes(2)
+    def _create_nodes_messages(self, messagetype="create_full_sync_text", community_class=DebugCommunity):
+        node, other = self.create_nodes(2, community_class=community_class)
         other.send_identity(node)
 
         # other creates messages
@@ -51,6 +71,296 @@ class TestSync(DispersyTestFunc):
                 self.assertEqual(sorted(global_times), sorted(response_times))
 
 
+    def test_shared_scan(self):
+        """
+        Bloom filter requests with overlapping ranges are served from one query, with the same packets in the same
+        order as separate queries would give, and the query stops once every request reached the byte limit.
+        """
+        node, other, messages = self._create_nodes_messages()
+        other.store([other.create_in_order_text("In order %d" % i, i + 40) for i in xrange(10)])
+        other.store([other.create_out_order_text("Out order %d" % i, i + 60) for i in xrange(10)])
+
+        @blocking_call_on_reactor_thread
+        def get_packets():
+            community = other.community
+            known = BloomFilter(1024 * 8, 0.01, prefix="x")
+            known.add(other.fetch_packets([u"full-sync-text"])[0])
+            requests = [["a", 1, 30, 0, 1, known], ["b", 15, 45, 1, 2, known], ["c", 40, 65, 0, 3, known],
+                        ["d", 80, 90, 0, 1, known]]
+            separate = [community._get_sync_responses([request], 2 ** 20)[0][1] for request in requests]
+
+            scan_count = community.statistics.sync_scan_count
+            shared = community._get_sync_responses(requests, 2 ** 20)
+            self.assertEqual([message for message, _ in shared], ["a", "b", "c", "d"])
+            self.assertEqual([packets for _, packets in shared], separate)
+
+            # a, b, and c are served from one query, d from another
+            self.assertEqual(community.statistics.sync_scan_count - scan_count, 2)
+            self.assertEqual(community.statistics.sync_shared_scan_requests, 3)
+            self.assertTrue(all(separate[:3]))
+            self.assertEqual(separate[3], [])
+
+            # each request stops at the first packet that reaches the byte limit
+            limited = community._get_sync_responses(requests[:3], 1)
+            self.assertEqual([packets for _, packets in limited], [packets[:1] for packets in separate[:3]])
+        get_packets()
+
+    def test_adaptive_bloom_filter(self):
+        """
+        A quiescent community gets smaller sync bloom filters and skips more syncs, a candidate that delivered new
+        messages gets a full size bloom filter and is never skipped.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+        messages = [other.create_full_sync_text("Message %d" % i, i + 10) for i in xrange(5)]
+        skip_curve = node.community._SKIP_CURVE_STEPS
+
+        @blocking_call_on_reactor_thread
+        def start_rounds(count):
+            community = node.community
+            for _ in xrange(count):
+                community.sync_controller.on_bloom_filter(other.my_candidate, community.dispersy_sync_bloom_filter_bits // 8)
+
+        @blocking_call_on_reactor_thread
+        def check(bits_shift, skip_probability):
+            community = node.community
+            controller = community.sync_controller
+            self.assertEqual(controller.get_bloom_filter_bits(other.my_candidate),
+                             (community.dispersy_sync_bloom_filter_bits // 8 >> bits_shift) * 8)
+            self.assertEqual(controller.get_skip_probability(other.my_candidate), skip_probability)
+            self.assertEqual(community.statistics.sync_adaptive_skip_probability, skip_probability)
+
+        # six rounds without new messages halve the bloom filter twice
+        start_rounds(7)
+        check(2, skip_curve[6])
+
+        # new messages restore the full size
+        new_messages = node.call(lambda: node.community.statistics.sync_new_messages)
+        node.give_messages(messages, other)
+        start_rounds(1)
+        check(0, 0.0)
+
+        # duplicates do not count as yield
+        node.give_messages(messages, other)
+        start_rounds(1)
+        check(0, skip_curve[1])
+
+        @blocking_call_on_reactor_thread
+        def check_statistics():
+            statistics = node.community.statistics
+            self.assertEqual(statistics.sync_new_messages - new_messages, 5)
+            self.assertEqual(statistics.sync_duplicate_messages, 5)
+            self.assertGreater(statistics.sync_yield_per_kib, 0.0)
+        check_statistics()
+
+    def test_duplicate_drop(self):
+        """
+        Checking a message that was already stored yields a DropMessageByDuplicate.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+        message = other.create_full_sync_text("Message", 10)
+        node.give_message(message, other)
+
+        @blocking_call_on_reactor_thread
+        def check():
+            community = node.community
+            decoded = community.get_conversion_for_packet(message.packet).decode_message(other.my_candidate,
+                                                                                         message.packet)
+            drops = list(community.dispersy._check_full_sync_distribution_batch([decoded]))
+            self.assertEqual(len(drops), 1)
+            self.assertIsInstance(drops[0], DropMessageByDuplicate)
+        check()
+
+    def test_reconciliation(self):
+        """
+        NODE sends a sync reconciliation table and OTHER responds with exactly the messages that NODE is missing.
+        """
+        node, other, messages = self._create_nodes_messages(community_class=ReconciliationCommunity)
+        node.store(messages[:25])
+
+        table = InvertibleBloomLookupTable(512 * 8, prefix="x")
+        table.add_keys(message.packet for message in messages[:25])
+        other.give_message(node.create_introduction_request(other.my_candidate, node.lan_address, node.wan_address, False, u"unknown", (1, 0, 1, 0, table), 42), node)
+
+        responses = node.receive_messages(names=[u"full-sync-text"], return_after=5)
+        self.assertEqual(sorted(message.distribution.global_time for _, message in responses),
+                         [message.distribution.global_time for message in messages[25:]])
+
+        @blocking_call_on_reactor_thread
+        def check():
+            self.assertEqual(other.community.statistics.sync_reconciliation_decoded, 1)
+        check()
+
+    def test_reconciliation_ignored(self):
+        """
+        OTHER does not use the sync reconciliation strategy and ignores the sync reconciliation table from NODE.
+        """
+        node, other, messages = self._create_nodes_messages()
+        node.store(messages[:25])
+
+        table = InvertibleBloomLookupTable(512 * 8, prefix="x")
+        table.add_keys(message.packet for message in messages[:25])
+        other.give_message(node.create_introduction_request(other.my_candidate, node.lan_address, node.wan_address, False, u"unknown", (1, 0, 1, 0, table), 42), node)
+
+        self.assertEqual(node.receive_messages(names=[u"full-sync-text"]), [])
+
+        @blocking_call_on_reactor_thread
+        def check():
+            self.assertEqual(other.community.statistics.sync_reconciliation_decoded, 0)
+            self.assertEqual(other.community.statistics.sync_reconciliation_failed, 0)
+        check()
+
+    def test_reconciliation_strategy(self):
+        """
+        The sync reconciliation strategy creates a table containing all syncable packets.
+        """
+        node, other, messages = self._create_nodes_messages()
+
+        class RequestCache(object):
+            helper_candidate = node.my_candidate
+
+        @blocking_call_on_reactor_thread
+        def claim():
+            community = other.community
+            time_low, time_high, modulo, offset, table = community._dispersy_claim_sync_reconciliation(RequestCache())
+            self.assertEqual((time_low, time_high, modulo, offset), (1, community.acceptable_global_time, 1, 0))
+            self.assertIsInstance(table, InvertibleBloomLookupTable)
+
+            packets = [(message.packet,) for message in messages]
+            self.assertEqual(list(table.not_filter(packets)), [])
+            self.assertTrue(table.decoded)
+        claim()
+
+    def test_reconciliation_introduction_request(self):
+        """
+        An introduction request created with the sync reconciliation strategy results in the missing messages.
+        """
+        node, other = self.create_nodes(2, community_class=ReconciliationCommunity)
+        other.send_identity(node)
+
+        messages = [other.create_full_sync_text("Message %d" % i, i + 10) for i in xrange(30)]
+        other.store(messages)
+        node.store(messages[:25])
+
+        @blocking_call_on_reactor_thread
+        def create_request():
+            community = node.community
+            candidate = community.create_or_update_walkcandidate(other.lan_address, other.lan_address,
+                                                                 other.wan_address, False, u"unknown")
+            request = community.create_introduction_request(candidate, True, forward=False)
+            self.assertIsInstance(request.payload.bloom_filter, InvertibleBloomLookupTable)
+            return request
+        other.give_message(create_request(), node)
+
+        responses = node.receive_messages(names=[u"full-sync-text"], return_after=5)
+        self.assertEqual(sorted(message.distribution.global_time for _, message in responses),
+                         [message.distribution.global_time for message in messages[25:]])
+
+    def _create_digest_request(self, node, other):
+        @blocking_call_on_reactor_thread
+        def create_request():
+            community = node.community
+            candidate = community.create_or_update_walkcandidate(other.lan_address, other.lan_address,
+                                                                 other.wan_address, False, u"unknown")
+            return community.create_introduction_request(candidate, True, forward=False)
+        return create_request()
+
+    def test_sync_digest_matched(self):
+        """
+        NODE sends sync digests that match the packets of OTHER, OTHER does not reply.
+        """
+        node, other = self.create_nodes(2, community_class=DigestCommunity)
+        other.send_identity(node)
+
+        messages = [other.create_full_sync_text("Message %d" % i, i + 10) for i in xrange(30)]
+        other.store(messages)
+        node.store(messages)
+
+        request = self._create_digest_request(node, other)
+        self.assertIsInstance(request.payload.bloom_filter, RangeDigests)
+        # the requested range ends at a bucket boundary, hence OTHER answers from its bucket digests only
+        self.assertEqual(request.payload.time_high % SYNC_DIGEST_BUCKET_SIZE, SYNC_DIGEST_BUCKET_SIZE - 1)
+
+        @blocking_call_on_reactor_thread
+        def count_selects():
+            sync_digest = other.community.sync_digest
+            sync_digest.get_digests(get_ranges(1, 1))
+            selects = []
+            select = sync_digest._select
+            sync_digest._select = lambda *args: selects.append(args) or select(*args)
+            return selects
+        selects = count_selects()
+
+        other.give_message(request, node)
+
+        self.assertEqual(node.receive_messages(names=[u"dispersy-sync-digest", u"full-sync-text"]), [])
+        self.assertEqual(other.call(lambda: other.community.statistics.sync_digest_matched), 1)
+        self.assertEqual(selects, [])
+
+    def test_sync_digest_ignored(self):
+        """
+        OTHER ignores sync digests when it does not use the sync digest strategy.
+        """
+        node, = self.create_nodes(community_class=DigestCommunity)
+        other, = self.create_nodes()
+        other.send_identity(node)
+
+        messages = [other.create_full_sync_text("Message %d" % i, i + 10) for i in xrange(30)]
+        other.store(messages)
+
+        other.give_message(self._create_digest_request(node, other), node)
+
+        self.assertEqual(node.receive_messages(names=[u"dispersy-sync-digest", u"full-sync-text"]), [])
+        self.assertFalse(other.call(lambda: other.community.sync_digest.loaded))
+
+    def test_sync_digest_descend(self):
+        """
+        NODE sends sync digests, OTHER replies with the differing range, and NODE syncs that range with a bloom filter.
+        """
+        node, other = self.create_nodes(2, community_class=DigestCommunity)
+        other.send_identity(node)
+
+        messages = [other.create_full_sync_text("Message %d" % i, i + 10) for i in xrange(30)]
+        other.store(messages)
+        node.store(messages[:25])
+
+        other.give_message(self._create_digest_request(node, other), node)
+        _, digest = node.receive_message(names=[u"dispersy-sync-digest"]).next()
+        self.assertEqual(len(digest.payload.differences), 1)
+
+        # NODE asks for the differing range right away
+        node.give_message(digest, other)
+        other.process_packets()
+
+        responses = node.receive_messages(names=[u"full-sync-text"], return_after=5)
+        self.assertEqual(sorted(message.distribution.global_time for _, message in responses),
+                         [message.distribution.global_time for message in messages[25:]])
+        self.assertEqual(node.call(lambda: node.community.statistics.sync_digest_descend), 1)
+
+    def test_sync_digest_maintenance(self):
+        """
+        The digests are maintained when packets are stored and undone.
+        """
+        node, = self.create_nodes()
+
+        @blocking_call_on_reactor_thread
+        def check():
+            community = node.community
+            ranges = get_ranges(1, community.acceptable_global_time)
+            self.assertEqual(community.sync_digest.get_digests(ranges), SyncDigest(community).get_digests(ranges))
+            return community.sync_digest.get_count(1, community.acceptable_global_time)
+
+        count = check()
+        messages = [node.create_full_sync_text("Message %d" % i, i + 10) for i in xrange(10)]
+        node.give_messages(messages, node)
+        self.assertEqual(check(), count + 10)
+
+        # the undone messages are no longer included, the undo messages are
+        undoes = [node.create_undo_own(message, i + 100, i + 1) for i, message in enumerate(messages[:3])]
+        node.give_messages(undoes, node)
+        self.assertEqual(check(), count + 10)
+
     def test_in_order(self):
         node, other, messages = self._create_nodes_messages('create_in_order_text')
         global_times = [message.distribution.global_time for message in messages]
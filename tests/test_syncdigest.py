@@ -0,0 +1,42 @@
+from unittest import TestCase
+
+from ..syncdigest import RangeDigests, get_bucket_time_high, get_ranges, SYNC_DIGEST_BUCKET_SIZE
+
+
+class TestRangeDigests(TestCase):
+
+    def test_get_ranges(self):
+        """
+        get_ranges divides a time range into consecutive ranges at bucket boundaries.
+        """
+        for time_low, time_high in [(1, 100000), (1, 10), (100, 1000), (SYNC_DIGEST_BUCKET_SIZE, 2 ** 63 - 1)]:
+            ranges = get_ranges(time_low, time_high)
+            self.assertLessEqual(len(ranges), 16)
+            self.assertEqual(ranges[0][0], time_low)
+            self.assertEqual(ranges[-1][1], time_high)
+            for (_, high), (low, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(high + 1, low)
+                self.assertEqual(low % SYNC_DIGEST_BUCKET_SIZE, 0)
+
+        # fewer ranges than buckets are returned
+        self.assertEqual(get_ranges(1, 10), [(1, 10)])
+        self.assertEqual(len(get_ranges(1, 3 * SYNC_DIGEST_BUCKET_SIZE)), 4)
+
+        # requests end at a bucket boundary
+        self.assertEqual(get_bucket_time_high(1), SYNC_DIGEST_BUCKET_SIZE - 1)
+        self.assertEqual(get_bucket_time_high(SYNC_DIGEST_BUCKET_SIZE), 2 * SYNC_DIGEST_BUCKET_SIZE - 1)
+
+    def test_differences(self):
+        """
+        RangeDigests survive the binary conversion and list the ranges that differ.
+        """
+        digests = RangeDigests([(i, i * 2 ** 40) for i in xrange(16)])
+        clone = RangeDigests(digests.bytes)
+        self.assertEqual(clone.digests, digests.digests)
+        self.assertEqual(clone.size, 16 * 12 * 8)
+        self.assertEqual(clone.get_differences(digests.digests), [])
+
+        other = list(digests.digests)
+        other[3] = (3, 0)
+        other[9] = (0, 9 * 2 ** 40)
+        self.assertEqual(digests.get_differences(other), [3, 9])
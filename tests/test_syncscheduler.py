@@ -0,0 +1,78 @@
+from time import time
+
+from ..syncscheduler import SyncResponseScheduler
+from ..util import blocking_call_on_reactor_thread
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestSyncResponseScheduler(DispersyTestFunc):
+
+    def test_global_budget(self):
+        """
+        Packets are sent by priority, packets exceeding the global budget are deferred and expire.
+        """
+        node, = self.create_nodes()
+
+        @blocking_call_on_reactor_thread
+        def schedule():
+            scheduler = SyncResponseScheduler(self._dispersy, rate=1.0, burst=1000, deferred_age=5.0)
+            now = time()
+            scheduler.schedule(self._community, [(node.my_candidate, [("a" * 400, 128), ("b" * 400, 128),
+                                                                      ("c" * 400, 192)])], now)
+            self.assertEqual(scheduler.deferred_bytes, 400)
+
+            # the deferred packet expires
+            scheduler._process(now + 10.0)
+            self.assertEqual(scheduler.deferred_bytes, 0)
+            scheduler.clear()
+
+            statistics = self._community.statistics
+            self.assertEqual(statistics.sync_response_sent_bytes, 800)
+            self.assertEqual(statistics.sync_response_deferred_bytes, 400)
+            self.assertEqual(statistics.sync_response_dropped_bytes, 400)
+        schedule()
+
+        self.assertEqual([packet for _, packet in node.receive_packets()], ["c" * 400, "a" * 400])
+
+    def test_candidate_budget(self):
+        """
+        Packets exceeding the budget of their candidate are dropped, other candidates are not affected.
+        """
+        node, other = self.create_nodes(2)
+
+        @blocking_call_on_reactor_thread
+        def schedule():
+            scheduler = SyncResponseScheduler(self._dispersy, candidate_rate=1.0, candidate_burst=500)
+            scheduler.schedule(self._community, [(node.my_candidate, [("a" * 400, 128), ("b" * 400, 128)]),
+                                                 (other.my_candidate, [("c" * 400, 128)])])
+            self.assertEqual(scheduler.deferred_bytes, 0)
+            scheduler.clear()
+
+            statistics = self._community.statistics
+            self.assertEqual(statistics.sync_response_sent_bytes, 800)
+            self.assertEqual(statistics.sync_response_dropped_bytes, 400)
+        schedule()
+
+        self.assertEqual([packet for _, packet in node.receive_packets()], ["a" * 400])
+        self.assertEqual([packet for _, packet in other.receive_packets()], ["c" * 400])
+
+    def test_discard(self):
+        """
+        The deferred packets of an unloaded community are dropped without being sent or counted.
+        """
+        node, = self.create_nodes()
+
+        @blocking_call_on_reactor_thread
+        def schedule():
+            scheduler = SyncResponseScheduler(self._dispersy, rate=1.0, burst=500)
+            scheduler.schedule(self._community, [(node.my_candidate, [("a" * 400, 128), ("b" * 400, 128)])])
+            self.assertEqual(scheduler.deferred_bytes, 400)
+
+            scheduler.discard(self._community)
+            self.assertEqual(scheduler.deferred_bytes, 0)
+            self.assertFalse(scheduler.is_pending_task_active("process"))
+            self.assertEqual(self._community.statistics.sync_response_dropped_bytes, 0)
+            scheduler.clear()
+        schedule()
+
+        self.assertEqual([packet for _, packet in node.receive_packets()], ["a" * 400])
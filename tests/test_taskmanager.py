@@ -85,6 +85,34 @@ class TaskManagerTestFunc(DispersyTestFunc):
         self.assertEquals(42, self.counter)
         self.assertFalse(self.tm.is_pending_task_active("test"))
 
+    def test_fired_call_later_is_forgotten(self):
+        self.tm.register_task("test", self.tm._reactor.callLater(1, self.count))
+        self.tm._reactor.advance(1)
+        self.assertEquals(1, self.counter)
+        self.assertNotIn("test", self.tm._pending_tasks)
+
+    def test_fired_deferred_is_forgotten(self):
+        d = Deferred()
+        self.tm.register_task("test", d)
+        d.callback(None)
+        self.assertNotIn("test", self.tm._pending_tasks)
+
+    def test_fired_call_later_keeps_replacement(self):
+        dc = self.tm._reactor.callLater(1, self.count)
+        self.tm.register_task("test", dc)
+        # the task is re-registered while the old DelayedCall is still scheduled
+        self.tm._pending_tasks["test"] = replacement = self.tm._reactor.callLater(10, self.count)
+        self.tm._reactor.advance(1)
+        self.assertIs(self.tm._pending_tasks["test"], replacement)
+
+    def test_cancel_all_pending_tasks(self):
+        for index in xrange(10):
+            self.tm.register_task(index, self.tm._reactor.callLater(1, self.count))
+        self.tm.cancel_all_pending_tasks()
+        self.assertFalse(self.tm._pending_tasks)
+        self.tm._reactor.advance(1)
+        self.assertEquals(0, self.counter)
+
     def count(self):
         self.counter += 1
 
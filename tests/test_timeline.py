@@ -1,6 +1,16 @@
+from ..resolution import LinearResolution
+from ..util import blocking_call_on_reactor_thread
+from .debugcommunity.community import DebugCommunity
 from .dispersytestclass import DispersyTestFunc
 
 
+class SnapshotCommunity(DebugCommunity):
+
+    @property
+    def dispersy_enable_timeline_snapshot(self):
+        return True
+
+
 class TestTimeline(DispersyTestFunc):
 
     def test_delay_by_proof(self):
@@ -91,3 +101,180 @@ class TestTimeline(DispersyTestFunc):
         permission_triplet = (self._mm.my_member.mid, u"protected-full-sync-text", u"permit")
         authorize_permission_triplets = [(triplet[0].mid, triplet[1].name, triplet[2]) for triplet in authorize.payload.permission_triplets]
         self.assertIn(permission_triplet, authorize_permission_triplets)
+
+    def test_permission_history(self):
+        """
+        The most recent authorize or revoke at or before a global time decides, regardless of the order in which
+        they were added to the timeline.
+        """
+        node, = self.create_nodes(1)
+        meta = self._community.get_meta_message(u"protected-full-sync-text")
+        triplets = [(node.my_member, meta, u"permit")]
+        timeline = self._community.timeline
+        master = self._community.master_member
+
+        @blocking_call_on_reactor_thread
+        def check(global_time):
+            return timeline._check(node.my_member, global_time, LinearResolution(), [(meta, u"permit")])[0]
+
+        @blocking_call_on_reactor_thread
+        def build():
+            timeline.authorize(master, 30, triplets, self._mm.create_authorize(triplets, 30))
+            timeline.authorize(master, 10, triplets, self._mm.create_authorize(triplets, 10))
+            timeline.revoke(master, 20, triplets, self._mm.create_revoke(triplets, 20))
+        build()
+
+        self.assertEqual([check(global_time) for global_time in (5, 10, 15, 20, 25, 30, 100)],
+                         [False, True, True, False, False, True, True])
+
+    def test_check_cache(self):
+        """
+        Repeated checks are answered from the check cache until the permissions change.
+        """
+        node, = self.create_nodes(1)
+        meta = self._community.get_meta_message(u"protected-full-sync-text")
+        triplets = [(node.my_member, meta, u"permit")]
+        timeline = self._community.timeline
+        master = self._community.master_member
+
+        @blocking_call_on_reactor_thread
+        def check():
+            return timeline._check(node.my_member, 10, LinearResolution(), [(meta, u"permit")])[0]
+
+        @blocking_call_on_reactor_thread
+        def authorize():
+            timeline.authorize(master, 5, triplets, self._mm.create_authorize(triplets, 5))
+
+        @blocking_call_on_reactor_thread
+        def get_statistics():
+            self._community.statistics.update()
+            return self._community.statistics.timeline_cache_hits, self._community.statistics.timeline_cache_misses
+
+        hits, misses = get_statistics()
+        self.assertFalse(check())
+        self.assertFalse(check())
+        self.assertEqual(get_statistics(), (hits + 1, misses + 1))
+
+        # authorize must invalidate the cached result
+        authorize()
+        self.assertTrue(check())
+        self.assertTrue(check())
+        self.assertEqual(get_statistics(), (hits + 2, misses + 2))
+
+    def test_check_cache_interval(self):
+        """
+        A cached check is reused for every global time between the grant or revoke that decided it and the next one.
+        """
+        node, = self.create_nodes(1)
+        meta = self._community.get_meta_message(u"protected-full-sync-text")
+        triplets = [(node.my_member, meta, u"permit")]
+        timeline = self._community.timeline
+        master = self._community.master_member
+
+        @blocking_call_on_reactor_thread
+        def build():
+            timeline.authorize(master, 10, triplets, self._mm.create_authorize(triplets, 10))
+            timeline.revoke(master, 20, triplets, self._mm.create_revoke(triplets, 20))
+        build()
+
+        @blocking_call_on_reactor_thread
+        def check(global_time):
+            return timeline._check(node.my_member, global_time, LinearResolution(), [(meta, u"permit")])[0]
+
+        @blocking_call_on_reactor_thread
+        def get_statistics():
+            return timeline.check_cache_hits, timeline.check_cache_misses
+
+        hits, misses = get_statistics()
+        self.assertEqual([check(global_time) for global_time in (10, 11, 15, 19)], [True, True, True, True])
+        self.assertEqual(get_statistics(), (hits + 3, misses + 1))
+
+        self.assertEqual([check(global_time) for global_time in (20, 30, 1000)], [False, False, False])
+        self.assertEqual(get_statistics(), (hits + 5, misses + 2))
+
+        self.assertEqual([check(global_time) for global_time in (5, 9)], [False, False])
+        self.assertEqual(get_statistics(), (hits + 6, misses + 3))
+
+    def test_timeline_snapshot(self):
+        """
+        After reloading a community its timeline is restored from the snapshot in the database, the proofs are
+        only loaded when they are required.
+        """
+        node, other = self.create_nodes(2, community_class=SnapshotCommunity)
+        meta = self._community.get_meta_message(u"protected-full-sync-text")
+        authorize = self._mm.create_authorize([(node.my_member, meta, u"permit")], 10)
+        other.give_message(authorize, self._mm)
+
+        @blocking_call_on_reactor_thread
+        def get_member():
+            return other.community.dispersy.get_member(public_key=node.my_member.public_key)
+        member = get_member()
+
+        @blocking_call_on_reactor_thread
+        def reload_community(community):
+            community.unload_community()
+            return community.init_community(community.dispersy, community.master_member, community.my_member)
+
+        @blocking_call_on_reactor_thread
+        def get_proofs(community):
+            times, permissions = community.timeline._members[member][u"permit^" + meta.name]
+            return permissions[0][1][:]
+
+        @blocking_call_on_reactor_thread
+        def check(community):
+            return community.timeline._check(member, 11, LinearResolution(),
+                                             [(community.get_meta_message(meta.name), u"permit")])
+
+        # the first reload replays the dispersy-authorize and stores the snapshot
+        community = reload_community(other.community)
+        self.assertEqual([proof.packet for proof in get_proofs(community)], [authorize.packet])
+
+        # the second reload restores the snapshot
+        community = reload_community(community)
+        proofs = get_proofs(community)
+        self.assertEqual(len(proofs), 1)
+        self.assertIsInstance(proofs[0], (int, long))
+
+        allowed, proofs = check(community)
+        self.assertTrue(allowed)
+        self.assertEqual([proof.packet for proof in proofs], [authorize.packet])
+
+    def test_timeline_snapshot_outdated(self):
+        """
+        A snapshot is ignored when a permission packet that it covers was removed from the database, and no snapshot
+        is stored unless the community enables it.
+        """
+        node, other = self.create_nodes(2, community_class=SnapshotCommunity)
+        plain, = self.create_nodes(1)
+        meta = self._community.get_meta_message(u"protected-full-sync-text")
+        authorize = self._mm.create_authorize([(node.my_member, meta, u"permit")], 10)
+        other.give_message(authorize, self._mm)
+        plain.give_message(authorize, self._mm)
+
+        @blocking_call_on_reactor_thread
+        def reload_community(community):
+            community.unload_community()
+            return community.init_community(community.dispersy, community.master_member, community.my_member)
+
+        @blocking_call_on_reactor_thread
+        def count_snapshots(community):
+            return community.dispersy.database.execute(u"SELECT COUNT(*) FROM timeline_snapshot WHERE community = ?",
+                                                       (community.database_id,)).next()[0]
+
+        @blocking_call_on_reactor_thread
+        def remove_authorize(community):
+            community.dispersy.database.execute(u"DELETE FROM sync WHERE meta_message = ?",
+                                                (community.get_meta_message(u"dispersy-authorize").database_id,))
+
+        @blocking_call_on_reactor_thread
+        def is_restored(community):
+            return community._load_timeline_snapshot([community.get_meta_message(u"dispersy-authorize").database_id]) > 0
+
+        self.assertEqual(count_snapshots(reload_community(plain.community)), 0)
+
+        community = reload_community(other.community)
+        self.assertEqual(count_snapshots(community), 1)
+        self.assertTrue(is_restored(community))
+
+        remove_authorize(community)
+        self.assertFalse(is_restored(community))
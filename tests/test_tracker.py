@@ -0,0 +1,164 @@
+from hashlib import sha1
+from unittest import TestCase
+
+from twisted.web.test.requesthelper import DummyRequest
+
+from ..candidate import Candidate
+from ..endpoint import TUNNEL_PREFIX
+from ..tracker.community import TrackerCommunity
+from ..tracker.endpoint import get_shard, get_packet_cid, encode_forwarded_packet, decode_forwarded_packet
+from ..tracker.metrics import MetricsResource, add_worker_label, format_metrics
+from ..util import blocking_call_on_reactor_thread
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestTracker(DispersyTestFunc):
+
+    def create_tracker(self):
+        tracker, = self.create_nodes(community_class=TrackerCommunity)
+        tracker._dispersy._silent = True
+        return tracker
+
+    def test_introduction_request(self):
+        """
+        The tracker responds to introduction requests without sync and introduces the other candidates.
+        """
+        tracker = self.create_tracker()
+        node, other = self.create_nodes(2)
+        node.send_identity(tracker)
+        other.send_identity(tracker)
+
+        # OTHER becomes known to the tracker
+        request = other.create_introduction_request(tracker.my_candidate, other.lan_address, other.wan_address, False,
+                                                    u"unknown", None, 1)
+        tracker.give_message(request, other)
+        _, response = other.receive_message(names=[u"dispersy-introduction-response"]).next()
+        self.assertEqual(response.payload.identifier, 1)
+        self.assertEqual(response.payload.lan_introduction_address, ("0.0.0.0", 0))
+
+        # NODE is introduced to OTHER, and OTHER receives a puncture request for NODE
+        request = node.create_introduction_request(tracker.my_candidate, node.lan_address, node.wan_address, True,
+                                                   u"unknown", None, 2)
+        tracker.give_message(request, node)
+        _, response = node.receive_message(names=[u"dispersy-introduction-response"]).next()
+        self.assertEqual(response.authentication.member.mid, tracker.my_member.mid)
+        self.assertEqual(response.payload.identifier, 2)
+        self.assertEqual(response.payload.destination_address, node.lan_address)
+        self.assertEqual(response.payload.lan_introduction_address, other.lan_address)
+
+        _, puncture_request = other.receive_message(names=[u"dispersy-puncture-request"]).next()
+        self.assertEqual(puncture_request.payload.identifier, 2)
+        self.assertEqual(puncture_request.payload.lan_walker_address, node.lan_address)
+
+        @blocking_call_on_reactor_thread
+        def check():
+            success_dict = tracker.community.statistics.msg_statistics.success_dict
+            self.assertEqual(success_dict[u"dispersy-introduction-request"], 2)
+        check()
+
+    def test_introduction_request_sync(self):
+        """
+        The tracker handles introduction requests with sync without creating Message.Implementation instances and
+        also answers their sync part.
+        """
+        tracker = self.create_tracker()
+        node, = self.create_nodes()
+        node.send_identity(tracker)
+
+        request = node.create_introduction_request(tracker.my_candidate, node.lan_address, node.wan_address, False,
+                                                   u"unknown", (1, 0, 1, 0, []), 3)
+
+        @blocking_call_on_reactor_thread
+        def handle():
+            community = tracker.community
+            scans = community.statistics.sync_scan_count
+            meta = community.get_meta_message(u"dispersy-introduction-request")
+            conversion = community.get_conversion_for_packet(request.packet)
+            remaining = community._on_introduction_request_packets(
+                meta, [(Candidate(node.lan_address, False), request.packet, conversion, u"unknown")])
+            self.assertEqual(remaining, [])
+            self.assertEqual(community.statistics.sync_scan_count, scans + 1)
+        handle()
+
+        _, response = node.receive_message(names=[u"dispersy-introduction-response"]).next()
+        self.assertEqual(response.payload.identifier, 3)
+
+
+class TestShard(TestCase):
+
+    def test_get_shard(self):
+        """
+        Every cid is owned by exactly one worker and the cids are spread over all workers.
+        """
+        cids = [sha1(str(index)).digest() for index in xrange(100)]
+        self.assertEqual(set(get_shard(cid, 1) for cid in cids), set([0]))
+        self.assertEqual(set(get_shard(cid, 4) for cid in cids), set([0, 1, 2, 3]))
+        self.assertEqual([get_shard(cid, 4) for cid in cids], [get_shard(cid, 4) for cid in cids])
+
+    def test_get_packet_cid(self):
+        cid = sha1("cid").digest()
+        packet = "\x00\x01" + cid + "\xff" + "payload"
+        self.assertEqual(get_packet_cid(packet), cid)
+        self.assertEqual(get_packet_cid(TUNNEL_PREFIX + packet), cid)
+        self.assertIsNone(get_packet_cid(packet[:21]))
+
+    def test_forwarded_packet(self):
+        data = encode_forwarded_packet(("1.2.3.4", 6421), "packet")
+        self.assertEqual(decode_forwarded_packet(data), (("1.2.3.4", 6421), "packet"))
+        self.assertIsNone(decode_forwarded_packet(data[:6]))
+
+
+class TestMetrics(TestCase):
+
+    def test_format_metrics(self):
+        """
+        Metrics are formatted with sorted and escaped labels, and values without a long suffix.
+        """
+        metrics = [("dispersy_bytes_up_total", "counter", "Bytes sent", [({}, 2 ** 64)]),
+                   ("dispersy_uptime_seconds", "gauge", "Seconds\nsince", [({}, 1.5), ({"a": 1}, float("inf"))]),
+                   ("dispersy_messages_total", "counter", "Messages",
+                    [({"meta": u"dispersy-\"quoted\"\\\n", "category": "drop"}, 3)])]
+        self.assertEqual(format_metrics(metrics).split("\n"),
+                         ["# HELP dispersy_bytes_up_total Bytes sent",
+                          "# TYPE dispersy_bytes_up_total counter",
+                          "dispersy_bytes_up_total 18446744073709551616",
+                          "# HELP dispersy_uptime_seconds Seconds\\nsince",
+                          "# TYPE dispersy_uptime_seconds gauge",
+                          "dispersy_uptime_seconds 1.5",
+                          'dispersy_uptime_seconds{a="1"} +Inf',
+                          "# HELP dispersy_messages_total Messages",
+                          "# TYPE dispersy_messages_total counter",
+                          'dispersy_messages_total{category="drop",meta="dispersy-\\"quoted\\"\\\\\\n"} 3',
+                          ""])
+
+    def test_add_worker_label(self):
+        metrics = [("dispersy_walk_total", "counter", "Walks", [({}, 1), ({"result": "success"}, 2)])]
+        self.assertEqual(add_worker_label(metrics, 3),
+                         [("dispersy_walk_total", "counter", "Walks",
+                           [({"worker": "3"}, 1), ({"result": "success", "worker": "3"}, 2)])])
+        # the original labels are not modified
+        self.assertEqual(metrics[0][3][1][0], {"result": "success"})
+
+    def test_metrics_resource(self):
+        """
+        /metrics serves the metrics of the running tracker, other paths and a stopped tracker give 404.
+        """
+        class Tracker(object):
+            def get_metrics(self):
+                return [("dispersy_sendqueue", "gauge", "Packets", [({}, 0)])]
+
+        container = [None]
+        resource = MetricsResource(container)
+        request = DummyRequest(["metrics"])
+        self.assertEqual(resource.render_GET(request), "")
+        self.assertEqual(request.responseCode, 404)
+
+        container[0] = Tracker()
+        request = DummyRequest(["other"])
+        self.assertEqual(resource.render_GET(request), "")
+        self.assertEqual(request.responseCode, 404)
+
+        request = DummyRequest(["metrics"])
+        self.assertEqual(resource.render_GET(request),
+                         "# HELP dispersy_sendqueue Packets\n# TYPE dispersy_sendqueue gauge\ndispersy_sendqueue 0\n")
+        self.assertTrue(request.responseHeaders.getRawHeaders("Content-Type")[0].startswith("text/plain"))
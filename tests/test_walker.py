@@ -1,6 +1,17 @@
+from ..util import blocking_call_on_reactor_thread
+from .debugcommunity.conversion import DebugCommunityConversion
 from .dispersytestclass import DispersyTestFunc
 
 
+class OverridingConversion(DebugCommunityConversion):
+
+    def _encode_introduction_response(self, message):
+        return super(OverridingConversion, self)._encode_introduction_response(message)
+
+    def _decode_introduction_request(self, placeholder, offset, data):
+        return super(OverridingConversion, self)._decode_introduction_request(placeholder, offset, data)
+
+
 class TestWalker(DispersyTestFunc):
 
     def test_one_walker(self): return self.check_walker([""])
@@ -14,6 +25,102 @@ class TestWalker(DispersyTestFunc):
     def test_two_mixed_walker_b(self): return self.check_walker(["t", ""])
     def test_many_mixed_walker_b(self): return self.check_walker(["t", ""] * 11)
 
+    def test_walker_packets(self):
+        """
+        The walker packets encoded without Message.Implementation are identical to those made by encode_message.
+        """
+        node, = self.create_nodes()
+
+        @blocking_call_on_reactor_thread
+        def encode():
+            community = self._community
+            meta_response = community.get_meta_message(u"dispersy-introduction-response")
+            meta_request = community.get_meta_message(u"dispersy-puncture-request")
+            conversion = community.get_conversion_for_message(meta_response)
+            self.assertTrue(conversion.can_encode_walker_packets(meta_response, meta_request))
+
+            global_time = community.global_time
+            response_args = (node.lan_address, ("10.0.0.1", 1), ("1.2.3.4", 2), ("10.0.0.2", 3), ("1.2.3.5", 4),
+                             u"public", True, 42)
+            response = meta_response.impl(authentication=(community.my_member,), distribution=(global_time,),
+                                          destination=(node.my_candidate,), payload=response_args)
+            packet = conversion.encode_introduction_response_packet(meta_response, community.my_member, global_time,
+                                                                    *response_args)
+            signature_length = community.my_member.signature_length
+            self.assertEqual(packet[:-signature_length], response.packet[:-signature_length])
+            self.assertTrue(community.my_member.verify(packet[:-signature_length], packet[-signature_length:]))
+
+            # reusing the signature of a byte-identical response
+            first = conversion.encode_introduction_response_packet(meta_response, community.my_member, global_time,
+                                                                   *response_args, reuse_signature=True)
+            second = conversion.encode_introduction_response_packet(meta_response, community.my_member, global_time,
+                                                                    *response_args, reuse_signature=True)
+            self.assertEqual(first, second)
+
+            request_args = (("10.0.0.1", 1), ("1.2.3.4", 2), 42)
+            request = meta_request.impl(distribution=(global_time,), destination=(node.my_candidate,),
+                                        payload=request_args)
+            self.assertEqual(conversion.encode_puncture_request_packet(meta_request, global_time, *request_args),
+                             request.packet)
+        encode()
+
+    def test_walker_packets_override(self):
+        """
+        The walker packets are not encoded, nor decoded, without Message.Implementation when a conversion overrides
+        the payload encoder or decoder.
+        """
+        @blocking_call_on_reactor_thread
+        def check():
+            community = self._community
+            conversion = OverridingConversion(community)
+            self.assertFalse(conversion.can_encode_walker_packets(
+                community.get_meta_message(u"dispersy-introduction-response"),
+                community.get_meta_message(u"dispersy-puncture-request")))
+            self.assertFalse(conversion.can_decode_introduction_request_record(
+                community.get_meta_message(u"dispersy-introduction-request")))
+        check()
+
+    def test_introduction_request_record(self):
+        """
+        The introduction request records decoded without Message.Implementation contain the same fields as the
+        messages made by decode_message, including the optional sync bloom filter.
+        """
+        node, = self.create_nodes()
+        request = node.create_introduction_request(self._mm.my_candidate, node.lan_address, node.wan_address, True,
+                                                   u"symmetric-NAT", None, 42)
+        sync_request = node.create_introduction_request(self._mm.my_candidate, node.lan_address, node.wan_address,
+                                                        True, u"public", (1, 0, 1, 0, []), 43)
+
+        @blocking_call_on_reactor_thread
+        def decode():
+            community = self._community
+            meta = community.get_meta_message(u"dispersy-introduction-request")
+            conversion = community.get_conversion_for_packet(request.packet)
+            self.assertTrue(conversion.can_decode_introduction_request_record(meta))
+
+            message = conversion.decode_message(node.my_candidate, request.packet)
+            record = conversion.decode_introduction_request_record(node.my_candidate, request.packet)
+            self.assertEqual(record.member, message.authentication.member)
+            self.assertEqual(record.global_time, message.distribution.global_time)
+            self.assertEqual(record.destination_address, message.payload.destination_address)
+            self.assertEqual(record.source_lan_address, message.payload.source_lan_address)
+            self.assertEqual(record.source_wan_address, message.payload.source_wan_address)
+            self.assertEqual(record.advice, message.payload.advice)
+            self.assertEqual(record.connection_type, message.payload.connection_type)
+            self.assertEqual(record.identifier, message.payload.identifier)
+
+            self.assertIsNone(record.sync)
+
+            message = conversion.decode_message(node.my_candidate, sync_request.packet)
+            record = conversion.decode_introduction_request_record(node.my_candidate, sync_request.packet)
+            self.assertEqual(record.identifier, 43)
+            time_low, time_high, modulo, offset, bloom_filter = record.sync
+            self.assertEqual((time_low, time_high, modulo, offset),
+                             (message.payload.time_low, message.payload.time_high, message.payload.modulo,
+                              message.payload.offset))
+            self.assertEqual(bloom_filter.bytes, message.payload.bloom_filter.bytes)
+        decode()
+
     def create_others(self, all_flags):
         assert isinstance(all_flags, list)
         assert all(isinstance(flags, str) for flags in all_flags)
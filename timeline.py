@@ -3,7 +3,9 @@ The Timeline is an important part of Dispersy.  The Timeline can be
 queried as to who had what actions at some point in time.
 """
 
-from itertools import count, groupby
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import groupby
 import logging
 
 from .authentication import MemberAuthentication, DoubleMemberAuthentication
@@ -22,14 +24,23 @@ class Timeline(object):
         # the community that this timeline is keeping track off
         self._community = community
 
-        # _members contains the permission grants and revokes per member
-        # Member / [(global_time, {u"permission^message-name":(True/False, [Message.Implementation])})]
+        # _members contains the permission grants and revokes per member, for each permission the global times are
+        # kept sorted to allow bisect lookups
+        # Member / {u"permission^message-name":([global_time], [(True/False, [Message.Implementation])])}
         self._members = {}
 
         # _policies contains the policies that the community is currently using (dynamic settings)
         # [(global_time, {u"resolution^message-name":(resolution-policy, [Message.Implementation])})]
         self._policies = []
 
+        # _check_cache contains the outcome of previous _check calls and the global time interval [low, high) in
+        # which that outcome holds, it is cleared whenever a permission or a policy changes
+        # (Member, resolution-type, ((Message, permission), ...)) / (low, high, (True/False, [Message.Implementation]))
+        self._check_cache = OrderedDict()
+        self._check_cache_size = 1024
+        self.check_cache_hits = 0
+        self.check_cache_misses = 0
+
     if __debug__:
         def printer(self):
             for global_time, dic in self._policies:
@@ -37,25 +48,20 @@ class Timeline(object):
                 for key, (policy, proofs) in dic.iteritems():
                     self._logger.debug("policy %50s  %s based on %d proofs", key, policy, len(proofs))
 
-            for member, lst in self._members.iteritems():
+            for member, dic in self._members.iteritems():
                 self._logger.debug("member %d %s", member.database_id, member.mid.encode("HEX"))
-                for global_time, dic in lst:
-                    self._logger.debug("member %d @%d", member.database_id, global_time)
-                    for key, (allowed, proofs) in sorted(dic.iteritems()):
-                        if allowed:
-                            assert all(proof.name == u"dispersy-authorize" for proof in proofs)
-                            self._logger.debug("member %d %50s  granted by %s",
-                                               member.database_id, key,
-                                               ", ".join("%d@%d" % (proof.authentication.member.database_id,
-                                                                    proof.distribution.global_time)
-                                                         for proof in proofs))
-                        else:
-                            assert all(proof.name == u"dispersy-revoke" for proof in proofs)
-                            self._logger.debug("member %d %50s  revoked by %s",
-                                               member.database_id, key,
-                                               ", ".join("%d@%d" % (proof.authentication.member.database_id,
-                                                                    proof.distribution.global_time)
-                                                         for proof in proofs))
+                for key, (times, grants) in sorted(dic.iteritems()):
+                    for global_time, (allowed, proofs) in zip(times, grants):
+                        self._logger.debug("member %d @%d", member.database_id, global_time)
+                        self._logger.debug("member %d %50s  %s by %s",
+                                           member.database_id, key, "granted" if allowed else "revoked",
+                                           ", ".join(self._describe_proof(proof) for proof in proofs))
+
+        def _describe_proof(self, proof):
+            if isinstance(proof, (int, long)):
+                # restored from a snapshot and not loaded yet
+                return "packet %d" % proof
+            return "%d@%d" % (proof.authentication.member.database_id, proof.distribution.global_time)
 
     def check(self, message, permission=u"permit"):
         """
@@ -168,93 +174,121 @@ class Timeline(object):
             assert pair[1] in (u"permit", u"authorize", u"revoke", u"undo")
         assert isinstance(resolution, (PublicResolution.Implementation, LinearResolution.Implementation, DynamicResolution.Implementation, PublicResolution, LinearResolution, DynamicResolution)), resolution
 
-        # TODO: we can make this more efficient by changing the loop a bit.  make a shallow copy of
-        # the permission_pairs and remove one after another as they succeed.  key is to loop though
-        # the self._members[member] once (currently looping over the timeline for every item in
-        # permission_pairs).
+        # the master member can do anything
+        if member == self._community.master_member:
+            self._logger.debug("ACCEPT time:%d user:%d -> %s (master member)",
+                               global_time, member.database_id,
+                               ", ".join(permission + "^" + message.name for message, permission in permission_pairs))
+            return (True, [])
+
+        key = (member, type(resolution), tuple(permission_pairs))
+        cached = self._check_cache.get(key)
+        if cached is None or not cached[0] <= global_time < cached[1]:
+            self.check_cache_misses += 1
+            result, low, high = self._resolve(member, global_time, resolution, permission_pairs)
+            # pop and reinsert to keep the cache in least recently updated order
+            self._check_cache.pop(key, None)
+            self._check_cache[key] = (low, high, result)
+
+            # limit cache length
+            if len(self._check_cache) > self._check_cache_size:
+                self._check_cache.popitem(False)
+
+        else:
+            self.check_cache_hits += 1
+            result = cached[2]
+
+        # the caller owns the returned proofs list
+        allowed, proofs = result
+        return (allowed, list(proofs))
+
+    def _resolve(self, member, global_time, resolution, permission_pairs):
+        """
+        Check is MEMBER has all of the permission pairs in PERMISSION_PAIRS at GLOBAL_TIME without using the
+        check cache.
 
+        Returns a ((allowed, proofs), low, high) tuple where the outcome is the same for every global time in the
+        interval [low, high).
+        """
+        from .message import Message
         all_proofs = []
+        grants = self._members.get(member)
+        low, high = 0, float("inf")
 
         for message, permission in permission_pairs:
-            # the master member can do anything
-            if member == self._community.master_member:
-                self._logger.debug("ACCEPT time:%d user:%d -> %s^%s (master member)",
+            # dynamically set the resolution policy
+            if isinstance(resolution, (DynamicResolution, DynamicResolution.Implementation)):
+                local_resolution, proofs = self.get_resolution_policy(message, global_time)
+                assert isinstance(local_resolution, (PublicResolution, LinearResolution))
+                all_proofs.extend(proofs)
+
+                # a policy changed at time T applies from T + 1 onwards
+                index = bisect_left(self._policies, (global_time,))
+                if index > 0:
+                    low = max(low, self._policies[index - 1][0] + 1)
+                if index < len(self._policies):
+                    high = min(high, self._policies[index][0] + 1)
+
+                # if not resolution.policy.meta == local_resolution:
+                # either we didn't receive an update to the dynamic policy, or the peer creating the message did not
+                # however, we cannot tell the difference -> hence we continue with our local knowledge
+                # this will result in the following:
+                #    local policy == public -> we accept the message and might be told differently lateron
+                #    local policy == linear -> we accept/reject this message and request the peer for proofs
+                # however, we might have already received those proofs, as the peer is actually behind
+                # hence we also reply with all proofs
+                resolution = local_resolution
+
+            # everyone is allowed PublicResolution
+            if isinstance(resolution, (PublicResolution, PublicResolution.Implementation)):
+                self._logger.debug("ACCEPT time:%d user:%d -> %s^%s (public resolution)",
                                    global_time, member.database_id, permission, message.name)
 
-            else:
-                # dynamically set the resolution policy
-                if isinstance(resolution, (DynamicResolution, DynamicResolution.Implementation)):
-                    local_resolution, proofs = self.get_resolution_policy(message, global_time)
-                    assert isinstance(local_resolution, (PublicResolution, LinearResolution))
+            # allowed LinearResolution is stored in Timeline
+            elif isinstance(resolution, (LinearResolution, LinearResolution.Implementation)):
+                key = permission + "^" + message.name
+
+                if grants is None:
+                    self._logger.warning("FAIL time:%d user:%d -> %s (no authorization)",
+                                         global_time, member.database_id, key)
+                    return (False, all_proofs), low, high
+
+                # the most recent grant or revoke at or before GLOBAL_TIME decides, until the next one
+                times, permissions = grants.get(key, ((), ()))
+                index = bisect_right(times, global_time) - 1
+                if index + 1 < len(times):
+                    high = min(high, times[index + 1])
+                if index < 0:
+                    self._logger.warning("FAIL time:%d user:%d -> %s (not authorized)",
+                                         global_time, member.database_id, key)
+                    return (False, all_proofs), low, high
+                low = max(low, times[index])
+
+                assert isinstance(permissions[index], tuple)
+                assert len(permissions[index]) == 2
+                assert isinstance(permissions[index][0], bool)
+                assert isinstance(permissions[index][1], list)
+                assert len(permissions[index][1]) > 0
+                allowed, proofs = permissions[index]
+                self._load_proofs(proofs)
+                assert all(isinstance(x, Message.Implementation) for x in proofs)
+
+                if allowed:
+                    self._logger.debug("ACCEPT time:%d user:%d -> %s (authorized)",
+                                       global_time, member.database_id, key)
                     all_proofs.extend(proofs)
+                else:
+                    self._logger.warning("DENIED time:%d user:%d -> %s (revoked)",
+                                         global_time, member.database_id, key)
+                    return (False, [proofs]), low, high
 
-                    # if not resolution.policy.meta == local_resolution:
-                    # either we didn't receive an update to the dynamic policy, or the peer creating the message did not
-                    # however, we cannot tell the difference -> hence we continue with our local knowledge
-                    # this will result in the following:
-                    #    local policy == public -> we accept the message and might be told differently lateron
-                    #    local policy == linear -> we accept/reject this message and request the peer for proofs
-                    # however, we might have already received those proofs, as the peer is actually behind
-                    # hence we also reply with all proofs
-                    resolution = local_resolution
-
-                # everyone is allowed PublicResolution
-                if isinstance(resolution, (PublicResolution, PublicResolution.Implementation)):
-                    self._logger.debug("ACCEPT time:%d user:%d -> %s^%s (public resolution)",
-                                       global_time, member.database_id, permission, message.name)
-
-                # allowed LinearResolution is stored in Timeline
-                elif isinstance(resolution, (LinearResolution, LinearResolution.Implementation)):
-                    key = permission + "^" + message.name
-
-                    if member in self._members:
-                        iterator = reversed(self._members[member])
-                        try:
-                            # go backwards while time > global_time
-                            while True:
-                                time, permissions = iterator.next()
-                                if time <= global_time:
-                                    break
-
-                            # check permissions and continue backwards in time
-                            while True:
-                                if key in permissions:
-                                    assert isinstance(permissions[key], tuple)
-                                    assert len(permissions[key]) == 2
-                                    assert isinstance(permissions[key][0], bool)
-                                    assert isinstance(permissions[key][1], list)
-                                    assert len(permissions[key][1]) > 0
-                                    assert all(isinstance(x, Message.Implementation) for x in permissions[key][1])
-                                    allowed, proofs = permissions[key]
-
-                                    if allowed:
-                                        self._logger.debug("ACCEPT time:%d user:%d -> %s (authorized)",
-                                                           global_time, member.database_id, key)
-                                        all_proofs.extend(proofs)
-                                        break
-                                    else:
-                                        self._logger.warning("DENIED time:%d user:%d -> %s (revoked)",
-                                                             global_time, member.database_id, key)
-                                        return (False, [proofs])
-
-                                time, permissions = iterator.next()
-
-                        except StopIteration:
-                            self._logger.warning("FAIL time:%d user:%d -> %s (not authorized)",
-                                                 global_time, member.database_id, key)
-                            return (False, all_proofs)
-                    else:
-                        self._logger.warning("FAIL time:%d user:%d -> %s (no authorization)",
-                                             global_time, member.database_id, key)
-                        return (False, all_proofs)
-
-                    # accept with proof
-                    assert len(all_proofs) > 0
+                # accept with proof
+                assert len(all_proofs) > 0
 
-                else:
-                    raise NotImplementedError("Unknown Resolution")
+            else:
+                raise NotImplementedError("Unknown Resolution")
 
-        return (True, all_proofs)
+        return (True, all_proofs), low, high
 
     def authorize(self, author, global_time, permission_triplets, proof):
         from .member import Member
@@ -286,52 +320,10 @@ class Timeline(object):
                                author == self._community.master_member, author == self._community.my_member)
             return (False, authorize_proofs)
 
+        self._check_cache.clear()
         for member, message, permission in permission_triplets:
             if isinstance(message.resolution, (PublicResolution, LinearResolution, DynamicResolution)):
-                if not member in self._members:
-                    self._members[member] = []
-
-                key = permission + "^" + message.name
-
-                for index, (time, permissions) in zip(count(0), self._members[member]):
-                    # extend when time == global_time
-                    if time == global_time:
-                        if key in permissions:
-                            allowed, proofs = permissions[key]
-                            if allowed:
-                                # multiple proofs for the same permissions at this exact time
-                                self._logger.debug("AUTHORISE time:%d user:%d -> %s (extending duplicate)",
-                                                   global_time, member.database_id, key)
-                                proofs.append(proof)
-
-                            else:
-                                # TODO: when two authorise contradict each other on the same global
-                                # time, the ordering of the packet will decide the outcome.  we need
-                                # those packets!  [SELECT packet FROM sync WHERE ...]
-                                raise NotImplementedError("Requires ordering by packet to resolve permission conflict")
-
-                        else:
-                            # no earlier proof on this global time
-                            self._logger.debug("AUTHORISE time:%d user:%d -> %s (extending)",
-                                               global_time, member.database_id, key)
-                            permissions[key] = (True, [proof])
-                        break
-
-                    # insert when time > global_time
-                    elif time > global_time:
-                        # TODO: ensure that INDEX is correct!
-                        self._logger.debug("AUTHORISE time:%d user:%d -> %s (inserting)",
-                                           global_time, member.database_id, key)
-                        self._members[member].insert(index, (global_time, {key: (True, [proof])}))
-                        break
-
-                    # otherwise: go forward while time < global_time
-
-                else:
-                    # we have reached the end without a BREAK: append the permission
-                    self._logger.debug("AUTHORISE time:%d user:%d -> %s (appending)",
-                                       global_time, member.database_id, key)
-                    self._members[member].append((global_time, {key: (True, [proof])}))
+                self._add_permission(member, global_time, permission + "^" + message.name, True, proof)
 
             else:
                 raise NotImplementedError(message.resolution)
@@ -368,57 +360,43 @@ class Timeline(object):
                                author == self._community.master_member, author == self._community.my_member)
             return (False, revoke_proofs)
 
+        self._check_cache.clear()
         for member, message, permission in permission_triplets:
             if isinstance(message.resolution, (PublicResolution, LinearResolution, DynamicResolution)):
-                if not member in self._members:
-                    self._members[member] = []
+                self._add_permission(member, global_time, permission + "^" + message.name, False, proof)
 
-                key = permission + "^" + message.name
+            else:
+                raise NotImplementedError(message.resolution)
 
-                for index, (time, permissions) in zip(count(0), self._members[member]):
-                    # extend when time == global_time
-                    if time == global_time:
-                        if key in permissions:
-                            allowed, proofs = permissions[key]
-                            if allowed:
-                                # TODO: when two authorize contradict each other on the same global
-                                # time, the ordering of the packet will decide the outcome.  we need
-                                # those packets!  [SELECT packet FROM sync WHERE ...]
-                                raise NotImplementedError("Requires ordering by packet to resolve permission conflict")
-
-                            else:
-                                # multiple proofs for the same permissions at this exact time
-                                self._logger.debug("REVOKE time:%d user:%d -> %s (extending duplicate)",
-                                                   global_time, member.database_id, key)
-                                proofs.append(proof)
-
-                        else:
-                            # no earlier proof on this global time
-                            self._logger.debug("REVOKE time:%d user:%d -> %s (extending)",
-                                               global_time, member.database_id, key)
-                            permissions[key] = (False, [proof])
-                        break
-
-                    # insert when time > global_time
-                    elif time > global_time:
-                        # TODO: ensure that INDEX is correct!
-                        self._logger.debug("REVOKE time:%d user:%d -> %s (inserting)",
-                                           global_time, member.database_id, key)
-                        self._members[member].insert(index, (global_time, {key: (False, [proof])}))
-                        break
-
-                    # otherwise: go forward while time < global_time
+        return (True, revoke_proofs)
 
-                else:
-                    # we have reached the end without a BREAK: append the permission
-                    self._logger.debug("REVOKE time:%d user:%d -> %s (appending)",
-                                       global_time, member.database_id, key)
-                    self._members[member].append((global_time, {key: (False, [proof])}))
+    def _add_permission(self, member, global_time, key, allowed, proof):
+        """
+        Grant (ALLOWED is True) or revoke (ALLOWED is False) permission KEY to MEMBER at GLOBAL_TIME.
+        """
+        action = "AUTHORISE" if allowed else "REVOKE"
+        times, permissions = self._members.setdefault(member, {}).setdefault(key, ([], []))
+        index = bisect_left(times, global_time)
+
+        # extend when time == global_time
+        if index < len(times) and times[index] == global_time:
+            if permissions[index][0] == allowed:
+                # multiple proofs for the same permissions at this exact time
+                self._logger.debug("%s time:%d user:%d -> %s (extending duplicate)",
+                                   action, global_time, member.database_id, key)
+                permissions[index][1].append(proof)
 
             else:
-                raise NotImplementedError(message.resolution)
+                # TODO: when two authorize contradict each other on the same global time, the ordering of the
+                # packet will decide the outcome.  we need those packets!  [SELECT packet FROM sync WHERE ...]
+                raise NotImplementedError("Requires ordering by packet to resolve permission conflict")
 
-        return (True, revoke_proofs)
+        else:
+            self._logger.debug("%s time:%d user:%d -> %s (%s)",
+                               action, global_time, member.database_id, key,
+                               "appending" if index == len(times) else "inserting")
+            times.insert(index, global_time)
+            permissions.insert(index, (allowed, [proof]))
 
     def get_resolution_policy(self, message, global_time):
         """
@@ -434,6 +412,7 @@ class Timeline(object):
             if policy_time < global_time and key in policies:
                 self._logger.debug("using %s for time %d (configured at %s)",
                                    policies[key][0].__class__.__name__, global_time, policy_time)
+                self._load_proofs(policies[key][1])
                 return policies[key]
 
         self._logger.debug("using %s for time %d (default)", message.resolution.default.__class__.__name__, global_time)
@@ -454,5 +433,110 @@ class Timeline(object):
             self._policies.append((global_time, policies))
             self._policies.sort()
 
+        self._check_cache.clear()
+
         # TODO it is possible that different members set different policies at the same time
         policies[u"resolution^" + message.name] = (policy, [proof])
+
+    def _load_proofs(self, proofs):
+        """
+        Replaces, in place, the packet ids in PROOFS that were restored from a snapshot with their messages.
+
+        Proofs that can no longer be loaded from the database are removed.
+        """
+        if any(isinstance(proof, (int, long)) for proof in proofs):
+            community = self._community
+            loaded = []
+            for proof in proofs:
+                if isinstance(proof, (int, long)):
+                    try:
+                        packet, = community.dispersy.database.execute(u"SELECT packet FROM sync WHERE id = ?",
+                                                                      (proof,)).next()
+                    except StopIteration:
+                        self._logger.error("proof %d is no longer available", proof)
+                        continue
+
+                    message = community.dispersy.convert_packet_to_message(str(packet), community, verify=False)
+                    if message is None:
+                        self._logger.error("proof %d can not be converted", proof)
+                        continue
+                    message.packet_id = proof
+                    proof = message
+                loaded.append(proof)
+            proofs[:] = loaded
+
+    def get_snapshot(self):
+        """
+        Returns the permissions and policies in this timeline using only builtin types, see load_snapshot.
+
+        Proofs are referred to by their packet id in the sync table.  Permissions and policies that are
+        only based on messages that have not been stored are not part of the snapshot.
+
+        @rtype: tuple
+        """
+        def packet_ids(proofs):
+            return [proof if isinstance(proof, (int, long)) else proof.packet_id
+                    for proof in proofs
+                    if isinstance(proof, (int, long)) or proof.packet_id]
+
+        members = {}
+        for member, dic in self._members.iteritems():
+            keys = {}
+            for key, (times, permissions) in dic.iteritems():
+                snapshot_times = []
+                snapshot_permissions = []
+                for global_time, (allowed, proofs) in zip(times, permissions):
+                    ids = packet_ids(proofs)
+                    if ids:
+                        snapshot_times.append(global_time)
+                        snapshot_permissions.append((allowed, ids))
+                if snapshot_times:
+                    keys[key] = (snapshot_times, snapshot_permissions)
+            if keys:
+                members[member.database_id] = keys
+
+        policies = []
+        for global_time, dic in self._policies:
+            keys = {}
+            for key, (policy, proofs) in dic.iteritems():
+                ids = packet_ids(proofs)
+                if ids:
+                    meta = self._community.get_meta_message(key.split(u"^", 1)[1])
+                    keys[key] = (meta.resolution.policies.index(policy), ids)
+            if keys:
+                policies.append((global_time, keys))
+
+        return (members, policies)
+
+    def load_snapshot(self, snapshot):
+        """
+        Replaces the permissions and policies in this timeline with SNAPSHOT, as returned by get_snapshot.
+
+        The proofs are only loaded from the database once they are required.
+
+        @param snapshot: The timeline snapshot.
+        @type snapshot: tuple
+        """
+        assert isinstance(snapshot, tuple), type(snapshot)
+        assert len(snapshot) == 2, len(snapshot)
+        snapshot_members, snapshot_policies = snapshot
+
+        members = {}
+        for database_id, keys in snapshot_members.iteritems():
+            member = self._community.dispersy.get_member_from_database_id(database_id)
+            if member is None:
+                raise ValueError("unknown member %d in timeline snapshot" % database_id)
+            members[member] = dict((key, (list(times), [(allowed, list(ids)) for allowed, ids in permissions]))
+                                   for key, (times, permissions) in keys.iteritems())
+
+        policies = []
+        for global_time, keys in snapshot_policies:
+            dic = {}
+            for key, (index, ids) in keys.iteritems():
+                meta = self._community.get_meta_message(key.split(u"^", 1)[1])
+                dic[key] = (meta.resolution.policies[index], list(ids))
+            policies.append((global_time, dic))
+
+        self._members = members
+        self._policies = policies
+        self._check_cache.clear()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for decoding dispersy-introduction-request messages, in requests per second on a single core.
+
+Two methods are compared, for requests without and with a sync bloom filter:
+- message: NoDefBinaryConversion.decode_message, creating the Placeholder and Message.Implementation
+- record: NoDefBinaryConversion.decode_introduction_request_record, the fast path used by the tracker
+
+Signatures are not verified unless --verify is given, hence the decoding itself is measured.
+"""
+
+import argparse
+import logging
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from twisted.internet import reactor
+
+# From: http://docs.python.org/2/tutorial/modules.html#intra-package-references
+# Note that both explicit and implicit relative imports are based on the name of the current
+# module. Since the name of the main module is always "__main__", modules intended for use as the
+# main module of a Python application should always use absolute imports.
+from dispersy.bloomfilter import BloomFilter
+from dispersy.candidate import Candidate
+from dispersy.dispersy import Dispersy
+from dispersy.endpoint import NullEndpoint
+from dispersy.tests.debugcommunity.community import DebugCommunity
+
+
+def create_request(community, sync, bits):
+    meta = community.get_meta_message(u"dispersy-introduction-request")
+    global_time = community.global_time
+    if sync:
+        bloom_filter = BloomFilter(bits, 0.01, prefix="x")
+        bloom_filter.add_keys(str(index) for index in xrange(100))
+        sync = (1, global_time, 1, 0, bloom_filter)
+    else:
+        sync = None
+    return meta.impl(authentication=(community.my_member,),
+                     distribution=(global_time,),
+                     destination=(Candidate(("1.2.3.4", 1234), False),),
+                     payload=(("1.2.3.4", 1234), ("10.0.0.1", 6421), ("1.2.3.5", 6421), True, u"public", sync, 42))
+
+
+def benchmark(community, method, packet, count, verify):
+    conversion = community.get_conversion_for_packet(packet)
+    candidate = Candidate(("1.2.3.5", 6421), False)
+
+    start = time()
+    if method == "message":
+        for _ in xrange(count):
+            conversion.decode_message(candidate, packet, verify=verify)
+    else:
+        for _ in xrange(count):
+            conversion.decode_introduction_request_record(candidate, packet, verify=verify)
+    return count / (time() - start)
+
+
+def run(args):
+    try:
+        working_directory = unicode(mkdtemp(prefix="dispersy-introduction-request-"))
+        try:
+            dispersy = Dispersy(NullEndpoint(), working_directory)
+            dispersy.start(autoload_discovery=False)
+            my_member = dispersy.get_new_member(args.key)
+            community = DebugCommunity.create_community(dispersy, my_member)
+
+            print "%-8s %-8s %17s" % ("sync", "method", "requests/second")
+            for sync in (False, True):
+                packet = create_request(community, sync, args.bits).packet
+                for method in ("message", "record"):
+                    rate = max(benchmark(community, method, packet, args.count, args.verify)
+                               for _ in xrange(args.rounds))
+                    print "%-8s %-8s %17.0f" % ("yes" if sync else "no", method, rate)
+
+            dispersy.stop()
+
+        finally:
+            rmtree(working_directory, ignore_errors=True)
+
+    finally:
+        reactor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bits", type=int, default=1024 * 8, help="size of the sync bloom filter in bits")
+    parser.add_argument("--count", type=int, default=5000, help="requests decoded per round")
+    parser.add_argument("--key", default=u"very-low", help="security level of the signing key")
+    parser.add_argument("--rounds", type=int, default=3, help="the best of ROUNDS rounds is reported")
+    parser.add_argument("--verify", action="store_true", help="also verify the signatures")
+    args = parser.parse_args()
+    args.key = unicode(args.key)
+
+    logging.basicConfig(level=logging.WARNING)
+    reactor.callWhenRunning(run, args)
+    reactor.run()
+
+if __name__ == "__main__":
+    main()
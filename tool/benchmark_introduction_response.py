@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for creating dispersy-introduction-response messages, in responses per second on a single core.
+
+Three methods are compared:
+- impl: Message.impl followed by encode_message, the way responses were created before
+- packet: NoDefBinaryConversion.encode_introduction_response_packet
+- reuse: as packet, while reusing the signature of byte-identical responses, i.e. retransmitted requests.  The
+  number of distinct responses is given by --distinct
+"""
+
+import argparse
+import logging
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from twisted.internet import reactor
+
+# From: http://docs.python.org/2/tutorial/modules.html#intra-package-references
+# Note that both explicit and implicit relative imports are based on the name of the current
+# module. Since the name of the main module is always "__main__", modules intended for use as the
+# main module of a Python application should always use absolute imports.
+from dispersy.candidate import Candidate
+from dispersy.dispersy import Dispersy
+from dispersy.endpoint import NullEndpoint
+from dispersy.tests.debugcommunity.community import DebugCommunity
+
+
+def benchmark(community, method, count, distinct):
+    meta = community.get_meta_message(u"dispersy-introduction-response")
+    conversion = community.get_conversion_for_message(meta)
+    member = community.my_member
+    global_time = community.global_time
+    candidate = Candidate(("1.2.3.4", 1234), False)
+
+    start = time()
+    for index in xrange(count):
+        args = (candidate.sock_addr, ("10.0.0.1", 6421), ("1.2.3.5", 6421), ("10.0.0.2", 6421), ("1.2.3.6", 6421),
+                u"public", False, index % distinct)
+        if method == "impl":
+            meta.impl(authentication=(member,), distribution=(global_time,), destination=(candidate,),
+                      payload=args).packet
+        else:
+            conversion.encode_introduction_response_packet(meta, member, global_time, *args,
+                                                           reuse_signature=method == "reuse")
+    return count / (time() - start)
+
+
+def run(args):
+    try:
+        working_directory = unicode(mkdtemp(prefix="dispersy-introduction-response-"))
+        try:
+            dispersy = Dispersy(NullEndpoint(), working_directory)
+            dispersy.start(autoload_discovery=False)
+            my_member = dispersy.get_new_member(args.key)
+            community = DebugCommunity.create_community(dispersy, my_member)
+
+            print "%-8s %18s" % ("method", "responses/second")
+            for method in ("impl", "packet", "reuse"):
+                rate = max(benchmark(community, method, args.count, args.distinct) for _ in xrange(args.rounds))
+                print "%-8s %18.0f" % (method, rate)
+
+            dispersy.stop()
+
+        finally:
+            rmtree(working_directory, ignore_errors=True)
+
+    finally:
+        reactor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=2000, help="responses created per round")
+    parser.add_argument("--distinct", type=int, default=100, help="number of distinct responses for the reuse method")
+    parser.add_argument("--key", default=u"very-low", help="security level of the signing key")
+    parser.add_argument("--rounds", type=int, default=3, help="the best of ROUNDS rounds is reported")
+    args = parser.parse_args()
+    args.key = unicode(args.key)
+
+    logging.basicConfig(level=logging.WARNING)
+    reactor.callWhenRunning(run, args)
+    reactor.run()
+
+if __name__ == "__main__":
+    main()
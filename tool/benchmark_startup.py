@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+Cold-start benchmark for Dispersy.
+
+A database is prepared containing COMMUNITIES communities, each with MESSAGES stored full-sync-text messages and
+PERMISSIONS dispersy-authorize messages.  Afterwards Dispersy is started ROUNDS times on this database and the time
+until all communities are loaded is reported, together with the phases recorded in the DispersyStatistics.startup
+and CommunityStatistics.startup dictionaries.
+"""
+
+import argparse
+import logging
+from collections import defaultdict
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from twisted.internet import reactor
+
+# From: http://docs.python.org/2/tutorial/modules.html#intra-package-references
+# Note that both explicit and implicit relative imports are based on the name of the current
+# module. Since the name of the main module is always "__main__", modules intended for use as the
+# main module of a Python application should always use absolute imports.
+from dispersy.dispersy import Dispersy
+from dispersy.endpoint import NullEndpoint
+from dispersy.tests.debugcommunity.community import DebugCommunity
+
+
+def prepare(working_directory, args):
+    """
+    Creates the communities and messages, returns the mid of the member that created them.
+    """
+    dispersy = Dispersy(NullEndpoint(), working_directory)
+    dispersy.start(autoload_discovery=False)
+    my_member = dispersy.get_new_member(u"low")
+
+    for _ in xrange(args.communities):
+        community = DebugCommunity.create_community(dispersy, my_member)
+
+        meta = community.get_meta_message(u"full-sync-text")
+        messages = [meta.impl(authentication=(my_member,),
+                              distribution=(community.claim_global_time(),),
+                              payload=("benchmark message %d" % index,))
+                    for index in xrange(args.messages)]
+        dispersy.store_update_forward(messages, True, True, False)
+
+        for _ in xrange(args.permissions):
+            member = dispersy.get_new_member(u"very-low")
+            community.create_authorize([(member, meta, u"permit")], forward=False)
+
+    dispersy.stop()
+    return my_member.mid
+
+
+def measure(working_directory, mid, args):
+    """
+    Starts Dispersy, loads all communities, and returns a PHASE:SECONDS dictionary.
+    """
+    phases = {}
+    start = time()
+    dispersy = Dispersy(NullEndpoint(), working_directory)
+    dispersy.start(autoload_discovery=False)
+    phases.update(("start:" + phase, duration) for phase, duration in dispersy.statistics.startup.iteritems())
+
+    my_member = dispersy.get_member(mid=mid)
+    communities = dispersy.define_auto_load(DebugCommunity, my_member, load=True, lazy=args.lazy)
+    phases["ready"] = time() - start
+
+    for master in DebugCommunity.get_master_members(dispersy):
+        dispersy.get_community(master.mid)
+    phases["loaded"] = time() - start
+    assert args.lazy or len(communities) == args.communities, len(communities)
+
+    for community in dispersy.get_communities():
+        for phase, duration in community.statistics.startup.iteritems():
+            phases["initialize:" + phase] = phases.get("initialize:" + phase, 0.0) + duration
+    phases["member_load_duration"] = dispersy.statistics.member_load_duration
+
+    dispersy.stop()
+    return phases
+
+
+def run(args):
+    try:
+        working_directory = unicode(mkdtemp(prefix="dispersy-startup-"))
+        try:
+            start = time()
+            mid = prepare(working_directory, args)
+            print "prepared %d communities with %d messages and %d permissions each in %.2fs" % (
+                args.communities, args.messages, args.permissions, time() - start)
+
+            results = defaultdict(list)
+            for _ in xrange(args.rounds):
+                for phase, duration in measure(working_directory, mid, args).iteritems():
+                    results[phase].append(duration)
+
+            print "%-40s %10s %10s" % ("phase", "best", "average")
+            for phase, durations in sorted(results.iteritems()):
+                print "%-40s %10.3f %10.3f" % (phase, min(durations), sum(durations) / len(durations))
+
+        finally:
+            rmtree(working_directory, ignore_errors=True)
+
+    finally:
+        reactor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--communities", type=int, default=50, help="number of communities")
+    parser.add_argument("--messages", type=int, default=100, help="number of stored messages per community")
+    parser.add_argument("--permissions", type=int, default=10, help="number of dispersy-authorize messages per community")
+    parser.add_argument("--rounds", type=int, default=3, help="number of times Dispersy is started")
+    parser.add_argument("--lazy", action="store_true", help="use lazy community loading")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    reactor.callWhenRunning(run, args)
+    reactor.run()
+
+if __name__ == "__main__":
+    main()
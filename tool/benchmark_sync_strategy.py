@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the sync strategies on synthetic divergence scenarios.
+
+A requester that has COUNT packets syncs with a responder that has DIVERGENCE packets more.  Each round the requester
+sends one sync request of at most BYTES bytes and the responder sends the packets in the requested slice that are
+missing from the request.  A round is repeated until the requester has all packets, or ROUNDS rounds have passed.
+
+The strategies mimic Community._dispersy_claim_sync_bloom_filter_largest (largest), _modulo (modulo),
+_dispersy_claim_sync_reconciliation (reconciliation), and _dispersy_claim_sync_digest (digest), without the database.
+For each strategy the number of rounds, the bytes of all requests, and the CPU seconds are reported.  A digest round is
+answered with the differing ranges instead of packets.
+"""
+
+import argparse
+from math import ceil
+from os import urandom
+from random import Random
+from time import time
+
+# From: http://docs.python.org/2/tutorial/modules.html#intra-package-references
+# Note that both explicit and implicit relative imports are based on the name of the current
+# module. Since the name of the main module is always "__main__", modules intended for use as the
+# main module of a Python application should always use absolute imports.
+from dispersy.bloomfilter import BloomFilter
+from dispersy.community import SYNC_RECONCILIATION_ITEMS, SYNC_RECONCILIATION_MAX_SPLIT
+from dispersy.iblt import InvertibleBloomLookupTable, get_key
+from dispersy.syncdigest import RangeDigests, get_ranges, SYNC_DIGEST_BUCKET_SIZE
+
+ERROR_RATE = 0.01
+
+
+def create_packets(random, count, global_time):
+    # (global_time, packet) tuples
+    return [(random.randint(1, global_time), urandom(100)) for _ in xrange(count)]
+
+
+def strategy_largest(random, local, remote, size, state):
+    bloom = BloomFilter(size * 8, ERROR_RATE, prefix=chr(random.randint(0, 255)))
+    capacity = bloom.get_capacity(ERROR_RATE)
+    ordered = sorted(local)
+    if len(ordered) <= capacity:
+        time_low, time_high, selected = 1, 2 ** 63 - 1, ordered
+    else:
+        start = random.randint(0, len(ordered) - capacity)
+        selected = ordered[start:start + capacity]
+        time_low = selected[0][0] if start else 1
+        time_high = ordered[start + capacity][0] - 1 if start + capacity < len(ordered) else 2 ** 63 - 1
+        selected = [item for item in selected if item[0] <= time_high]
+    bloom.add_keys(packet for _, packet in selected)
+    return bloom.size // 8, list(bloom.not_filter((packet,) for global_time, packet in remote
+                                                  if time_low <= global_time <= time_high))
+
+
+def strategy_modulo(random, local, remote, size, state):
+    bloom = BloomFilter(size * 8, ERROR_RATE, prefix=chr(random.randint(0, 255)))
+    modulo = max(1, int(ceil(len(local) / float(bloom.get_capacity(ERROR_RATE)))))
+    offset = random.randint(0, modulo - 1)
+    bloom.add_keys(packet for global_time, packet in local if (global_time + offset) % modulo == 0)
+    return bloom.size // 8, list(bloom.not_filter((packet,) for global_time, packet in remote
+                                                  if (global_time + offset) % modulo == 0))
+
+
+def strategy_reconciliation(random, local, remote, size, state):
+    table = InvertibleBloomLookupTable(size * 8, prefix=chr(random.randint(0, 255)))
+    modulo = max(1, int(ceil(len(local) / float(SYNC_RECONCILIATION_ITEMS))))
+    split = state.get("split", 0)
+    if state["new"]:
+        if state["new"] < table.get_capacity() // 4:
+            split = max(0, split - 1)
+    elif (state["empty_rounds"] + 1) % (modulo << split) == 0:
+        split = min(split + 1, SYNC_RECONCILIATION_MAX_SPLIT)
+    state["split"] = split
+    modulo <<= split
+    offset = state["rounds"] % modulo
+    table.add_keys(packet for global_time, packet in local if (global_time + offset) % modulo == 0)
+    received = InvertibleBloomLookupTable(table.bytes, table.functions, table.prefix)
+    return len(table.bytes), list(received.not_filter((packet,) for global_time, packet in remote
+                                                      if (global_time + offset) % modulo == 0))
+
+
+def get_digests(packets, ranges):
+    digests = [[0, 0] for _ in ranges]
+    for global_time, packet in packets:
+        for digest, (time_low, time_high) in zip(digests, ranges):
+            if time_low <= global_time <= time_high:
+                digest[0] += 1
+                digest[1] ^= get_key(packet)
+    return [(count, key_xor) for count, key_xor in digests]
+
+
+def strategy_digest(random, local, remote, size, state):
+    differences = state.setdefault("differences", [])
+    if differences:
+        time_low, time_high = differences.pop()
+        bloom = BloomFilter(size * 8, ERROR_RATE, prefix=chr(random.randint(0, 255)))
+        capacity = bloom.get_capacity(ERROR_RATE)
+        selected = [(global_time, packet) for global_time, packet in local if time_low <= global_time <= time_high]
+        # extend the range with the following differing ranges while the bloom filter can hold the packets
+        while len(selected) <= capacity and differences and differences[-1][0] > time_high:
+            extended = [(global_time, packet) for global_time, packet in local
+                        if time_low <= global_time <= differences[-1][1]]
+            if len(extended) > capacity:
+                break
+            time_high = differences.pop()[1]
+            selected = extended
+        if len(selected) <= capacity or time_low // SYNC_DIGEST_BUCKET_SIZE == time_high // SYNC_DIGEST_BUCKET_SIZE:
+            modulo = max(1, int(ceil(len(selected) / float(capacity))))
+            offset = random.randint(0, modulo - 1)
+            bloom.add_keys(packet for global_time, packet in selected if (global_time + offset) % modulo == 0)
+            return bloom.size // 8, list(bloom.not_filter((packet,) for global_time, packet in remote
+                                                          if time_low <= global_time <= time_high and
+                                                          (global_time + offset) % modulo == 0))
+    else:
+        time_low, time_high = 1, max(global_time for global_time, _ in remote)
+
+    ranges = get_ranges(time_low, time_high)
+    digests = RangeDigests(get_digests(local, ranges))
+    # the most recently reported ranges are visited first, as in SyncDigest.on_differences
+    differences.extend(reversed([ranges[index] for index in digests.get_differences(get_digests(remote, ranges))]))
+    return len(digests.bytes), []
+
+
+def benchmark(strategy, seed, count, divergence, size, max_rounds):
+    random = Random(seed)
+    local = create_packets(random, count, count)
+    remote = local + create_packets(random, divergence, count)
+    known = set(packet for _, packet in local)
+
+    start = time()
+    request_bytes = 0
+    # the yield of the previous round, as seen by Community.sync_controller
+    state = dict(rounds=0, new=0, empty_rounds=0)
+    while len(known) < len(remote) and state["rounds"] < max_rounds:
+        length, packets = strategy(random, local, remote, size, state)
+        state["rounds"] += 1
+        request_bytes += length
+        received = set(packet for packet, in packets)
+        new = [(global_time, packet) for global_time, packet in remote if packet in received and packet not in known]
+        state["empty_rounds"] = 0 if state["new"] else state["empty_rounds"] + 1
+        state["new"] = len(new)
+        local.extend(new)
+        known.update(packet for _, packet in new)
+    return state["rounds"], request_bytes, time() - start, len(remote) - len(known)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20000, help="packets that both the requester and responder have")
+    parser.add_argument("--divergence", type=int, nargs="+", default=[10, 50, 250, 1000],
+                        help="packets that only the responder has")
+    parser.add_argument("--bytes", type=int, default=1100, help="maximum size of one sync request")
+    parser.add_argument("--rounds", type=int, default=500, help="maximum number of rounds")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic packets")
+    args = parser.parse_args()
+
+    strategies = (("largest", strategy_largest), ("modulo", strategy_modulo), ("reconciliation", strategy_reconciliation),
+                  ("digest", strategy_digest))
+    print "%-15s %10s %8s %14s %10s %8s" % ("strategy", "divergence", "rounds", "request bytes", "seconds", "missing")
+    for divergence in args.divergence:
+        for name, strategy in strategies:
+            rounds, request_bytes, duration, missing = benchmark(strategy, args.seed, args.count, divergence,
+                                                                 args.bytes, args.rounds)
+            print "%-15s %10d %8d %14d %10.3f %8d" % (name, divergence, rounds, request_bytes, duration, missing)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmark for TaskManager register/cancel throughput.
+
+The DelayedCalls are not scheduled on any reactor, hence only the time spent in the TaskManager itself
+is measured.  Each round registers COUNT DelayedCalls on top of BACKLOG already pending tasks and then
+either cancels them by name or lets them fire.
+"""
+
+import argparse
+from time import time
+
+from twisted.internet.base import DelayedCall
+from twisted.python.threadable import registerAsIOThread
+
+# From: http://docs.python.org/2/tutorial/modules.html#intra-package-references
+# Note that both explicit and implicit relative imports are based on the name of the current
+# module. Since the name of the main module is always "__main__", modules intended for use as the
+# main module of a Python application should always use absolute imports.
+from dispersy.taskmanager import TaskManager
+
+
+def do_nothing():
+    pass
+
+
+def call_later(delay):
+    return DelayedCall(delay, do_nothing, (), {}, lambda dc: None, lambda dc: None)
+
+
+def benchmark(count, backlog, fire):
+    task_manager = TaskManager()
+
+    for index in xrange(backlog):
+        task_manager.register_task(("backlog", index), call_later(3600.0))
+
+    start = time()
+    calls = [task_manager.register_task(index, call_later(1.0)) for index in xrange(count)]
+    if fire:
+        # mimic the reactor running the DelayedCalls
+        for call in calls:
+            call.called = 1
+            call.func(*call.args, **call.kw)
+    else:
+        for index in xrange(count):
+            task_manager.cancel_pending_task(index)
+    duration = time() - start
+
+    assert len(task_manager._pending_tasks) == backlog, len(task_manager._pending_tasks)
+    task_manager.cancel_all_pending_tasks()
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100000, help="tasks registered per round")
+    parser.add_argument("--backlog", type=int, nargs="+", default=[0, 1000, 10000],
+                        help="number of pending tasks that remain registered during a round")
+    parser.add_argument("--rounds", type=int, default=3, help="the best of ROUNDS rounds is reported")
+    args = parser.parse_args()
+
+    # there is no reactor, this thread acts as the reactor thread
+    registerAsIOThread()
+
+    print "%-8s %8s %10s %14s" % ("mode", "backlog", "seconds", "tasks/second")
+    for fire in (False, True):
+        for backlog in args.backlog:
+            duration = min(benchmark(args.count, backlog, fire) for _ in xrange(args.rounds))
+            print "%-8s %8d %10.3f %14.0f" % ("fire" if fire else "cancel", backlog, duration, args.count / duration)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
+from time import time
+
+from ..candidate import WalkCandidate
 from ..community import Community, HardKilledCommunity
 from ..conversion import BinaryConversion
 from ..exception import ConversionNotFoundException
+from ..message import DelayPacket, DropPacket
 
 
 class TrackerHardKilledCommunity(HardKilledCommunity):
@@ -148,6 +152,116 @@ class TrackerCommunity(Community):
 
         return TrackerHardKilledCommunity
 
+    def _on_batch_cache(self, meta, batch):
+        # the fast path is only taken while the introduction request is checked and handled by the default callbacks
+        if (meta.name == u"dispersy-introduction-request" and
+                meta.check_callback == self.check_introduction_request and
+                meta.handle_callback == self.on_introduction_request):
+            batch = self._on_introduction_request_packets(meta, batch)
+            if not batch:
+                return
+        return super(TrackerCommunity, self)._on_batch_cache(meta, batch)
+
+    def _on_introduction_request_packets(self, meta, batch):
+        """
+        Handles the dispersy-introduction-request packets in BATCH without creating Message.Implementation instances.
+
+        The packets are decoded into IntroductionRequestRecord instances, after which the candidates are updated and
+        the dispersy-introduction-response and dispersy-puncture-request packets are sent and the sync part is
+        answered, just like Community.on_introduction_request does.  Returns the part of BATCH that must take the
+        generic path instead, i.e. requests that can not be decoded into records.
+        """
+        records = []
+        remaining = []
+        for item in batch:
+            candidate, packet, conversion, _ = item
+            if not conversion.can_decode_introduction_request_record(meta):
+                remaining.append(item)
+                continue
+
+            try:
+                start = time()
+                record = conversion.decode_introduction_request_record(candidate, packet)
+                self._statistics.record_latency(u"decode", meta.name, time() - start)
+            except DropPacket as drop:
+                self._drop(drop, packet, candidate)
+                continue
+            except DelayPacket as delay:
+                self._dispersy._delay(delay, packet, candidate)
+                continue
+
+            if record.member.mid == self.my_member.mid:
+                self._drop(DropPacket("Received introduction_request from my_member [%s]" % str(candidate)), packet, candidate)
+            else:
+                records.append((record, conversion))
+
+        if records:
+            self._handle_introduction_request_records(meta, records)
+        return remaining
+
+    def _handle_introduction_request_records(self, meta, records):
+        meta_response = self.get_meta_message(u"dispersy-introduction-response")
+        meta_puncture_request = self.get_meta_message(u"dispersy-puncture-request")
+        response_conversion = self.get_conversion_for_message(meta_response)
+        if not response_conversion.can_encode_walker_packets(meta_response, meta_puncture_request):
+            raise RuntimeError("the tracker must be able to encode walker packets")
+
+        dispersy = self._dispersy
+        send_packets = dispersy._send_packets
+        my_member = self.my_member
+        reuse_signature = self.dispersy_enable_response_signature_reuse
+        none = ("0.0.0.0", 0)
+        now = time()
+
+        for record, conversion in records:
+            # direct messages tell us what other people believe is the current global_time, and until we implement a
+            # proper 3-way handshake we are going to assume that the creator is associated to this candidate
+            if isinstance(record.candidate, WalkCandidate):
+                record.candidate.global_time = record.global_time
+            record.candidate.associate(record.member)
+
+            if not dispersy._silent:
+                host, port = record.candidate.sock_addr
+                print "REQ_IN2", self._cid.encode("HEX"), record.member.mid.encode("HEX"), ord(conversion.dispersy_version), ord(conversion.community_version), host, port
+
+            candidate = self.create_or_update_walkcandidate(record.candidate.sock_addr, record.source_lan_address, record.source_wan_address, record.candidate.tunnel, record.connection_type, record.candidate)
+            candidate.stumble(now)
+            dispersy.wan_address_vote(record.destination_address, candidate)
+            self.filter_duplicate_candidate(candidate)
+            record.candidate = candidate
+
+        for record, _ in records:
+            candidate = record.candidate
+            introduced = self.dispersy_get_introduce_candidate(candidate) if record.advice else None
+            global_time = self.global_time
+
+            if introduced:
+                response = response_conversion.encode_introduction_response_packet(
+                    meta_response, my_member, global_time, candidate.sock_addr, dispersy._lan_address,
+                    dispersy._wan_address, introduced.lan_address, introduced.wan_address, dispersy._connection_type,
+                    introduced.tunnel, record.identifier, reuse_signature=reuse_signature)
+                send_packets([candidate], [response], self, meta_response.name)
+
+                puncture_request = response_conversion.encode_puncture_request_packet(
+                    meta_puncture_request, global_time, record.source_lan_address, record.source_wan_address,
+                    record.identifier)
+                send_packets([introduced], [puncture_request], self, meta_puncture_request.name)
+
+            else:
+                response = response_conversion.encode_introduction_response_packet(
+                    meta_response, my_member, global_time, candidate.sock_addr, dispersy._lan_address,
+                    dispersy._wan_address, none, none, dispersy._connection_type, False, record.identifier,
+                    reuse_signature=reuse_signature)
+                send_packets([candidate], [response], self, meta_response.name)
+
+        self._statistics.increase_msg_count(u"success", meta.name, len(records))
+        dispersy._statistics.incoming_intro_count += len(records)
+        for record, _ in records:
+            self._statistics.increase_msg_count(u"incoming_intro", record.candidate.sock_addr)
+            dispersy._statistics.dict_inc(u"incoming_intro_dict", record.candidate.sock_addr)
+
+        self._on_sync_requests([(record.candidate,) + record.sync for record, _ in records if record.sync])
+
     def on_introduction_request(self, messages):
         if not self._dispersy._silent:
             hex_cid = self.cid.encode("HEX")
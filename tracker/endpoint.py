@@ -0,0 +1,162 @@
+"""
+Endpoint used when the tracker runs as multiple worker processes.
+
+All workers bind the same UDP port using SO_REUSEPORT, the kernel distributes the incoming packets over the workers
+based on their source address.  The communities are sharded over the workers based on their cid, a packet for a
+community that is owned by another worker is forwarded to that worker over the loopback interface, prefixed with its
+original source address.  The owning worker responds from its own socket, which is bound to the same shared port.
+"""
+import errno
+import socket
+import threading
+from select import select
+from socket import inet_aton, inet_ntoa
+from struct import Struct
+
+from ..endpoint import StandaloneEndpoint, TUNNEL_PREFIX, TUNNEL_PREFIX_LENGHT
+
+_struct_L = Struct(">L")
+# the original source address that prefixes a forwarded packet
+_struct_address = Struct(">4sH")
+
+
+def get_shard(cid, shards):
+    """
+    Returns the index of the worker that owns the community CID when there are SHARDS workers.
+    """
+    assert isinstance(cid, str), type(cid)
+    assert len(cid) == 20, len(cid)
+    assert isinstance(shards, int), type(shards)
+    assert shards > 0, shards
+    return _struct_L.unpack_from(cid)[0] % shards
+
+
+def get_packet_cid(data):
+    """
+    Returns the cid of the, possibly tunnelled, packet DATA or None when DATA is too short.
+    """
+    offset = TUNNEL_PREFIX_LENGHT if data.startswith(TUNNEL_PREFIX) else 0
+    if len(data) < offset + 22:
+        return None
+    return data[offset + 2:offset + 22]
+
+
+def encode_forwarded_packet(sock_addr, data):
+    return _struct_address.pack(inet_aton(sock_addr[0]), sock_addr[1]) + data
+
+
+def decode_forwarded_packet(data):
+    """
+    Returns the (sock_addr, data) tuple encoded by encode_forwarded_packet, or None when DATA is invalid.
+    """
+    if len(data) <= _struct_address.size:
+        return None
+    ip, port = _struct_address.unpack_from(data)
+    return (inet_ntoa(ip), port), data[_struct_address.size:]
+
+
+class ShardedEndpoint(StandaloneEndpoint):
+
+    """
+    StandaloneEndpoint for worker SHARD out of SHARDS workers that share PORT.
+
+    Worker i receives the packets forwarded by the other workers at 127.0.0.1:SHARD_PORT+i.
+    """
+
+    def __init__(self, port, ip, shard, shards, shard_port):
+        assert isinstance(shard, int), type(shard)
+        assert isinstance(shards, int), type(shards)
+        assert 0 <= shard < shards, (shard, shards)
+        assert isinstance(shard_port, int), type(shard_port)
+        super(ShardedEndpoint, self).__init__(port, ip, reuse_port=True)
+
+        self._shard = shard
+        self._shards = shards
+        self._shard_port = shard_port
+
+        # _SHARD_SOCKET and _SHARD_THREAD are set during open(...)
+        self._shard_socket = None
+        self._shard_thread = None
+
+    @property
+    def shard(self):
+        return self._shard
+
+    @property
+    def shards(self):
+        return self._shards
+
+    def open(self, dispersy):
+        self._shard_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._shard_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 870400)
+        self._shard_socket.bind(("127.0.0.1", self._shard_port + self._shard))
+        self._shard_socket.setblocking(0)
+
+        result = super(ShardedEndpoint, self).open(dispersy)
+
+        self._shard_thread = threading.Thread(name="ShardedEndpoint", target=self._shard_loop)
+        self._shard_thread.daemon = True
+        self._shard_thread.start()
+        return result
+
+    def close(self, timeout=10.0):
+        result = super(ShardedEndpoint, self).close(timeout)
+
+        if timeout > 0.0:
+            self._shard_thread.join(timeout)
+            if self._shard_thread.is_alive():
+                self._logger.error("the shard thread is still running (after waiting %f seconds)", timeout)
+                result = False
+
+        try:
+            self._shard_socket.close()
+        except socket.error as exception:
+            self._logger.exception("%s", exception)
+            result = False
+
+        return result
+
+    def data_came_in(self, packets, cache=True):
+        local_packets = []
+        for sock_addr, data in packets:
+            cid = get_packet_cid(data)
+            shard = self._shard if cid is None else get_shard(cid, self._shards)
+            if shard == self._shard:
+                local_packets.append((sock_addr, data))
+
+            else:
+                try:
+                    self._shard_socket.sendto(encode_forwarded_packet(sock_addr, data),
+                                              ("127.0.0.1", self._shard_port + shard))
+                except socket.error:
+                    self._dispersy.statistics.dict_inc(u"endpoint_send", u"shard-forward-error")
+
+        if local_packets:
+            super(ShardedEndpoint, self).data_came_in(local_packets, cache)
+
+    def _shard_loop(self):
+        assert self._dispersy, "Should not be called before open(...)"
+        recvfrom = self._shard_socket.recvfrom
+        socket_list = [self._shard_socket.fileno()]
+        shard_ports = xrange(self._shard_port, self._shard_port + self._shards)
+
+        while self._running:
+            read_list, _, _ = select(socket_list, [], [], 0.1)
+            if read_list:
+                packets = []
+                try:
+                    while True:
+                        (data, sock_addr) = recvfrom(65535)
+                        # only the other workers may forward packets
+                        if sock_addr[0] == "127.0.0.1" and sock_addr[1] in shard_ports:
+                            packet = decode_forwarded_packet(data)
+                            if packet:
+                                packets.append(packet)
+
+                except socket.error as e:
+                    if e.errno != errno.EAGAIN:
+                        self._dispersy.statistics.dict_inc(u"endpoint_recv", u"socket-error-'%s'" % repr(e))
+
+                finally:
+                    if packets:
+                        super(ShardedEndpoint, self).data_came_in(packets)
@@ -0,0 +1,76 @@
+"""
+Metrics of the tracker in the Prometheus text exposition format, served at /metrics when the tracker runs with
+--metrics.
+
+The metrics are given as a list with (NAME, TYPE, HELP, [(LABELS, VALUE), ...]) tuples, see
+TrackerDispersy.get_metrics.
+"""
+from math import isinf, isnan
+
+from twisted.web.resource import Resource
+
+
+def _escape_label_value(value):
+    return unicode(value).replace(u"\\", u"\\\\").replace(u"\"", u"\\\"").replace(u"\n", u"\\n")
+
+
+def _format_value(value):
+    # repr gives the shortest exact float, while longs must not get their L suffix
+    if isinstance(value, float):
+        if isnan(value):
+            return u"NaN"
+        if isinf(value):
+            return u"+Inf" if value > 0 else u"-Inf"
+        return unicode(repr(value))
+    return unicode(value)
+
+
+def add_worker_label(metrics, worker):
+    """
+    Returns METRICS with a worker label added to every sample.
+    """
+    worker = str(worker)
+    return [(name, metric_type, description, [(dict(labels, worker=worker), value) for labels, value in samples])
+            for name, metric_type, description, samples in metrics]
+
+
+def format_metrics(metrics):
+    """
+    Returns METRICS, as returned by TrackerDispersy.get_metrics, in the Prometheus text exposition format.
+    """
+    lines = []
+    for name, metric_type, description, samples in metrics:
+        lines.append(u"# HELP %s %s" % (name, description.replace(u"\\", u"\\\\").replace(u"\n", u"\\n")))
+        lines.append(u"# TYPE %s %s" % (name, metric_type))
+        for labels, value in samples:
+            if labels:
+                lines.append(u"%s{%s} %s" % (name,
+                                             u",".join(u'%s="%s"' % (key, _escape_label_value(label))
+                                                      for key, label in sorted(labels.iteritems())),
+                                             _format_value(value)))
+            else:
+                lines.append(u"%s %s" % (name, _format_value(value)))
+    lines.append(u"")
+    return u"\n".join(lines).encode("UTF-8")
+
+
+class MetricsResource(Resource):
+
+    """
+    Serves the metrics of the running tracker, CONTAINER[0], at /metrics.
+    """
+
+    isLeaf = True
+
+    def __init__(self, container):
+        Resource.__init__(self)
+        self._container = container
+
+    def render_GET(self, request):
+        dispersy = self._container[0]
+        if request.postpath != ["metrics"] or dispersy is None:
+            request.setResponseCode(404)
+            return ""
+
+        request.setHeader("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        return format_metrics(dispersy.get_metrics())
@@ -17,11 +17,22 @@ Outputs destroyed communities whenever notified by a candidate:
 
 Note that there is no output for REQ_IN2 for destroyed overlays.  Instead a DESTROY_OUT is given
 whenever a introduction request is received for a destroyed overlay.
+
+Optionally serves metrics in the Prometheus text format at http://127.0.0.1:PORT/metrics, see --metrics.  The
+dispersy_messages_per_meta_total series is only served while the debug statistics are enabled, which is the default
+unless Python runs with -O.
+
+Optionally runs as multiple worker processes that share the UDP port, see --workers.  Each worker owns the
+communities whose cid maps to it, see dispersy.tracker.endpoint, and writes the destroyed communities to its own
+persistent-storage-WORKER.data file.  Worker i serves its metrics at the --metrics port plus i, labelled with
+worker="i".
 """
 import errno
+import glob
 import os
 import signal
 import sys
+from collections import defaultdict
 from time import time
 
 from dispersy.candidate import LoopbackCandidate
@@ -31,9 +42,14 @@ from dispersy.dispersy import Dispersy
 from dispersy.endpoint import StandaloneEndpoint
 from dispersy.exception import CommunityNotFoundException
 from dispersy.tracker.community import TrackerCommunity, TrackerHardKilledCommunity
+from dispersy.tracker.endpoint import ShardedEndpoint, get_shard
+from dispersy.tracker.metrics import MetricsResource, add_worker_label
+from twisted.application.internet import TCPServer
 from twisted.application.service import IServiceMaker, MultiService
 from twisted.conch import manhole_tap
 from twisted.internet import reactor
+from twisted.internet.error import ProcessExitedAlready
+from twisted.internet.protocol import ProcessProtocol
 from twisted.internet.task import LoopingCall
 from twisted.logger import globalLogPublisher
 from twisted.plugin import IPlugin
@@ -41,11 +57,15 @@ from twisted.python import usage
 from twisted.python.log import msg, ILogObserver, PythonLoggingObserver, FileLogObserver
 from twisted.python.logfile import DailyLogFile
 from twisted.python.threadable import isInIOThread
+from twisted.web.server import Site
 from zope.interface import implements
 
 from tool.clean_observers import clean_twisted_observers
 
 COMMUNITY_CLEANUP_INTERVAL = 180.0
+# seconds between counting the communities and their candidates for the metrics endpoint, scrapes never walk the
+# communities themselves
+COMMUNITY_METRICS_INTERVAL = 60.0
 
 if sys.platform == 'win32':
     SOCKET_BLOCK_ERRORCODE = 10035  # WSAEWOULDBLOCK
@@ -58,14 +78,28 @@ clean_twisted_observers()
 
 class TrackerDispersy(Dispersy):
 
-    def __init__(self, endpoint, working_directory, silent=False, crypto=NoVerifyCrypto()):
+    def __init__(self, endpoint, working_directory, silent=False, crypto=NoVerifyCrypto(), metrics=False):
         super(TrackerDispersy, self).__init__(endpoint, working_directory, u":memory:", crypto)
 
-        # location of persistent storage
-        self._persistent_storage_filename = os.path.join(working_directory, "persistent-storage.data")
+        # the worker index and the number of workers, a ShardedEndpoint only delivers packets for our own shard
+        if isinstance(endpoint, ShardedEndpoint):
+            self._shard, self._shards = endpoint.shard, endpoint.shards
+        else:
+            self._shard, self._shards = 0, 1
+
+        # location of persistent storage, every worker appends to its own file
+        if self._shards > 1:
+            self._persistent_storage_filename = os.path.join(working_directory,
+                                                             "persistent-storage-%d.data" % self._shard)
+        else:
+            self._persistent_storage_filename = os.path.join(working_directory, "persistent-storage.data")
         self._silent = silent
+        self._metrics = metrics
         self._my_member = None
 
+        # COMMUNITY-TYPE:[COUNT(OVERLAYS), COUNT(VERIFIED_CANDIDATES)] as counted by _update_community_counts
+        self._community_counts = {}
+
     def start(self):
         assert isInIOThread()
         if super(TrackerDispersy, self).start():
@@ -82,6 +116,10 @@ class TrackerDispersy(Dispersy):
                 self._statistics_looping_call = LoopingCall(self._report_statistics)
                 self._statistics_looping_call.start(300)
 
+            if self._metrics:
+                self.register_task("update community counts",
+                                   LoopingCall(self._update_community_counts)).start(COMMUNITY_METRICS_INTERVAL)
+
             return True
         return False
 
@@ -101,20 +139,25 @@ class TrackerDispersy(Dispersy):
             return TrackerCommunity.init_community(self, self.get_member(mid=cid), self._my_member)
 
     def _load_persistent_storage(self):
-        # load all destroyed communities
-        try:
-            packets = [pkt.decode("HEX") for _, pkt in (line.split() for
-                                                        line in open(self._persistent_storage_filename, "r") if not
-                                                        line.startswith("#"))]
-        except IOError:
-            pass
-        else:
+        # load all destroyed communities, regardless of the number of workers that wrote them
+        directory = os.path.dirname(self._persistent_storage_filename)
+        for filename in sorted(glob.glob(os.path.join(directory, "persistent-storage*.data"))):
+            try:
+                packets = [pkt.decode("HEX") for _, pkt in (line.split() for
+                                                            line in open(filename, "r") if not
+                                                            line.startswith("#"))]
+            except IOError:
+                continue
+
+            if self._shards > 1:
+                packets = [pkt for pkt in packets if len(pkt) >= 22 and get_shard(pkt[2:22], self._shards) == self._shard]
+
             candidate = LoopbackCandidate()
             for pkt in reversed(packets):
                 try:
                     self.on_incoming_packets([(candidate, pkt)], cache=False, timestamp=time())
                 except:
-                    self._logger.exception("Error while loading from persistent-destroy-community.data")
+                    self._logger.exception("Error while loading from %s", filename)
 
     def unload_inactive_communities(self):
         def is_active(community, now):
@@ -134,11 +177,75 @@ class TrackerDispersy(Dispersy):
         for community in inactive:
             community.unload_community()
 
-    def _report_statistics(self):
+    def _update_community_counts(self):
         mapping = {TrackerCommunity: [0,0], TrackerHardKilledCommunity: [0,0], DiscoveryCommunity: [0,0]}
         for community in self._communities.itervalues():
-            mapping[type(community)][0] += 1
-            mapping[type(community)][1] += len(list(community.dispersy_yield_verified_candidates())) 
+            counts = mapping.setdefault(type(community), [0, 0])
+            counts[0] += 1
+            counts[1] += len(list(community.dispersy_yield_verified_candidates()))
+        self._community_counts = mapping
+        return mapping
+
+    def get_metrics(self):
+        """
+        Returns the metrics as a list with (NAME, TYPE, HELP, [(LABELS, VALUE), ...]) tuples.
+
+        Only counters that are already maintained are read, the community and candidate counts are those of the most
+        recent _update_community_counts call.
+        """
+        statistics = self._statistics
+        msg_statistics = statistics.msg_statistics
+
+        metrics = [("dispersy_uptime_seconds", "gauge", "Seconds since the statistics were reset",
+                    [({}, time() - statistics.start)]),
+                   ("dispersy_bytes_up_total", "counter", "Bytes sent by the endpoint",
+                    [({}, statistics.total_up)]),
+                   ("dispersy_bytes_down_total", "counter", "Bytes received by the endpoint",
+                    [({}, statistics.total_down)]),
+                   ("dispersy_packets_sent_total", "counter", "Packets sent by the endpoint",
+                    [({}, statistics.total_send)]),
+                   ("dispersy_packets_received_total", "counter", "Packets received by the endpoint",
+                    [({}, statistics.total_received)]),
+                   ("dispersy_sendqueue", "gauge", "Packets waiting in the endpoint sendqueue",
+                    [({}, statistics.cur_sendqueue)]),
+                   ("dispersy_candidates_discovered_total", "counter", "Candidates introduced or stumbled upon",
+                    [({}, statistics.total_candidates_discovered)]),
+                   ("dispersy_walk_total", "counter", "Outgoing walk attempts by result",
+                    [({"result": "attempt"}, statistics.walk_attempt_count),
+                     ({"result": "success"}, statistics.walk_success_count),
+                     ({"result": "failure"}, statistics.walk_failure_count)]),
+                   ("dispersy_introductions_total", "counter", "Introduction requests by direction",
+                    [({"direction": "incoming"}, statistics.incoming_intro_count),
+                     ({"direction": "outgoing"}, statistics.outgoing_intro_count)])]
+
+        messages = [({"category": category}, getattr(msg_statistics, "%s_count" % category))
+                    for category in ("success", "drop", "created", "outgoing")]
+        metrics.append(("dispersy_messages_total", "counter", "Messages by category", messages))
+
+        # only available when the debug statistics are enabled, they are disabled when Python runs with -O
+        per_meta = []
+        for category in ("success", "drop", "created", "outgoing"):
+            counts = getattr(msg_statistics, "%s_dict" % category)
+            if counts:
+                per_meta.extend(({"category": category, "meta": name}, value) for name, value in counts.iteritems())
+        if per_meta:
+            metrics.append(("dispersy_messages_per_meta_total", "counter", "Messages by category and meta message",
+                            per_meta))
+
+        community_counts = sorted((community_type.__name__, counts)
+                                  for community_type, counts in self._community_counts.iteritems())
+        metrics.append(("dispersy_communities", "gauge", "Loaded overlays by community type",
+                        [({"type": name}, counts[0]) for name, counts in community_counts]))
+        metrics.append(("dispersy_verified_candidates", "gauge", "Verified candidates by community type",
+                        [({"type": name}, counts[1]) for name, counts in community_counts]))
+
+        # the workers are scraped separately, the worker label allows aggregating them
+        if self._shards > 1:
+            metrics = add_worker_label(metrics, self._shard)
+        return metrics
+
+    def _report_statistics(self):
+        mapping = defaultdict(lambda: [0, 0], self._update_community_counts())
 
         print "BANDWIDTH", self._statistics.total_up, self._statistics.total_down
         print "COMMUNITY", mapping[TrackerCommunity][0], mapping[TrackerHardKilledCommunity][0], mapping[DiscoveryCommunity][0]
@@ -162,8 +269,59 @@ class Options(usage.Options):
         ["crypto"  , "c", "ECCrypto",     "The Crypto object type Dispersy is going to use"              , str],
         ["manhole" , "m", 0         ,     "Enable manhole telnet service listening at the specified port", int],
         ["logfile" , "l", "dispersy.log", "Use an alternate dispersy log file name",                       str],
+        ["metrics" , "M", 0         ,     "Serve metrics at http://127.0.0.1:PORT/metrics, the per meta message series need the debug statistics (not with python -O)", int],
+        ["workers" , "w", 1         ,     "Number of worker processes sharing the UDP port"              , int],
+        ["worker-port" , None, 0    ,     "Worker i receives forwarded packets at 127.0.0.1:WORKER-PORT+i, defaults to PORT+1", int],
+        ["worker-index", None, 0    ,     "Used internally to start the additional worker processes"    , int],
     ]
 
+    def postOptions(self):
+        if self["workers"] < 1:
+            raise usage.UsageError("--workers must be at least 1")
+        if not 0 <= self["worker-index"] < self["workers"]:
+            raise usage.UsageError("--worker-index must be smaller than --workers")
+        if self["workers"] > 1 and not self["port"]:
+            raise usage.UsageError("--workers requires a fixed --port")
+        if not self["worker-port"]:
+            self["worker-port"] = self["port"] + 1
+
+
+class WorkerProcessProtocol(ProcessProtocol):
+
+    def __init__(self, index):
+        self._index = index
+
+    def processEnded(self, reason):
+        msg("Tracker worker %d ended: %s" % (self._index, reason.getErrorMessage()))
+
+
+def spawn_workers(options):
+    """
+    Starts the worker processes 1 up to options["workers"], the calling process is worker 0.
+    """
+    processes = []
+    logfile, extension = os.path.splitext(options["logfile"])
+    for index in xrange(1, options["workers"]):
+        args = [sys.executable, "-c", "from twisted.scripts.twistd import run; run()",
+                "--nodaemon", "--pidfile=", "tracker",
+                "--statedir", options["statedir"],
+                "--ip", options["ip"],
+                "--port", str(options["port"]),
+                "--crypto", options["crypto"],
+                "--logfile", "%s-%d%s" % (logfile, index, extension),
+                "--workers", str(options["workers"]),
+                "--worker-port", str(options["worker-port"]),
+                "--worker-index", str(index)]
+        if options["silent"]:
+            args.append("--silent")
+        if options["metrics"]:
+            args.extend(("--metrics", str(options["metrics"] + index)))
+
+        # the workers share our stdout and stderr
+        processes.append(reactor.spawnProcess(WorkerProcessProtocol(index), sys.executable, args, env=os.environ,
+                                              childFDs={0: "w", 1: 1, 2: 2}))
+    return processes
+
 
 class TrackerMultiService(MultiService):
 
@@ -212,21 +370,39 @@ class TrackerServiceMaker(object):
             tracker_service.addService(manhole)
             manhole.startService()
 
+        if options["metrics"]:
+            metrics = TCPServer(options["metrics"], Site(MetricsResource(container)), interface="127.0.0.1")
+            tracker_service.addService(metrics)
+
         def run():
             # setup
-            dispersy = TrackerDispersy(StandaloneEndpoint(options["port"],
-                                                          options["ip"]),
+            if options["workers"] > 1:
+                endpoint = ShardedEndpoint(options["port"], options["ip"], options["worker-index"],
+                                           options["workers"], options["worker-port"])
+            else:
+                endpoint = StandaloneEndpoint(options["port"], options["ip"])
+
+            dispersy = TrackerDispersy(endpoint,
                                        unicode(options["statedir"]),
                                        bool(options["silent"]),
-                                       crypto)
+                                       crypto,
+                                       bool(options["metrics"]))
             container[0] = dispersy
             manhole_namespace['dispersy'] = dispersy
 
+            # only the first worker starts the others
+            workers = spawn_workers(options) if options["worker-index"] == 0 else []
+
             self._stopping=False
             def signal_handler(sig, frame):
                 msg("Received signal '%s' in %s (shutting down)" % (sig, frame))
                 if not self._stopping:
                     self._stopping = True
+                    for worker in workers:
+                        try:
+                            worker.signalProcess("TERM")
+                        except ProcessExitedAlready:
+                            pass
                     try:
                         dispersy.stop()
                     except Exception, e:
@@ -4,12 +4,15 @@ import logging
 import sys
 import traceback
 import warnings
+from collections import OrderedDict
 from cProfile import Profile
+from random import random
 from socket import inet_aton, error as socket_error
 from thread import get_ident
 from threading import current_thread
 from time import time
 from socket import inet_aton, socket, AF_INET, SOCK_DGRAM
+from string import Formatter
 from struct import unpack_from
 
 from twisted.internet import reactor, defer
@@ -25,6 +28,12 @@ logger = logging.getLogger(__name__)
 
 MEMORY_DUMP_INTERVAL = float(60 * 60)
 
+# maximum number of distinct field values for which attach_runtime_statistics caches the formatted key
+RUNTIME_STATISTICS_KEY_CACHE_SIZE = 1024
+
+# fraction of the calls that attach_runtime_statistics measures, see set_runtime_statistics_sample_rate
+_runtime_statistics_sample_rate = 1.0
+
 
 #
 # Various decorators
@@ -110,6 +119,34 @@ else:
         return func
 
 
+def set_runtime_statistics_sample_rate(rate):
+    """
+    Only measure a random RATE fraction of the calls to functions decorated with attach_runtime_statistics.
+
+    The count, duration, and histogram are scaled to estimate the totals of all calls.
+    """
+    assert isinstance(rate, float), type(rate)
+    assert 0.0 < rate <= 1.0, rate
+    global _runtime_statistics_sample_rate
+    _runtime_statistics_sample_rate = rate
+
+
+def _compile_runtime_statistics_format(format_):
+    """
+    Returns a list with (first, rest) tuples for each replacement field in FORMAT_, where FIRST is the argument
+    index or keyword and REST is a list with (is_attribute, key) tuples, or None when FORMAT_ can not be compiled.
+    """
+    fields = []
+    for _, field_name, _, _ in Formatter().parse(format_):
+        if field_name is not None:
+            first, rest = field_name._formatter_field_name_split()
+            if first == u"":
+                # automatic field numbering
+                return None
+            fields.append((first, list(rest)))
+    return fields
+
+
 def attach_runtime_statistics(format_):
     """
     Keep track of how often and how long a function was called.
@@ -135,15 +172,70 @@ def attach_runtime_statistics(format_):
     - 'foo bar=1 moo=milk returns=41' was called once
     - 'foo bar=2 moo=milk returns=42' was called twice
 
+    The key is only formatted once for each distinct combination of field values, the
+    RUNTIME_STATISTICS_KEY_CACHE_SIZE most recently used combinations are cached per decorated function.  See
+    set_runtime_statistics_sample_rate to only measure a fraction of the calls.
+
     Updated runtime information is available from Dispersy.statistics.runtime after calling
     Dispersy.statistics.update().  Statistics.runtime is a list (in no particular order) containing
-    dictionaries with the keys: count, duration, average, and entry.
+    dictionaries with the keys: count, duration, average, histogram, and entry.
     """
     assert isinstance(format_, basestring), type(format_)
+    fields = _compile_runtime_statistics_format(format_)
 
     def helper(func):
+        function_name = func.__name__
+
+        if fields is not None and all(first == u"function_name" and not rest for first, rest in fields):
+            # the key never changes
+            constant_entry = format_.format(function_name=function_name)
+        else:
+            constant_entry = None
+
+        # VALUES:ENTRY pairs in least recently used order, where VALUES is a tuple with the value that
+        # each field reads, e.g. the message name or the SQL statement rather than the whole argument
+        entries = OrderedDict()
+
+        def get_entry(return_value, args, kargs):
+            if fields is not None:
+                values = []
+                for first, rest in fields:
+                    if first == u"function_name":
+                        value = function_name
+                    elif first == u"return_value":
+                        value = return_value
+                    elif isinstance(first, (int, long)):
+                        value = args[first]
+                    else:
+                        value = kargs[first]
+                    for is_attribute, key in rest:
+                        value = getattr(value, key) if is_attribute else value[key]
+                    values.append(value)
+                values = tuple(values)
+
+                try:
+                    entry = entries.pop(values)
+
+                except KeyError:
+                    entry = format_.format(function_name=function_name, return_value=return_value, *args, **kargs)
+                    if len(entries) >= RUNTIME_STATISTICS_KEY_CACHE_SIZE:
+                        entries.popitem(False)
+
+                except TypeError:
+                    # unhashable values are not cached
+                    return format_.format(function_name=function_name, return_value=return_value, *args, **kargs)
+
+                entries[values] = entry
+                return entry
+
+            return format_.format(function_name=function_name, return_value=return_value, *args, **kargs)
+
         @functools.wraps(func)
         def wrapper(*args, **kargs):
+            rate = _runtime_statistics_sample_rate
+            if rate < 1.0 and random() >= rate:
+                return func(*args, **kargs)
+
             return_value = None
             start = time()
             try:
@@ -151,8 +243,8 @@ def attach_runtime_statistics(format_):
                 return return_value
             finally:
                 end = time()
-                entry = format_.format(function_name=func.__name__, return_value=return_value, *args, **kargs)
-                _runtime_statistics[entry].increment(end - start)
+                entry = constant_entry or get_entry(return_value, args, kargs)
+                _runtime_statistics[entry].increment(end - start, 1.0 / rate if rate < 1.0 else 1)
         return wrapper
     return helper
 
@@ -177,6 +269,56 @@ class deprecated(object):
         return wrapper_func
 
 
+class TokenBucket(object):
+
+    """
+    Allows on average RATE events per second, with bursts of at most BURST events.
+    """
+
+    __slots__ = ["rate", "burst", "_tokens", "_timestamp"]
+
+    def __init__(self, rate, burst, now):
+        assert isinstance(rate, float), type(rate)
+        assert rate > 0.0, rate
+        assert isinstance(burst, int), type(burst)
+        assert burst > 0, burst
+        assert isinstance(now, float), type(now)
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._timestamp = now
+
+    def take(self, count, now):
+        """
+        Takes at most COUNT tokens and returns the number of tokens that were taken.
+        """
+        tokens = min(float(self.burst), self._tokens + (now - self._timestamp) * self.rate)
+        taken = min(count, int(tokens))
+        self._tokens = tokens - taken
+        self._timestamp = now
+        return taken
+
+    def take_all(self, count, now):
+        """
+        Takes COUNT tokens when they are all available.  Returns True when they were taken, otherwise no tokens are
+        taken and False is returned.
+        """
+        tokens = min(float(self.burst), self._tokens + (now - self._timestamp) * self.rate)
+        self._timestamp = now
+        if tokens < count:
+            self._tokens = tokens
+            return False
+        self._tokens = tokens - count
+        return True
+
+    def get_delay(self, count, now):
+        """
+        Returns the number of seconds until COUNT tokens are available.
+        """
+        tokens = min(float(self.burst), self._tokens + (now - self._timestamp) * self.rate)
+        return max(0.0, (count - tokens) / self.rate)
+
+
 #
 # General Instrumentation stuff
 #